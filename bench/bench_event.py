@@ -0,0 +1,72 @@
+# Copyright 2013 Michael Frank <msfrank@syntaxjockey.com>
+#
+# This file is part of Terane.
+#
+# Terane is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Terane is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Terane.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Compare the memory footprint and throughput of Event and CompactEvent.
+
+usage: python bench/bench_event.py [COUNT]
+"""
+
+import sys, time
+from terane.event import Event, CompactEvent, FieldIdentifier
+
+def makevalues():
+    return {
+        Event.MESSAGE: u"sshd[1234]: Accepted publickey for root from 10.0.0.1",
+        Event.TIMESTAMP: time.time() * 1000.0,
+        Event.ORIGIN: "host.example.com",
+        FieldIdentifier('appname', FieldIdentifier.LITERAL): u"sshd",
+        FieldIdentifier('procid', FieldIdentifier.LITERAL): u"1234",
+        FieldIdentifier('bytes', FieldIdentifier.INTEGER): "4096",
+        FieldIdentifier('latency', FieldIdentifier.FLOAT): "0.25",
+    }
+
+def footprint(event):
+    """
+    Return the bytes used by the event container itself, excluding the
+    field values which are shared by both implementations.
+    """
+    size = sys.getsizeof(event)
+    if isinstance(event, CompactEvent):
+        for container in (event._values, event._unparsed):
+            if container is not None:
+                size += sys.getsizeof(container)
+    else:
+        size += sys.getsizeof(event.__dict__) + sys.getsizeof(event._values)
+    return size
+
+def throughput(cls, values, count):
+    """
+    Construct count events and read the fields a typical sink reads.
+    """
+    start = time.time()
+    for i in xrange(count):
+        event = cls(Event.EMPTY_ID, values)
+        event.message()
+        event.timestamp()
+        event.origin()
+    return count / (time.time() - start)
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    values = makevalues()
+    for cls in (Event, CompactEvent):
+        print "%-14s %6i bytes/event %10.0f events/sec" % (cls.__name__,
+            footprint(cls(Event.EMPTY_ID, values)), throughput(cls, values, count))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+# Copyright 2013 Michael Frank <msfrank@syntaxjockey.com>
+#
+# This file is part of Terane.
+#
+# Terane is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Terane is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Terane.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Compare the messages per second parsed by terane-relay using the loggerglue
+pyparsing grammar and using the hand-written parser.
+
+usage: python bench/bench_relay_parser.py [COUNT]
+"""
+
+import sys, time
+from terane.event import Event, FieldIdentifier
+from terane.sinks.syslog import SyslogSink, SchemaTracker
+from terane.toolbox.relay.rfc5424 import RFC5424Parser
+from terane.toolbox.relay.pipeline import makeevent
+
+def makemessages(count):
+    """
+    Return count messages as sent by a terane syslog sink, describing each
+    field once, plus a few plain messages from a typical syslog daemon.
+    """
+    sink = SyslogSink()
+    tracker = SchemaTracker(sink._schemaparams)
+    messages = list()
+    for i in xrange(count):
+        if i % 4 == 0:
+            messages.append('<86>1 2013-10-05T19:06:40.%06iZ host.example.com sshd 1234 - - '
+                'Accepted publickey for root from 10.0.0.%i port 22 ssh2' % (i % 1000000, i % 256))
+            continue
+        event = Event(Event.EMPTY_ID, {
+            Event.MESSAGE: u"GET /index.html HTTP/1.1 200 %i" % i,
+            Event.ORIGIN: "web%i.example.com" % (i % 8),
+            Event.TIMESTAMP: 1381000000000.0 + i,
+            SyslogSink.APPNAME: u"nginx",
+            FieldIdentifier('status', FieldIdentifier.INTEGER): 200,
+            FieldIdentifier('bytes', FieldIdentifier.INTEGER): i,
+            FieldIdentifier('agent', FieldIdentifier.TEXT): u'Mozilla/5.0 "compatible"',
+            })
+        messages.append(tracker.assemble(sink._format(event)))
+    return messages
+
+def parse(parser, messages, convert):
+    schema = dict()
+    start = time.time()
+    for data in messages:
+        message = parser.parse(data)
+        if convert:
+            makeevent(message, schema)
+    return len(messages) / (time.time() - start)
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    messages = makemessages(count)
+    for name,convert in (("parse", False), ("parse+event", True)):
+        rates = (parse(RFC5424Parser(strict=True), messages, convert),
+                 parse(RFC5424Parser(fallback=False), messages, convert))
+        print "%-12s pyparsing %10.0f msgs/sec  hand-written %10.0f msgs/sec  (%.1fx)" % (
+            name, rates[0], rates[1], rates[1] / rates[0])
+
+if __name__ == '__main__':
+    main()
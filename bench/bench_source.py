@@ -0,0 +1,95 @@
+# Copyright 2013 Michael Frank <msfrank@syntaxjockey.com>
+#
+# This file is part of Terane.
+#
+# Terane is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Terane is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Terane.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Compare the lines per second read by file sources when constructing events
+through Event(), as sources used to, and through the fast path.
+
+usage: python bench/bench_source.py [COUNT]
+"""
+
+import os, sys, time, tempfile
+from terane.event import Event
+from terane.sources.file import FileSource, StdinSource
+
+class LegacyFileSource(FileSource):
+
+    def _makeevent(self, message):
+        values = {
+            Event.MESSAGE: message,
+            Event.TIMESTAMP: time.time() * 1000.0,
+            Event.ORIGIN: self.hostname,
+        }
+        return Event(Event.EMPTY_ID, values)
+
+class LegacyStdinSource(StdinSource):
+
+    _makeevent = LegacyFileSource._makeevent.im_func
+
+def makeevents(source, count):
+    """
+    Construct count events directly, excluding the cost of reading lines.
+    """
+    message = u"sshd[1234]: Accepted publickey for root from 10.0.0.1"
+    start = time.time()
+    for i in xrange(count):
+        source._makeevent(message)
+    return count / (time.time() - start)
+
+def readfile(source, path):
+    """
+    Read every line of the file through the source.
+    """
+    source.path = path
+    if isinstance(source, StdinSource):
+        source.binary = True
+        source.f = open(path, 'rb')
+    source.init()
+    count = 0
+    start = time.time()
+    try:
+        while True:
+            source.emit()
+            count += 1
+    except StopIteration:
+        pass
+    elapsed = time.time() - start
+    source.fini()
+    return count / elapsed
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    fd,path = tempfile.mkstemp()
+    try:
+        with os.fdopen(fd, 'w') as f:
+            for i in xrange(count):
+                f.write("Oct 17 12:00:00 host sshd[1234]: Accepted publickey for root from 10.0.0.%i\n" % (i % 256))
+        for name,before,after in (
+          ("construct", LegacyFileSource(), FileSource()),
+          ("file_source", LegacyFileSource(), FileSource()),
+          ("stdin_source", LegacyStdinSource(), StdinSource())):
+            if name == "construct":
+                rates = makeevents(before, count), makeevents(after, count)
+            else:
+                rates = readfile(before, path), readfile(after, path)
+            print "%-14s before %10.0f lines/sec  after %10.0f lines/sec  (%.2fx)" % (
+                name, rates[0], rates[1], rates[1] / rates[0])
+    finally:
+        os.unlink(path)
+
+if __name__ == '__main__':
+    main()
@@ -29,6 +29,9 @@ setup(
         "zope.interface",
         "zope.component",
         ],
+    extras_require={
+        "xz": ["backports.lzma"],
+        },
     # package classifiers for PyPI
     classifiers=[
         "Development Status :: 3 - Alpha",
@@ -75,11 +78,13 @@ setup(
             'file_source=terane.sources.file:FileSource',
             'stdin_source=terane.sources.file:StdinSource',
             'tail_source=terane.sources.tail:TailSource',
+            'multitail_source=terane.sources.multitail:MultiTailSource',
             'syslog_sink=terane.sinks.syslog:SyslogSink',
             'syslog_format=terane.filters.syslog_format:SyslogFormatFilter',
             'enrich=terane.filters.enrich:EnrichFilter',
             'log_debug=terane.filters.debug:DebugFilter',
             'debug_sink=terane.sinks.debug:DebugSink',
+            'relay_sink=terane.toolbox.relay.sink:SyslogSink',
             ]
         },
     test_suite="tests",
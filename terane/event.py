@@ -15,16 +15,30 @@
 # You should have received a copy of the GNU General Public License
 # along with Terane.  If not, see <http://www.gnu.org/licenses/>.
 
+from array import array
 from collections import Mapping
-from time import mktime
+from operator import itemgetter
+from time import mktime, time
 from datetime import datetime
 from dateutil.tz import tzutc
 
-class FieldIdentifier(object):
+class FieldIdentifier(tuple):
     """
     Field name and type which uniquely identifies a field in a sink.
+
+    FieldIdentifiers are immutable and interned: constructing a
+    FieldIdentifier returns the shared instance for the specified name and
+    type.  A FieldIdentifier compares and hashes equal to the (name, type)
+    tuple, so it may be used interchangeably with the tuple as a mapping key.
+
+    At most MAXINTERNED identifiers are interned; once the table is full,
+    new identifiers are still constructed but not shared.  Field names which
+    come from an untrusted peer should be constructed with intern=False, so
+    they can't fill the table.
     """
 
+    __slots__ = ()
+
     TEXT      = 1
     LITERAL   = 2
     INTEGER   = 3
@@ -52,12 +66,22 @@ class FieldIdentifier(object):
         HOSTNAME: 'HOSTNAME'
     }
 
-    def __init__(self, fieldname, fieldtype):
-        self.name = unicode(fieldname)
-        self.type = fieldtype
+    MAXINTERNED = 4096
 
-    def __eq__(self, other):
-        return self.name == other.name and self.type == other.type
+    _interned = dict()
+
+    def __new__(cls, fieldname, fieldtype, intern=True):
+        try:
+            return FieldIdentifier._interned[(fieldname, fieldtype)]
+        except KeyError:
+            field = tuple.__new__(cls, (unicode(fieldname), fieldtype))
+            if not intern or len(FieldIdentifier._interned) >= FieldIdentifier.MAXINTERNED:
+                return field
+            return FieldIdentifier._interned.setdefault(field, field)
+
+    name = property(itemgetter(0))
+
+    type = property(itemgetter(1))
 
     def __str__(self):
         return str("%s:%s" % (FieldIdentifier._namelookup[self.type], self.name))
@@ -65,12 +89,12 @@ class FieldIdentifier(object):
     def __repr__(self):
         return str(self)
 
-    def __hash__(self):
-        return hash("%d:%s" % (self.type,self.name))
+    def __reduce__(self):
+        return (FieldIdentifier, (self.name, self.type))
 
     @classmethod
-    def fromstring(cls, fieldname, fieldtype):
-        return FieldIdentifier(fieldname, FieldIdentifier._idlookup[fieldtype.upper()])
+    def fromstring(cls, fieldname, fieldtype, intern=True):
+        return FieldIdentifier(fieldname, FieldIdentifier._idlookup[fieldtype.upper()], intern)
 
     @property
     def typestring(self):
@@ -96,7 +120,24 @@ class Event(Mapping):
         self._id = id
         self._values = dict()
         for field,value in values.items():
-            self._values[(field.name,field.type)] = parsefield(field, value)
+            self._values[field] = parsefield(field, value)
+
+    @classmethod
+    def fromparsed(cls, id, values):
+        """
+        Construct an event from values which are already native types, such
+        as a datetime for a DATETIME field, skipping parsefield().  The
+        values dict is used by the event directly, not copied.
+
+        :param id: The event id
+        :param values: A dict mapping :class:`FieldIdentifier` to native values
+        :type values: dict
+        :rtype: :class:`Event`
+        """
+        event = cls.__new__(cls)
+        event._id = id
+        event._values = values
+        return event
 
     def __str__(self):
         return "Event(%s, %s)" % (self._id, 
@@ -113,14 +154,14 @@ class Event(Mapping):
         return iter(self._values)
 
     def __contains__(self, field):
-        return (field.name,field.type) in self._values
+        return field in self._values
 
     def __getitem__(self, field):
         return self._values[field]
 
     def get(self, field, default=_MISSING):
         try:
-            return self._values[(field.name, field.type)]
+            return self._values[field]
         except KeyError:
             if default is Event._MISSING:
                 raise
@@ -130,7 +171,7 @@ class Event(Mapping):
         validated = validatefield(field, value)
         if validated == None:
             raise TypeError("failed to validate %s as %s" % (value, field.typestring))
-        self._values[(field.name,field.type)] = validated
+        self._values[field] = validated
 
     def text(self, key, default=_MISSING):
         try:
@@ -201,21 +242,522 @@ class Event(Mapping):
     def message(self, default=_MISSING):
         return self.text('message', default)
 
-    _special = (
-        ('source', FieldIdentifier.LITERAL),
-        ('origin', FieldIdentifier.HOSTNAME),
-        ('timestamp', FieldIdentifier.DATETIME),
-        ('message', FieldIdentifier.TEXT)
-    )
+    _special = frozenset((SOURCE, ORIGIN, TIMESTAMP, MESSAGE))
 
     def fields(self):
-        for fieldid,value in self.items():
-            if fieldid not in Event._special:
-                yield (FieldIdentifier(fieldid[0], fieldid[1]), value)
+        for field,value in self._values.items():
+            if field not in Event._special:
+                yield (field, value)
 
     def stringify(self, field):
-        return stringifyfield(field, self._values[(field.name, field.type)])
+        return stringifyfield(field, self._values[field])
+
+class _Absent(object):
+    """
+    Marks an empty field slot in a :class:`CompactEvent`.
+    """
+    __slots__ = ()
+    def __reduce__(self):
+        return '_ABSENT'
+
+_ABSENT = _Absent()
+
+class _EventAccessors(object):
+    """
+    Implements the :class:`Event` interface in terms of the _lookup(),
+    __iter__(), __len__() and __contains__() methods of the subclass.
+    """
+
+    __slots__ = ()
+
+    __hash__ = None
+
+    def __str__(self):
+        return "Event(%s, %s)" % (self.id,
+        ", ".join(["%s='%s'" % (k,v) for (k,_),v in self.items()]))
+
+    def __getitem__(self, field):
+        return self._lookup(field)
+
+    def __eq__(self, other):
+        if not isinstance(other, Mapping):
+            return NotImplemented
+        return dict(self.items()) == dict(other.items())
+
+    def __ne__(self, other):
+        return not (self == other)
+
+    def keys(self):
+        return list(self)
+
+    def iterkeys(self):
+        return iter(self)
+
+    def values(self):
+        return [self._lookup(field) for field in self]
+
+    def itervalues(self):
+        for field in self:
+            yield self._lookup(field)
+
+    def items(self):
+        return [(field, self._lookup(field)) for field in self]
+
+    def iteritems(self):
+        for field in self:
+            yield (field, self._lookup(field))
+
+    def get(self, field, default=Event._MISSING):
+        try:
+            return self._lookup(field)
+        except KeyError:
+            if default is Event._MISSING:
+                raise
+            return default
+
+    def text(self, key, default=Event._MISSING):
+        return self.get((key, FieldIdentifier.TEXT), default)
+
+    def literal(self, key, default=Event._MISSING):
+        return self.get((key, FieldIdentifier.LITERAL), default)
+
+    def integer(self, key, default=Event._MISSING):
+        return self.get((key, FieldIdentifier.INTEGER), default)
+
+    def float(self, key, default=Event._MISSING):
+        return self.get((key, FieldIdentifier.FLOAT), default)
+
+    def datetime(self, key, default=Event._MISSING):
+        return self.get((key, FieldIdentifier.DATETIME), default)
+
+    def address(self, key, default=Event._MISSING):
+        return self.get((key, FieldIdentifier.ADDRESS), default)
+
+    def hostname(self, key, default=Event._MISSING):
+        return self.get((key, FieldIdentifier.HOSTNAME), default)
+
+    def source(self, default=Event._MISSING):
+        return self.get(Event.SOURCE, default)
+
+    def origin(self, default=Event._MISSING):
+        return self.get(Event.ORIGIN, default)
+
+    def timestamp(self, default=Event._MISSING):
+        return self.get(Event.TIMESTAMP, default)
+
+    def message(self, default=Event._MISSING):
+        return self.get(Event.MESSAGE, default)
+
+    def fields(self):
+        for field in self.keys():
+            if field not in Event._special:
+                yield (field, self._lookup(field))
+
+    def stringify(self, field):
+        return stringifyfield(field, self._lookup(field))
+
+class CompactEvent(_EventAccessors):
+    """
+    A compact mapping of fields to values, with the same interface as
+    :class:`Event`.  The source, origin, timestamp and message fields are
+    stored in fixed slots and parsed when the event is constructed.  All
+    other fields are stored as they were passed in and parsed on first
+    access, so the work of parsing fields which are never read is avoided.
+    Note this means a malformed value raises when it is first accessed, not
+    when the event is constructed.
+    """
+
+    __slots__ = ('_id', '_source', '_origin', '_timestamp', '_message', '_values', '_unparsed')
+
+    def __init__(self, id, values):
+        self._id = id
+        self._source = _ABSENT
+        self._origin = _ABSENT
+        self._timestamp = _ABSENT
+        self._message = _ABSENT
+        self._values = None
+        self._unparsed = None
+        for field,value in values.iteritems():
+            slot = _specialslots.get(field)
+            if slot is not None:
+                slot.__set__(self, parsefield(field, value))
+            else:
+                if self._unparsed is None:
+                    self._unparsed = dict()
+                self._unparsed[field] = value
+
+    def __getstate__(self):
+        return (self._id, self._source, self._origin, self._timestamp,
+                self._message, self._values, self._unparsed)
+
+    def __setstate__(self, state):
+        (self._id, self._source, self._origin, self._timestamp,
+         self._message, self._values, self._unparsed) = state
+
+    @property
+    def id(self):
+        return self._id
+
+    def _lookup(self, field):
+        slot = _specialslots.get(field)
+        if slot is not None:
+            value = slot.__get__(self, CompactEvent)
+            if value is _ABSENT:
+                raise KeyError(field)
+            return value
+        values = self._values
+        if values is not None and field in values:
+            return values[field]
+        unparsed = self._unparsed
+        if unparsed is None or field not in unparsed:
+            raise KeyError(field)
+        field = FieldIdentifier(field[0], field[1])
+        value = parsefield(field, unparsed[field])
+        if values is None:
+            values = self._values = dict()
+        values[field] = value
+        del unparsed[field]
+        return value
+
+    def __len__(self):
+        length = 0
+        for slot in _specialslots.itervalues():
+            if slot.__get__(self, CompactEvent) is not _ABSENT:
+                length += 1
+        if self._values is not None:
+            length += len(self._values)
+        if self._unparsed is not None:
+            length += len(self._unparsed)
+        return length
+
+    def __iter__(self):
+        for field,slot in _specialslots.iteritems():
+            if slot.__get__(self, CompactEvent) is not _ABSENT:
+                yield field
+        if self._values is not None:
+            for field in self._values.keys():
+                yield field
+        if self._unparsed is not None:
+            for field in self._unparsed.keys():
+                yield field
+
+    def __contains__(self, field):
+        slot = _specialslots.get(field)
+        if slot is not None:
+            return slot.__get__(self, CompactEvent) is not _ABSENT
+        if self._values is not None and field in self._values:
+            return True
+        return self._unparsed is not None and field in self._unparsed
+
+    def set(self, field, value):
+        validated = validatefield(field, value)
+        if validated == None:
+            raise TypeError("failed to validate %s as %s" % (value, field.typestring))
+        slot = _specialslots.get(field)
+        if slot is not None:
+            slot.__set__(self, validated)
+            return
+        if self._unparsed is not None:
+            self._unparsed.pop(field, None)
+        if self._values is None:
+            self._values = dict()
+        self._values[field] = validated
+
+    def _special(self, field, value, default):
+        if value is _ABSENT:
+            if default is Event._MISSING:
+                raise KeyError(field)
+            return default
+        return value
+
+    def source(self, default=Event._MISSING):
+        return self._special(Event.SOURCE, self._source, default)
+
+    def origin(self, default=Event._MISSING):
+        return self._special(Event.ORIGIN, self._origin, default)
+
+    def timestamp(self, default=Event._MISSING):
+        return self._special(Event.TIMESTAMP, self._timestamp, default)
+
+    def message(self, default=Event._MISSING):
+        return self._special(Event.MESSAGE, self._message, default)
+
+    def fields(self):
+        if self._values is not None:
+            for field,value in self._values.items():
+                yield (field, value)
+        if self._unparsed is not None:
+            for field in self._unparsed.keys():
+                yield (field, self._lookup(field))
+
+Mapping.register(CompactEvent)
+
+_specialslots = {
+        Event.SOURCE: CompactEvent._source,
+        Event.ORIGIN: CompactEvent._origin,
+        Event.TIMESTAMP: CompactEvent._timestamp,
+        Event.MESSAGE: CompactEvent._message,
+}
+
+_epoch = datetime(1970, 1, 1, tzinfo=Event._utc)
+
+def _datetimetomillis(value):
+    """
+    Convert a datetime into milliseconds since the epoch.  Naive datetimes
+    are assumed to be UTC.
+    """
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=Event._utc)
+    delta = value - _epoch
+    return (delta.days * 86400 + delta.seconds) * 1000.0 + delta.microseconds / 1000.0
+
+class CoarseClock(object):
+    """
+    A clock which returns the current time as a UTC datetime, constructing a
+    new datetime at most once per resolution seconds.  Constructing a
+    tz-aware datetime costs far more than reading the system clock, so
+    sources which timestamp every event share one datetime between all of
+    the events read within the same millisecond.
+    """
+
+    def __init__(self, resolution=0.001):
+        self.resolution = resolution
+        self._last = 0.0
+        self._now = None
+
+    def now(self):
+        """
+        :returns: The current time, accurate to within resolution seconds.
+        :rtype: :class:`datetime.datetime`
+        """
+        now = time()
+        if now - self._last >= self.resolution or now < self._last:
+            self._last = now
+            self._now = datetime.fromtimestamp(now, Event._utc)
+        return self._now
+
+def _bittest(bits, index):
+    byte = index >> 3
+    return byte < len(bits) and bits[byte] & (1 << (index & 7)) != 0
+
+def _bitset(bits, index):
+    byte = index >> 3
+    if byte >= len(bits):
+        bits.extend('\x00' * (byte - len(bits) + 1))
+    bits[byte] |= 1 << (index & 7)
+
+def _bitfill(length):
+    bits = bytearray('\xff' * (length >> 3))
+    if length & 7:
+        bits.append((1 << (length & 7)) - 1)
+    return bits
+
+class EventBatch(object):
+    """
+    A batch of events stored column by column.  Each field has a column of
+    values and a presence bitmap recording which rows have a value for the
+    field.  Timestamps are stored as milliseconds since the epoch in an
+    array('d').
+
+    Indexing or iterating over the batch yields :class:`EventRow` views,
+    which implement the :class:`Event` interface, so plugins which operate
+    on single events work unmodified.  Batch-aware plugins can operate on
+    whole columns using column() and setcolumn().  Note that naive
+    timestamps are stored as UTC, and are returned as UTC datetimes.
+    """
+
+    def __init__(self, events=None):
+        self._length = 0
+        self._ids = list()
+        self._columns = dict()
+        self._present = dict()
+        self._timestamps = array('d')
+        if events is not None:
+            for event in events:
+                self.append(event)
+
+    def __len__(self):
+        return self._length
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self._length
+        if index < 0 or index >= self._length:
+            raise IndexError("batch index out of range")
+        return EventRow(self, index)
+
+    def __iter__(self):
+        for index in xrange(self._length):
+            yield EventRow(self, index)
+
+    def __str__(self):
+        return "EventBatch(%i events, %s)" % (self._length,
+            ", ".join([str(f) for f in self._present.keys()]))
+
+    def append(self, event):
+        """
+        Append a copy of the specified event to the batch.
+
+        :param event: The event to append
+        :type event: :class:`Event`
+        """
+        index = self._length
+        self._length += 1
+        self._ids.append(event.id)
+        self._timestamps.append(0.0)
+        for field,value in event.items():
+            self._setvalue(index, FieldIdentifier(field[0], field[1]), value)
+
+    def fields(self):
+        """
+        Return the fields which are present in at least one row.
+
+        :rtype: [:class:`FieldIdentifier`]
+        """
+        return [f for f,bits in self._present.items() if any(bits)]
+
+    def timestamps(self):
+        """
+        Return the timestamp column as milliseconds since the epoch.  Rows
+        without a timestamp contain 0.0.
+
+        :rtype: array('d')
+        """
+        return self._timestamps
+
+    def column(self, field):
+        """
+        Return the values of the specified field for every row, with None for
+        rows which don't have the field.
+
+        :param field: The field
+        :type field: :class:`FieldIdentifier`
+        :rtype: list
+        """
+        bits = self._present.get(field, None)
+        if bits is None:
+            return [None] * self._length
+        if field == Event.TIMESTAMP:
+            values = [parsefield(field, ts) for ts in self._timestamps]
+        else:
+            values = self._columns[field]
+            values = values + [None] * (self._length - len(values))
+        return [v if _bittest(bits, i) else None for i,v in enumerate(values)]
+
+    def setcolumn(self, field, value, override=True):
+        """
+        Set the specified field to value in every row of the batch.  If
+        override is False, then only rows without the field are set.
+
+        :param field: The field
+        :type field: :class:`FieldIdentifier`
+        :param value: The value, which must be valid for the field type
+        :param override: Whether to replace existing values
+        :type override: bool
+        :raises: TypeError
+        """
+        validated = validatefield(field, value)
+        if validated == None:
+            raise TypeError("failed to validate %s as %s" % (value, field.typestring))
+        if field == Event.TIMESTAMP:
+            validated = _datetimetomillis(validated)
+        bits = self._present.get(field, None)
+        if override or bits is None:
+            if field == Event.TIMESTAMP:
+                self._timestamps = array('d', [validated]) * self._length
+            else:
+                self._columns[field] = [validated] * self._length
+            self._present[field] = _bitfill(self._length)
+        else:
+            for index in xrange(self._length):
+                if not _bittest(bits, index):
+                    self._setvalue(index, field, validated)
+
+    def select(self, indices):
+        """
+        Return a new batch containing copies of the specified rows.
+
+        :param indices: The row indices to select
+        :type indices: iterable
+        :rtype: :class:`EventBatch`
+        """
+        return EventBatch([EventRow(self, index) for index in indices])
+
+    def toevents(self):
+        """
+        Convert the batch into a list of :class:`Event`.
+
+        :rtype: [:class:`Event`]
+        """
+        # the values are already native types, so skip validation
+        return [Event.fromparsed(row.id, dict(row.items())) for row in self]
+
+    def _has(self, index, field):
+        bits = self._present.get(field, None)
+        return bits is not None and _bittest(bits, index)
+
+    def _getvalue(self, index, field):
+        bits = self._present.get(field, None)
+        if bits is None or not _bittest(bits, index):
+            raise KeyError(field)
+        if field == Event.TIMESTAMP:
+            return parsefield(field, self._timestamps[index])
+        return self._columns[field][index]
+
+    def _setvalue(self, index, field, value):
+        if field == Event.TIMESTAMP:
+            self._timestamps[index] = _datetimetomillis(value)
+        else:
+            values = self._columns.get(field, None)
+            if values is None:
+                values = self._columns[field] = list()
+            if index >= len(values):
+                values.extend([None] * (index - len(values) + 1))
+            values[index] = value
+        bits = self._present.get(field, None)
+        if bits is None:
+            bits = self._present[field] = bytearray()
+        _bitset(bits, index)
+
+    def _rowfields(self, index):
+        return [f for f,bits in self._present.items() if _bittest(bits, index)]
+
+class EventRow(_EventAccessors):
+    """
+    A view of a single row of an :class:`EventBatch`, implementing the
+    :class:`Event` interface.  Changes made through the view are written to
+    the batch.
+    """
+
+    __slots__ = ('_batch', '_index')
+
+    def __init__(self, batch, index):
+        self._batch = batch
+        self._index = index
+
+    @property
+    def id(self):
+        return self._batch._ids[self._index]
+
+    def _lookup(self, field):
+        return self._batch._getvalue(self._index, field)
+
+    def __len__(self):
+        return len(self._batch._rowfields(self._index))
+
+    def __iter__(self):
+        return iter(self._batch._rowfields(self._index))
+
+    def __contains__(self, field):
+        return self._batch._has(self._index, field)
+
+    def set(self, field, value):
+        validated = validatefield(field, value)
+        if validated == None:
+            raise TypeError("failed to validate %s as %s" % (value, field.typestring))
+        self._batch._setvalue(self._index, FieldIdentifier(field[0], field[1]), validated)
 
+Mapping.register(EventRow)
 
 _parsefield = {
         FieldIdentifier.TEXT: (lambda x: unicode(x)),
@@ -16,7 +16,7 @@
 # along with Terane.  If not, see <http://www.gnu.org/licenses/>.
 
 from terane.plugin import IPlugin
-from terane.event import FieldIdentifier, parsefield
+from terane.event import FieldIdentifier, EventBatch, parsefield
 from terane.loggers import getLogger
 
 logger = getLogger("terane.filters.enrich")
@@ -49,3 +49,9 @@ class EnrichFilter(IPlugin):
             return event
         event.set(self.field, self.value)
         return event
+
+    def filter_batch(self, events):
+        if isinstance(events, EventBatch):
+            events.setcolumn(self.field, self.value, self.override)
+            return events
+        return [self.filter(event) for event in events]
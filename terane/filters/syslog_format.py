@@ -16,10 +16,13 @@
 # along with Terane.  If not, see <http://www.gnu.org/licenses/>.
 
 import re, dateutil.parser
+from datetime import datetime
+from dateutil.tz import tzutc, tzlocal, gettz
 from terane.plugin import IPlugin
 from terane.event import Event
 from terane.sinks.syslog import SyslogSink
 from terane.pipeline import DropEvent
+from terane.settings import ConfigureError
 from terane.loggers import getLogger
 
 logger = getLogger("terane.filters.syslog_format")
@@ -29,8 +32,61 @@ class SyslogFormatFilter(IPlugin):
     _linematcher = re.compile(r'(?P<ts>[A-Za-z]{3} [ \d]\d \d\d:\d\d\:\d\d) (?P<hostname>\S*) (?P<msg>.*)')
     _tagmatcher = re.compile(r'^(\S+)\[(\d+)\]:$|^(\S+):$')
 
+    _months = {
+        'Jan': 1, 'Feb': 2, 'Mar': 3, 'Apr': 4, 'May': 5, 'Jun': 6,
+        'Jul': 7, 'Aug': 8, 'Sep': 9, 'Oct': 10, 'Nov': 11, 'Dec': 12
+    }
+
+    def __init__(self, *args, **kwargs):
+        self.year = None
+        self.timezone = None
+        self._tz = None
+
     def __str__(self):
-        return "SyslogFormatFilter()"
+        return "SyslogFormatFilter(year=%s, timezone=%s)" % (self.year, self.timezone)
+
+    def configure(self, section):
+        # syslog timestamps have no year, default to the current year
+        self.year = section.getInt("year", self.year)
+        # syslog timestamps have no timezone, default to a naive timestamp
+        self.timezone = section.getString("timezone", self.timezone)
+        self._tz = self._gettz(self.timezone)
+
+    def _gettz(self, timezone):
+        if timezone == None:
+            return None
+        if timezone.lower() == 'local':
+            return tzlocal()
+        if timezone.lower() == 'utc':
+            return tzutc()
+        tz = gettz(timezone)
+        if tz == None:
+            raise ConfigureError("timezone '%s' is not a valid value" % timezone)
+        return tz
+
+    def init(self):
+        self._lastts = None
+        self._lastdt = None
+
+    def _parsetimestamp(self, ts):
+        """
+        Parse a timestamp in 'Mon DD HH:MM:SS' format.  Consecutive lines
+        usually share the same timestamp, so the last result is cached.
+        Unexpected input is handed to dateutil.
+        """
+        if ts == self._lastts:
+            return self._lastdt
+        year = self.year if self.year != None else datetime.now().year
+        try:
+            dt = datetime(year, SyslogFormatFilter._months[ts[0:3]], int(ts[4:6]),
+                          int(ts[7:9]), int(ts[10:12]), int(ts[13:15]), 0, self._tz)
+        except (KeyError, ValueError):
+            dt = dateutil.parser.parse(ts, default=datetime(year, 1, 1))
+            if self._tz != None and dt.tzinfo == None:
+                dt = dt.replace(tzinfo=self._tz)
+        self._lastts = ts
+        self._lastdt = dt
+        return dt
 
     def filter(self, event):
         # split the line into timestamp, hostname, and message
@@ -43,7 +99,7 @@ class SyslogFormatFilter(IPlugin):
             raise DropEvent("line is not in syslog format")
         # parse the timestamp
         try:
-            event.set(Event.TIMESTAMP, dateutil.parser.parse(ts))
+            event.set(Event.TIMESTAMP, self._parsetimestamp(ts))
         except Exception, e:
             raise DropEvent("failed to parse ts '%s': %s" % (ts, e))
         event.set(Event.ORIGIN, hostname)
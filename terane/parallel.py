@@ -0,0 +1,115 @@
+# Copyright 2013 Michael Frank <msfrank@syntaxjockey.com>
+#
+# This file is part of Terane.
+#
+# Terane is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Terane is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Terane.  If not, see <http://www.gnu.org/licenses/>.
+
+import signal, traceback, Queue
+from collections import deque
+from terane.loggers import getLogger
+
+logger = getLogger('terane.parallel')
+
+class WorkerError(Exception):
+    """
+    Raised in the parent process when a task failed in a worker process.
+    """
+
+def ignoresigint():
+    """
+    Ignore SIGINT in a worker process, so that only the parent process
+    handles keyboard interrupts.  Intended to be called from a pool
+    initializer.
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+def _safecall(func, item):
+    try:
+        return True, func(item)
+    except Exception, e:
+        return False, "%s\n---\n%s" % (e, traceback.format_exc())
+
+def _unwrap(result):
+    succeeded,value = result
+    if not succeeded:
+        raise WorkerError(value)
+    return value
+
+def imapbounded(pool, func, iterable, window, ordered=True):
+    """
+    Apply func to each item of iterable using the specified
+    :class:`multiprocessing.Pool`, yielding the results.  Unlike
+    Pool.imap(), at most window items are in flight at any time, so a fast
+    producer can't buffer an unbounded amount of work in the parent process.
+    Results which have completed are yielded without waiting for the window
+    to fill.  An item of None isn't processed, it tells imapbounded that the
+    producer is idle, so every item in flight is waited for and yielded.
+
+    :param pool: The worker pool
+    :type pool: :class:`multiprocessing.Pool`
+    :param func: A picklable module-level function taking a single argument
+    :param iterable: The items to process
+    :param window: The maximum number of items in flight
+    :type window: int
+    :param ordered: If True, yield results in the order of iterable, otherwise
+      yield results as they complete.
+    :type ordered: bool
+    :raises: :class:`WorkerError`
+    """
+    window = max(1, window)
+    if ordered:
+        pending = deque()
+        for item in iterable:
+            if item is None:
+                while len(pending) > 0:
+                    yield _unwrap(pending.popleft().get())
+                continue
+            pending.append(pool.apply_async(_safecall, (func, item)))
+            while len(pending) > 0 and (len(pending) >= window or pending[0].ready()):
+                yield _unwrap(pending.popleft().get())
+        while len(pending) > 0:
+            yield _unwrap(pending.popleft().get())
+    else:
+        # results arrive through the apply_async callback, which is only
+        # called for successful tasks.  a task which fails outside of
+        # _safecall, for example because its result can't be pickled, is
+        # found by polling the results in flight.
+        completed = Queue.Queue()
+        inflight = dict()
+        def nextresult():
+            while True:
+                try:
+                    key,result = completed.get(True, 0.1)
+                except Queue.Empty:
+                    for key,asyncresult in inflight.items():
+                        if asyncresult.ready() and not asyncresult.successful():
+                            del inflight[key]
+                            try:
+                                asyncresult.get()
+                            except Exception, e:
+                                raise WorkerError(str(e))
+                    continue
+                del inflight[key]
+                return _unwrap(result)
+        for key,item in enumerate(iterable):
+            if item is None:
+                while len(inflight) > 0:
+                    yield nextresult()
+                continue
+            inflight[key] = pool.apply_async(_safecall, (func, item),
+                callback=lambda result, key=key: completed.put((key, result)))
+            while len(inflight) >= window or not completed.empty():
+                yield nextresult()
+        while len(inflight) > 0:
+            yield nextresult()
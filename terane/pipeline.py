@@ -15,9 +15,14 @@
 # You should have received a copy of the GNU General Public License
 # along with Terane.  If not, see <http://www.gnu.org/licenses/>.
 
+import traceback
+from multiprocessing import Pool
+from multiprocessing.util import Finalize
 from pyparsing import *
+from terane.event import EventBatch
 from terane.plugin import PluginManager
 from terane.settings import NodespecSettings
+from terane.parallel import imapbounded, ignoresigint, WorkerError
 from terane.loggers import getLogger
 
 logger = getLogger("terane.pipeline")
@@ -97,12 +102,39 @@ class FilterChain(object):
             event = f.filter(event)
         return event
 
+    def process_batch(self, events):
+        """
+        Run the specified batch of events through the filter chain.
+
+        :param events: The events to process
+        :type events: list
+        :returns: A tuple containing the list of events which were not dropped
+          and the number of events which were dropped.
+        :rtype: tuple
+        """
+        dropped = 0
+        for f in self.filters:
+            if len(events) == 0:
+                break
+            nevents = len(events)
+            events = filterbatch(f, events)
+            dropped += nevents - len(events)
+        return events, dropped
+
+    def init(self):
+        for f in self.filters:
+            f.init()
+
+    def fini(self):
+        for f in self.filters:
+            f.fini()
+
 def makefilterchain(nodes, plugins=None):
     """
     Construct a :class:`FilterChain` from a node sequence.
     """
     if nodes == None or len(nodes) == 0:
-        return list()
+        return FilterChain(list())
     if plugins == None:
         plugins = PluginManager()
     settings = NodespecSettings(nodes)
@@ -112,7 +144,98 @@ def makefilterchain(nodes, plugins=None):
         node = plugins.newinstance('terane.plugin.pipeline', pluginname)
         node.configure(section)
         nodes.append(node)
-    return nodes
+    return FilterChain(nodes)
+
+def emitbatch(source, count):
+    """
+    Pull up to count events from the source.  If the source implements
+    emit_batch() then it is used, otherwise emit() is called repeatedly.
+    Events dropped by the source are not returned.  If emit_batch() returns
+    an :class:`EventBatch` it is passed along as is, so filters and sinks
+    which support it can operate on whole columns.
+
+    Since emit() blocks until an event is available, a source which waits
+    for new data (such as a tailing source) should implement emit_batch()
+    and return the events which are available without waiting, or an empty
+    list if none arrive, so events aren't held back until a batch fills.
+
+    :param source: The source to pull events from
+    :param count: The maximum number of events to return
+    :type count: int
+    :returns: A tuple containing the list (or :class:`EventBatch`) of events,
+      which may be empty, and the number of events dropped by the source.
+    :rtype: tuple
+    :raises: StopIteration
+    """
+    if hasattr(source, 'emit_batch'):
+        events = source.emit_batch(count)
+        if not isinstance(events, EventBatch):
+            events = list(events)
+        return events, 0
+    events = list()
+    dropped = 0
+    while len(events) < count:
+        try:
+            events.append(source.emit())
+        except DropEvent, e:
+            logger.debug("dropped event: %s" % str(e))
+            dropped += 1
+        except StopIteration:
+            if len(events) == 0 and dropped == 0:
+                raise
+            break
+    return events, dropped
+
+def filterbatch(f, events):
+    """
+    Run a batch of events through a single filter.  If the filter implements
+    filter_batch() then it is used, otherwise filter() is called once per
+    event.  filter_batch() must return the events which were not dropped.
+
+    :param f: The filter
+    :param events: The events to process
+    :type events: list
+    :returns: The events which were not dropped.
+    :rtype: list
+    """
+    if hasattr(f, 'filter_batch'):
+        return f.filter_batch(events)
+    filtered = list()
+    for event in events:
+        try:
+            filtered.append(f.filter(event))
+        except DropEvent, e:
+            logger.debug("dropped event: %s" % str(e))
+    return filtered
+
+def consumebatch(sink, events):
+    """
+    Push a batch of events into the sink.  If the sink implements
+    consume_batch() then it is used, otherwise consume() is called once per
+    event.  consume_batch() may return the number of events it dropped, or
+    None if every event was consumed.
+
+    :param sink: The sink
+    :param events: The events to consume
+    :type events: list
+    :returns: A tuple containing the number of events processed and dropped.
+    :rtype: tuple
+    """
+    if hasattr(sink, 'consume_batch'):
+        dropped = sink.consume_batch(events)
+        if dropped == None:
+            dropped = 0
+        return len(events) - dropped, dropped
+    processed = 0
+    dropped = 0
+    for event in events:
+        try:
+            sink.consume(event)
+            processed += 1
+        except DropEvent, e:
+            logger.debug("dropped event: %s" % str(e))
+            dropped += 1
+    return processed, dropped
 
 class Pipeline(object):
     """
@@ -121,12 +244,20 @@ class Pipeline(object):
     synchronously pulls events from the source, feeds them through each filter,
     and pushes them into the sink until there are no more events left (the
     source raises StopIteration).
+
+    If batchsize is greater than 1, then the pipeline pulls up to batchsize
+    events from the source at a time and passes each batch through the filters
+    and into the sink, using the emit_batch(), filter_batch() and
+    consume_batch() methods of any node which implements them.  Sources which
+    wait for new data return partial batches from emit_batch(), so events
+    are consumed and committed as they arrive; see :func:`emitbatch`.
     """
 
-    def __init__(self, source, sink, filters=[]):
+    def __init__(self, source, sink, filters=[], batchsize=None):
         self._source = source
         self._sink = sink
         self._filters = filters
+        self._batchsize = batchsize
         self._processed = 0
         self._dropped = 0
 
@@ -160,6 +291,49 @@ class Pipeline(object):
                 self._dropped += 1
         return event
 
+    def _nextbatch(self):
+        """
+        Return the next batch of events from the pipeline, or raise
+        StopIteration.  The returned batch may be empty if every event
+        in it was dropped.
+
+        :returns: A list of :class:`Event`
+        :rtype: list
+        :raises: StopIteration
+        """
+        events,dropped = emitbatch(self._source, self._batchsize)
+        self._dropped += dropped
+        events,dropped = FilterChain(self._filters).process_batch(events)
+        self._dropped += dropped
+        return events
+
+    def _commit(self):
+        """
+        Tell the source that every event it has emitted so far was consumed,
+        if the source supports checkpoints.
+        """
+        if hasattr(self._source, 'commit'):
+            self._source.commit(self._source.checkpoint())
+
+    def _run(self):
+        while True:
+            try:
+                self._sink.consume(self._next())
+                self._processed += 1
+            except DropEvent, e:
+                logger.debug("dropped event: %s" % str(e))
+                self._dropped += 1
+            self._commit()
+
+    def _runbatched(self):
+        while True:
+            events = self._nextbatch()
+            if len(events) > 0:
+                processed,dropped = consumebatch(self._sink, events)
+                self._processed += processed
+                self._dropped += dropped
+            self._commit()
+
     def run(self):
         """
         Run the pipeline synchronously until there are no more events.
@@ -171,20 +345,165 @@ class Pipeline(object):
         for f in self._filters:
             f.init()
         try:
-            while True:
-                try:
-                    self._sink.consume(self._next())
-                    self._processed += 1
-                except DropEvent, e:
-                    logger.debug("dropped event: %s" % str(e))
-                    self._dropped += 1
+            if self._batchsize != None and self._batchsize > 1:
+                self._runbatched()
+            else:
+                self._run()
         except StopIteration:
             pass
         finally:
-            self._source.fini()
-            self._sink.fini()
-            for f in self._filters:
-                f.fini()
+            # the sink finishes sending before the source saves its
+            # checkpoints, so events still queued in the sink are sent first
+            try:
+                self._sink.fini()
+            finally:
+                self._source.fini()
+                for f in self._filters:
+                    f.fini()
+
+    @property
+    def processed(self):
+        return self._processed
+
+    @property
+    def dropped(self):
+        return self._dropped
+
+_workerchain = None
+_workererror = None
+
+def _initworker(nodes):
+    """
+    Construct and initialize the filter chain in a worker process.  Errors
+    are not raised from here, since multiprocessing.Pool would replace the
+    failed worker forever; instead every task run by the worker fails.
+    """
+    global _workerchain, _workererror
+    ignoresigint()
+    try:
+        chain = makefilterchain(nodes)
+        chain.init()
+    except Exception, e:
+        _workererror = "failed to initialize filters: %s\n---\n%s" % (e, traceback.format_exc())
+        return
+    _workerchain = chain
+    Finalize(None, chain.fini, exitpriority=10)
+
+def _processbatch(batch):
+    """
+    Run a batch of events through the filter chain of a worker process.  The
+    batch is a tuple of the sequence number and the events, and the result is
+    a tuple of the sequence number, the filtered events and the number of
+    events dropped.
+    """
+    if _workerchain == None:
+        raise WorkerError(_workererror)
+    seq,events = batch
+    events,dropped = _workerchain.process_batch(events)
+    return seq, events, dropped
+
+class ParallelPipeline(object):
+    """
+    A pipeline which runs the filters in a pool of worker processes.  Events
+    are pulled from the source in batches in the parent process, each batch is
+    sent to a worker which runs it through its own copy of the filter chain,
+    and the filtered events are pushed into the sink in the parent process.
+
+    Since filter plugin instances can't be shared between processes, the
+    filters are specified as a sequence of :class:`NodeSpec`, and each worker
+    constructs its own filter chain.  If ordered is True, then events are
+    consumed by the sink in the order they were emitted by the source,
+    otherwise batches are consumed as soon as any worker completes them.
+    """
+
+    def __init__(self, source, sink, filters=[], workers=2, ordered=True, batchsize=None):
+        self._source = source
+        self._sink = sink
+        self._filters = list(filters)
+        self._workers = workers
+        self._ordered = ordered
+        self._batchsize = batchsize if batchsize != None and batchsize > 1 else 256
+        self._processed = 0
+        self._dropped = 0
+
+    def __str__(self):
+        source = str(self._source)
+        sink = str(self._sink)
+        if len(self._filters) > 0:
+            filters = " ~> ".join([n.name for n in self._filters])
+            return "%s ~> [%i x %s] ~> %s" % (source, self._workers, filters, sink)
+        return "%s ~> %s" % (source, sink)
+
+    def _batches(self, checkpoints):
+        seq = 0
+        while True:
+            try:
+                events,dropped = emitbatch(self._source, self._batchsize)
+            except StopIteration:
+                return
+            self._dropped += dropped
+            if len(events) > 0:
+                if checkpoints != None:
+                    checkpoints[seq] = self._source.checkpoint()
+                yield seq, events
+                seq += 1
+            elif dropped == 0:
+                # the source has nothing to emit yet, so consume the batches
+                # in flight rather than holding them back until it does
+                yield None
+
+    def _commit(self, token):
+        if token != None:
+            self._source.commit(token)
+
+    def run(self):
+        """
+        Run the pipeline until there are no more events.
+
+        :raises: Exception
+        """
+        # construct the filters once in this process, so configuration errors
+        # are raised here rather than in each worker
+        chain = makefilterchain(self._filters)
+        chain.init()
+        chain.fini()
+        self._source.init()
+        self._sink.init()
+        # if the source supports checkpoints, track the checkpoint for each
+        # batch in flight by sequence number.  batches complete out of order
+        # when unordered, so a checkpoint is only committed once its batch
+        # and every batch before it has been consumed.
+        checkpoints = dict() if hasattr(self._source, 'commit') else None
+        completed = set()
+        nextseq = 0
+        pool = Pool(self._workers, _initworker, (self._filters,))
+        try:
+            results = imapbounded(pool, _processbatch, self._batches(checkpoints),
+                                  self._workers * 2, self._ordered)
+            for seq,events,dropped in results:
+                self._dropped += dropped
+                if len(events) > 0:
+                    processed,dropped = consumebatch(self._sink, events)
+                    self._processed += processed
+                    self._dropped += dropped
+                if checkpoints != None:
+                    completed.add(seq)
+                    token = None
+                    while nextseq in completed:
+                        completed.remove(nextseq)
+                        token = checkpoints.pop(nextseq)
+                        nextseq += 1
+                    self._commit(token)
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+            try:
+                self._sink.fini()
+            finally:
+                self._source.fini()
 
     @property
     def processed(self):
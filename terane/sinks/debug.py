@@ -16,7 +16,6 @@
 # along with Terane.  If not, see <http://www.gnu.org/licenses/>.
 
 from terane.plugin import IPlugin
-from terane.event import FieldIdentifier
 from terane.loggers import getLogger
 
 logger = getLogger('terane.sinks.debug')
@@ -34,6 +33,5 @@ class DebugSink(IPlugin):
             print "-"
         else:
             print event.id
-        for (fieldname,fieldtype),value in event.items():
-            field = FieldIdentifier(fieldname, fieldtype)
+        for field,value in event.items():
             print "  %s = '%s'" % (field.name,value)
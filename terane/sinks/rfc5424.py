@@ -0,0 +1,208 @@
+# Copyright 2013 Michael Frank <msfrank@syntaxjockey.com>
+#
+# This file is part of Terane.
+#
+# Terane is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Terane is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Terane.  If not, see <http://www.gnu.org/licenses/>.
+
+import re
+from loggerglue import constants
+
+BOM = '\xef\xbb\xbf'
+
+_facilities = ('kern', 'user', 'mail', 'daemon', 'auth', 'syslog', 'lpr', 'news',
+    'uucp', 'cron', 'authpriv', 'local0', 'local1', 'local2', 'local3', 'local4',
+    'local5', 'local6', 'local7')
+
+_severities = ('emerg', 'alert', 'crit', 'err', 'warning', 'notice', 'info', 'debug')
+
+_privals = dict()
+for _facility in _facilities:
+    for _severity in _severities:
+        _privals[(_facility, _severity)] = getattr(constants, "LOG_" + _facility.upper()) \
+            + getattr(constants, "LOG_" + _severity.upper())
+
+def stringtoprival(facility, severity):
+    """
+    Return the prival for the specified facility and severity names, for
+    example ('daemon', 'info').  Names are case-insensitive.
+
+    :param facility: The facility name
+    :type facility: str
+    :param severity: The severity name
+    :type severity: str
+    :rtype: int
+    :raises: AttributeError if either name is not known
+    """
+    try:
+        return _privals[(facility, severity)]
+    except KeyError:
+        prival = getattr(constants, "LOG_" + facility.upper()) \
+            + getattr(constants, "LOG_" + severity.upper())
+        _privals[(facility, severity)] = prival
+        return prival
+
+_prinames = dict([(prival, names) for names,prival in _privals.items()])
+
+def privaltostring(prival):
+    """
+    Return the facility and severity names for the specified prival.
+
+    :param prival: The prival
+    :type prival: int
+    :returns: A tuple containing the facility and severity names, or None
+      for the facility if it has no name.
+    :rtype: tuple
+    """
+    try:
+        return _prinames[prival]
+    except KeyError:
+        return None, _severities[prival & 7]
+
+_priheaders = ["<%i>1 " % prival for prival in xrange(192)]
+
+_escapechars = re.compile(ur'["\\\]]')
+_escape = re.compile(ur'(["\\\]])')
+
+def _tobytes(value):
+    if value is None:
+        return '-'
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return str(value)
+
+def encodeparam(name, value):
+    """
+    Encode a single SD-PARAM, including the space which precedes it.
+
+    :param name: The PARAM-NAME
+    :type name: str
+    :param value: The PARAM-VALUE
+    :rtype: str
+    """
+    if isinstance(value, basestring):
+        value = _escape.sub(ur'\\\1', value)
+    return ''.join((' ', name, '="', _tobytes(value), '"'))
+
+class RFC5424Encoder(object):
+    """
+    Encodes syslog messages in RFC 5424 format, producing the same bytes as
+    str(SyslogEntry) in loggerglue without constructing the intermediate
+    objects.  The HOSTNAME, APP-NAME, PROCID and MSGID part of the header
+    is cached, since it usually takes only a few distinct values.  Unlike
+    loggerglue, non-ASCII header and SD-PARAM values are encoded as UTF-8
+    rather than raising UnicodeEncodeError.
+    """
+
+    def __init__(self, cachesize=4096):
+        self.cachesize = cachesize
+        self._headers = dict()
+        self._lasttimestamp = None
+        self._lastformatted = None
+
+    def _hostheader(self, hostname, appname, procid, msgid):
+        key = (hostname, appname, procid, msgid)
+        header = self._headers.get(key)
+        if header is None:
+            if len(self._headers) >= self.cachesize:
+                self._headers.clear()
+            header = ' '.join(('', _tobytes(hostname), _tobytes(appname),
+                _tobytes(procid), _tobytes(msgid), ''))
+            self._headers[key] = header
+        return header
+
+    def _timestamp(self, timestamp):
+        if timestamp is None:
+            return '-'
+        # events read within the same millisecond often share a timestamp
+        if timestamp is self._lasttimestamp:
+            return self._lastformatted
+        formatted = "%04i-%02i-%02iT%02i:%02i:%02i.%06iZ" % (timestamp.year,
+            timestamp.month, timestamp.day, timestamp.hour, timestamp.minute,
+            timestamp.second, timestamp.microsecond)
+        self._lasttimestamp = timestamp
+        self._lastformatted = formatted
+        return formatted
+
+    def header(self, prival, timestamp, hostname, appname, procid, msgid):
+        """
+        Encode the message header, up to and including the space before the
+        STRUCTURED-DATA.
+
+        :rtype: str
+        """
+        return ''.join((_priheaders[prival], self._timestamp(timestamp),
+            self._hostheader(hostname, appname, procid, msgid)))
+
+    def elements(self, elements):
+        """
+        Encode a list of SD-ELEMENTs.
+
+        :param elements: A list of (sdid, params) tuples, where params is a
+          list of (name, value) tuples.
+        :type elements: list
+        :rtype: str
+        """
+        if len(elements) == 0:
+            return ''
+        values = [value for sdid,params in elements for name,value in params]
+        # escaping is rarely needed, so check every value at once
+        escape = _escapechars.search(u''.join(values)) is not None
+        parts = list()
+        for sdid,params in elements:
+            parts.append('[')
+            parts.append(sdid)
+            for name,value in params:
+                if escape:
+                    value = _escape.sub(ur'\\\1', value)
+                parts.append(' ')
+                parts.append(name)
+                parts.append('="')
+                parts.append(_tobytes(value))
+                parts.append('"')
+            parts.append(']')
+        return ''.join(parts)
+
+    def message(self, message):
+        """
+        Encode the MSG, including the space which precedes it.
+
+        :rtype: str
+        """
+        if message is None:
+            return ''
+        if isinstance(message, unicode):
+            return ' ' + BOM + message.encode('utf-8')
+        return ' ' + message
+
+    def encode(self, prival, timestamp, hostname, appname, procid, msgid, elements, message):
+        """
+        Encode a syslog message.
+
+        :param prival: The prival
+        :type prival: int
+        :param timestamp: The message timestamp, or None
+        :type timestamp: :class:`datetime.datetime`
+        :param hostname: The HOSTNAME, or None
+        :param appname: The APP-NAME, or None
+        :param procid: The PROCID, or None
+        :param msgid: The MSGID, or None
+        :param elements: A list of (sdid, params) tuples, where params is a list
+          of (name, value) tuples.
+        :type elements: list
+        :param message: The MSG, or None
+        :returns: The encoded message
+        :rtype: str
+        """
+        return ''.join((self.header(prival, timestamp, hostname, appname, procid, msgid),
+            self.elements(elements) or '-', self.message(message)))
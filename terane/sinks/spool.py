@@ -0,0 +1,201 @@
+# Copyright 2013 Michael Frank <msfrank@syntaxjockey.com>
+#
+# This file is part of Terane.
+#
+# Terane is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Terane is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Terane.  If not, see <http://www.gnu.org/licenses/>.
+
+import os, errno, struct, threading
+from terane.loggers import getLogger
+
+logger = getLogger('terane.sinks.spool')
+
+_header = struct.Struct('>I')
+
+class Spool(object):
+    """
+    A disk-backed FIFO queue of messages, stored as a sequence of
+    append-only segment files in a directory.  Each message is written as a
+    4 byte big-endian length followed by the message bytes.  Once a segment
+    reaches segmentsize bytes a new segment is started, and segments are
+    deleted once every message in them has been read and committed.  If
+    appending a message would grow the spool beyond maxsize bytes, the
+    message is refused.
+
+    Messages left in the spool when it is closed are read again when it is
+    reopened.  Since the read position within a segment isn't persisted,
+    messages from a partially read segment may be delivered twice.
+
+    Appending and reading may happen from different threads.
+    """
+
+    def __init__(self, path, maxsize=1024 * 1024 * 1024, segmentsize=16 * 1024 * 1024):
+        self.path = path
+        self.maxsize = maxsize
+        self.segmentsize = segmentsize
+        self._lock = threading.Lock()
+        try:
+            os.makedirs(path)
+        except OSError, e:
+            if e.errno != errno.EEXIST:
+                raise
+        self._segments = list()
+        self._size = 0
+        for name in os.listdir(path):
+            if name.endswith('.spool'):
+                self._segments.append(int(name[:-6]))
+                self._size += os.path.getsize(self._segmentpath(self._segments[-1]))
+        self._segments.sort()
+        if len(self._segments) > 0:
+            logger.info("spool %s contains %i bytes in %i segments" % (path, self._size, len(self._segments)))
+        self._writer = None
+        self._writesize = 0
+        self._reader = None
+        self._readoffset = 0
+        self._committed = 0
+
+    def __str__(self):
+        return "Spool(path=%s, maxsize=%i, segmentsize=%i)" % (self.path, self.maxsize, self.segmentsize)
+
+    def _segmentpath(self, segment):
+        return os.path.join(self.path, "%016i.spool" % segment)
+
+    def empty(self):
+        """
+        :returns: True if there are no unread messages in the spool.
+        :rtype: bool
+        """
+        with self._lock:
+            if len(self._segments) == 0:
+                return True
+            if len(self._segments) > 1 or self._writer is None:
+                return False
+            return self._readoffset >= self._writesize
+
+    @property
+    def size(self):
+        return self._size
+
+    def append(self, msgs):
+        """
+        Append the messages to the spool.
+
+        :param msgs: The messages to append
+        :type msgs: list
+        :returns: The number of messages appended, which is less than the
+          number of messages if the spool is full.
+        :rtype: int
+        """
+        with self._lock:
+            records = list()
+            size = 0
+            for msg in msgs:
+                if self._size + size + _header.size + len(msg) > self.maxsize:
+                    break
+                records.append(_header.pack(len(msg)))
+                records.append(msg)
+                size += _header.size + len(msg)
+            if size == 0:
+                return 0
+            if self._writer is None or self._writesize >= self.segmentsize:
+                self._rotate()
+            self._writer.write(''.join(records))
+            self._writer.flush()
+            self._writesize += size
+            self._size += size
+            return len(records) / 2
+
+    def _rotate(self):
+        if self._writer is not None:
+            self._writer.close()
+        segment = self._segments[-1] + 1 if len(self._segments) > 0 else 0
+        self._writer = open(self._segmentpath(segment), 'ab')
+        self._writesize = 0
+        self._segments.append(segment)
+
+    def read(self, maxbytes):
+        """
+        Return unread messages from the head of the spool, totalling at most
+        maxbytes bytes (at least one message is returned if any are unread).
+        The messages are read again by the next call unless commit() is
+        called first.
+
+        :param maxbytes: The maximum number of bytes to return
+        :type maxbytes: int
+        :returns: A list of messages
+        :rtype: list
+        """
+        with self._lock:
+            msgs = list()
+            size = 0
+            offset = self._readoffset
+            while len(self._segments) > 0:
+                if self._reader is None:
+                    self._reader = open(self._segmentpath(self._segments[0]), 'rb')
+                    self._readoffset = offset = 0
+                self._reader.seek(offset)
+                while True:
+                    header = self._reader.read(_header.size)
+                    if len(header) < _header.size:
+                        break
+                    length, = _header.unpack(header)
+                    if len(msgs) > 0 and size + length > maxbytes:
+                        break
+                    msg = self._reader.read(length)
+                    if len(msg) < length:
+                        break
+                    msgs.append(msg)
+                    size += len(msg)
+                    offset += _header.size + length
+                if len(msgs) > 0 or self._iswriting():
+                    break
+                # the head segment is exhausted, move on to the next one
+                self._removehead()
+                offset = 0
+            self._committed = offset
+            return msgs
+
+    def commit(self):
+        """
+        Mark the messages returned by the last read() as consumed.
+        """
+        with self._lock:
+            self._readoffset = self._committed
+            if self._readoffset >= self._writesize and self._iswriting():
+                # every message has been read, so start afresh
+                self._writer.close()
+                self._writer = None
+                self._removehead()
+
+    def _iswriting(self):
+        return self._writer is not None and len(self._segments) == 1
+
+    def _removehead(self):
+        segment = self._segments.pop(0)
+        path = self._segmentpath(segment)
+        if self._reader is not None:
+            self._reader.close()
+            self._reader = None
+        self._size -= os.path.getsize(path)
+        os.unlink(path)
+        self._readoffset = 0
+        self._committed = 0
+
+    def close(self):
+        with self._lock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+            if self._reader is not None:
+                self._reader.close()
+                self._reader = None
@@ -15,11 +15,12 @@
 # You should have received a copy of the GNU General Public License
 # along with Terane.  If not, see <http://www.gnu.org/licenses/>.
 
-import urlparse, ssl
-from loggerglue import constants
+import urlparse, ssl, socket, threading, time, Queue
 from loggerglue.emitter import UDPSyslogEmitter, TCPSyslogEmitter
-from loggerglue.rfc5424 import SyslogEntry, SDElement, StructuredData
 from terane.plugin import IPlugin
+from terane.pipeline import DropEvent
+from terane.sinks.rfc5424 import RFC5424Encoder, encodeparam, stringtoprival
+from terane.sinks.spool import Spool
 from terane.event import Event, FieldIdentifier
 from terane.settings import ConfigureError
 from terane.loggers import getLogger
@@ -29,6 +30,473 @@ logger = getLogger('terane.sinks.syslog')
 # IANA registered private enterprise number for terane
 PEN = 42785
 
+SDID_SCHEMA = "schema@%d" % PEN
+SDID_VALUES = "values@%d" % PEN
+
+_STOP = object()
+
+class SyslogMessage(object):
+    """
+    A formatted syslog message which is missing its schema SD-ELEMENT.  The
+    schema is added by a :class:`SchemaTracker` when the message is written,
+    since which fields need describing depends on the connection.
+    """
+
+    __slots__ = ('header', 'fields', 'values', 'body')
+
+    def __init__(self, header, fields, values, body):
+        self.header = header
+        self.fields = fields
+        self.values = values
+        self.body = body
+
+    def __len__(self):
+        return len(self.header) + len(self.values) + len(self.body)
+
+class SchemaTracker(object):
+    """
+    Tracks which field identifiers have been described to the server over a
+    connection, so that each field's schema entry is sent only the first time
+    the field appears.  Over TCP the tracker is reset whenever the connection
+    is reestablished.  UDP has no connection, and datagrams may be lost or
+    reach a server which restarted, so if interval is specified the whole
+    schema is resent once interval seconds have passed; an interval of 0
+    sends the schema with every message.
+
+    :param params: A dict mapping each field to its encoded schema SD-PARAM,
+      which is shared with the sink.
+    :type params: dict
+    :param interval: The schema resend interval in seconds, or None
+    :type interval: float
+    """
+
+    def __init__(self, params, interval=None):
+        self.params = params
+        self.interval = interval
+        self.announced = set()
+        self.expires = None
+
+    def reset(self):
+        """
+        Forget every field which has been announced.
+        """
+        self.announced = set()
+        self.expires = None
+
+    def _encode(self, msg, fields):
+        params = self.params
+        if len(fields) > 0:
+            schema = "[%s%s]" % (SDID_SCHEMA, ''.join([params[f] for f in fields]))
+        else:
+            schema = ''
+        if schema == '' and msg.values == '':
+            return ''.join((msg.header, '-', msg.body))
+        return ''.join((msg.header, schema, msg.values, msg.body))
+
+    def assemble(self, msg):
+        """
+        Encode the message, describing any fields which haven't been
+        announced yet, and mark them as announced.
+
+        :param msg: The message to encode
+        :type msg: :class:`SyslogMessage`
+        :rtype: str
+        """
+        if self.interval is not None:
+            now = time.time()
+            if self.expires is None or now >= self.expires:
+                self.announced = set()
+                self.expires = now + self.interval
+        announced = self.announced
+        fields = [f for f in msg.fields if f not in announced]
+        announced.update(fields)
+        return self._encode(msg, fields)
+
+    def selfcontained(self, msg):
+        """
+        Encode the message describing all of its fields, without marking
+        them as announced.  This is used for messages which are spooled,
+        since they may be replayed over a different connection.
+
+        :param msg: The message to encode
+        :type msg: :class:`SyslogMessage`
+        :rtype: str
+        """
+        return self._encode(msg, msg.fields)
+
+class SyslogSender(threading.Thread):
+    """
+    Sends messages queued by the sink from a background thread, so a slow or
+    stalled network connection doesn't block the pipeline.  Messages are
+    formatted by the sink before they are queued, and the schema is added and
+    TCP frames are built by the sender, which coalesces as many queued frames
+    as fit in sendsize bytes into each send() call.  UDP messages are sent one
+    datagram at a time.  The sender may also be used without starting its
+    thread, by calling write() directly.
+
+    If a :class:`Spool` is specified, then messages which don't fit in the
+    queue, or which couldn't be sent because the connection failed, are
+    written to the spool instead.  While the connection is down the sender
+    retries with exponential backoff, and once it is back the sender replays
+    the spool whenever the queue is empty.
+
+    If a failover callback is specified (by :class:`SyslogPool`), messages
+    which couldn't be sent are passed to failover(sender, msgs) instead, and
+    the sender reconnects in the background with exponential backoff.
+    """
+
+    def __init__(self, factory, args, queuesize=10000, block=True, sendsize=65536, spool=None,
+                 failover=None, replaylock=None, tracker=None):
+        threading.Thread.__init__(self, name="SyslogSender")
+        self.daemon = True
+        self.factory = factory
+        self.args = args
+        self.emitter = None
+        self.queue = Queue.Queue(queuesize)
+        self.block = block
+        self.sendsize = sendsize
+        self.spool = spool
+        self.failover = failover
+        self.replaylock = replaylock if replaylock is not None else threading.Lock()
+        self.stream = factory is TCPSyslogEmitter
+        self.tracker = tracker if tracker is not None else SchemaTracker(dict())
+        self.retrydelay = 0.0
+        self.retryat = 0.0
+        self.sent = 0
+        self.failed = 0
+        self.failures = 0
+
+    def __str__(self):
+        host,port = self.args['address']
+        return "%s:%i" % (host, port)
+
+    def connect(self):
+        self.emitter = self.factory(**self.args)
+
+    def healthy(self):
+        """
+        :returns: False if the connection failed and the sender is waiting
+          to reconnect.
+        :rtype: bool
+        """
+        return time.time() >= self.retryat
+
+    def _disconnect(self):
+        if self.emitter is not None:
+            self.emitter.close()
+            self.emitter = None
+        # the next connection starts without any fields announced
+        self.tracker.reset()
+
+    def close(self):
+        self._disconnect()
+
+    def _frame(self, data):
+        if self.stream:
+            return "%i %s" % (len(data), data)
+        return data
+
+    def _selfcontained(self, msg):
+        return self._frame(self.tracker.selfcontained(msg))
+
+    def put(self, msg):
+        """
+        Queue a message for sending.
+
+        :returns: False if the queue is full and the message was dropped.
+        :rtype: bool
+        """
+        if self.spool is not None:
+            try:
+                self.queue.put_nowait(msg)
+                return True
+            except Queue.Full:
+                if self.spool.append([self._selfcontained(msg)]) == 1:
+                    return True
+        if self.block:
+            self.queue.put(msg)
+            return True
+        try:
+            self.queue.put_nowait(msg)
+            return True
+        except Queue.Full:
+            return False
+
+    def write(self, msgs):
+        """
+        Send the messages from the calling thread, connecting first if
+        necessary.  If a TCP send fails, the sender reconnects and sends the
+        messages once more.
+
+        :param msgs: The messages to send
+        :type msgs: list of :class:`SyslogMessage`
+        """
+        if self.emitter is None:
+            self.connect()
+        assemble = self.tracker.assemble
+        if not self.stream:
+            for msg in msgs:
+                self.emitter.emit(assemble(msg))
+            return
+        data = ''.join([self._frame(assemble(msg)) for msg in msgs])
+        try:
+            self.emitter.socket.sendall(data)
+        except socket.error, e:
+            logger.warning("send failed, reconnecting: %s" % e)
+            self._disconnect()
+            self.connect()
+            # the new connection needs the schema sent again
+            data = ''.join([self._frame(assemble(msg)) for msg in msgs])
+            self.emitter.socket.sendall(data)
+
+    def _writeraw(self, msgs):
+        if self.emitter is None:
+            self.connect()
+        if not self.stream:
+            for msg in msgs:
+                self.emitter.emit(msg)
+            return
+        self.emitter.socket.sendall(''.join(msgs))
+
+    def _backoff(self):
+        self.retrydelay = min(max(1.0, self.retrydelay * 2), 30.0)
+        self.retryat = time.time() + self.retrydelay
+
+    def _spool(self, msgs):
+        spooled = self.spool.append([self._selfcontained(msg) for msg in msgs])
+        if spooled < len(msgs):
+            logger.error("spool is full, dropped %i messages" % (len(msgs) - spooled))
+            self.failed += len(msgs) - spooled
+
+    def _divert(self, msgs):
+        if self.failover is not None:
+            self.failover(self, msgs)
+        else:
+            self._spool(msgs)
+
+    def _send(self, msgs):
+        diverts = self.spool is not None or self.failover is not None
+        if diverts and time.time() < self.retryat:
+            self._divert(msgs)
+            return
+        try:
+            self.write(msgs)
+            self.sent += len(msgs)
+            self.retrydelay = 0.0
+        except Exception, e:
+            self._disconnect()
+            self.failures += 1
+            if not diverts:
+                logger.error("failed to send %i messages: %s" % (len(msgs), e))
+                self.failed += len(msgs)
+            else:
+                logger.warning("connection to %s failed: %s" % (self, e))
+                self._backoff()
+                self._divert(msgs)
+
+    def _reconnect(self):
+        try:
+            self.connect()
+            self.retrydelay = 0.0
+            self.retryat = 0.0
+            logger.info("reconnected to %s" % self)
+        except Exception, e:
+            self.failures += 1
+            logger.debug("failed to reconnect to %s: %s" % (self, e))
+            self._backoff()
+
+    def _replay(self):
+        """
+        Send spooled messages until the spool is empty, a message arrives in
+        the queue, or sending fails.
+        """
+        # only one sender in a pool may replay the spool at a time
+        if not self.replaylock.acquire(False):
+            return
+        try:
+            while self.queue.empty() and time.time() >= self.retryat:
+                msgs = self.spool.read(self.sendsize)
+                if len(msgs) == 0:
+                    return
+                try:
+                    # spooled messages are already framed and self-contained
+                    self._writeraw(msgs)
+                except Exception, e:
+                    logger.warning("failed to replay spooled messages: %s" % e)
+                    self._disconnect()
+                    self.failures += 1
+                    self._backoff()
+                    return
+                self.spool.commit()
+                self.sent += len(msgs)
+                self.retrydelay = 0.0
+                # spooled messages may have been written by an earlier process
+                # which numbered its fields differently, and describe their
+                # fields with those numbers, so announce every field again
+                self.tracker.reset()
+        finally:
+            self.replaylock.release()
+
+    def run(self):
+        stopped = False
+        while not stopped:
+            # if the spool needs replaying or the connection needs to be
+            # reestablished, wake up periodically to do it
+            timeout = None
+            if self.spool is not None and not self.spool.empty():
+                timeout = 0.5
+            reconnecting = self.failover is not None and self.emitter is None and self.retryat > 0.0
+            if reconnecting:
+                timeout = max(0.01, min(0.5, self.retryat - time.time()))
+            try:
+                msg = self.queue.get(True, timeout)
+            except Queue.Empty:
+                msg = None
+            if msg is _STOP:
+                break
+            if reconnecting and self.healthy():
+                self._reconnect()
+            if msg is not None:
+                msgs = [msg]
+                size = len(msg)
+                while size < self.sendsize:
+                    try:
+                        msg = self.queue.get_nowait()
+                    except Queue.Empty:
+                        break
+                    if msg is _STOP:
+                        stopped = True
+                        break
+                    msgs.append(msg)
+                    size += len(msg)
+                self._send(msgs)
+            if self.spool is not None and not stopped:
+                self._replay()
+        self._disconnect()
+
+    def stop(self):
+        """
+        Send every queued message, then stop the sender thread.  If there is
+        a spool, messages which could not be sent remain in the spool.
+        """
+        self.queue.put(_STOP)
+        self.join()
+
+class SyslogPool(object):
+    """
+    Distributes messages across a :class:`SyslogSender` for each of several
+    hosts, either round-robin or to the sender with the shortest queue.
+    Senders whose connection failed are skipped until they reconnect, and the
+    messages they failed to send are passed to the other senders, or to the
+    spool if no other sender is available.
+    """
+
+    def __init__(self, senders, leastloaded=False, block=True, spool=None):
+        self.senders = senders
+        self.leastloaded = leastloaded
+        self.block = block
+        self.spool = spool
+        self.stream = senders[0].stream
+        self.index = 0
+        replaylock = threading.Lock()
+        for sender in senders:
+            sender.spool = spool
+            sender.failover = self.failover
+            sender.replaylock = replaylock
+
+    def __str__(self):
+        return "SyslogPool(%s)" % ", ".join([str(sender) for sender in self.senders])
+
+    @property
+    def failed(self):
+        return sum([sender.failed for sender in self.senders])
+
+    def start(self):
+        for sender in self.senders:
+            try:
+                sender.connect()
+            except Exception, e:
+                logger.warning("failed to connect to %s: %s" % (sender, e))
+                sender.failures += 1
+                sender._backoff()
+            sender.start()
+
+    def _select(self, exclude=None):
+        """
+        :returns: The next healthy sender, or None if there are none.
+        :rtype: :class:`SyslogSender`
+        """
+        if self.leastloaded:
+            healthy = [s for s in self.senders if s is not exclude and s.healthy()]
+            if len(healthy) == 0:
+                return None
+            return min(healthy, key=lambda s: s.queue.qsize())
+        nsenders = len(self.senders)
+        for i in xrange(nsenders):
+            sender = self.senders[(self.index + i) % nsenders]
+            if sender is not exclude and sender.healthy():
+                self.index = (self.index + i + 1) % nsenders
+                return sender
+        return None
+
+    def put(self, msg):
+        """
+        Queue a message for sending.
+
+        :returns: False if the message was dropped.
+        :rtype: bool
+        """
+        sender = self._select()
+        if sender is not None:
+            try:
+                sender.queue.put_nowait(msg)
+                return True
+            except Queue.Full:
+                pass
+        if self.spool is not None:
+            spooled = self.spool.append([self.senders[0]._selfcontained(msg)])
+            if spooled == 1:
+                return True
+        if sender is None:
+            # every host is down, so queue for whichever reconnects first
+            sender = min(self.senders, key=lambda s: s.retryat)
+        if self.block:
+            sender.queue.put(msg)
+            return True
+        try:
+            sender.queue.put_nowait(msg)
+            return True
+        except Queue.Full:
+            return False
+
+    def failover(self, failed, msgs):
+        """
+        Called from a sender thread with the messages it failed to send.
+        """
+        for i in xrange(len(msgs)):
+            sender = self._select(exclude=failed)
+            if sender is not None:
+                try:
+                    sender.queue.put_nowait(msgs[i])
+                    continue
+                except Queue.Full:
+                    pass
+            if self.spool is not None:
+                failed._spool(msgs[i:])
+            else:
+                logger.error("no connection available, dropped %i messages" % (len(msgs) - i))
+                failed.failed += len(msgs) - i
+            return
+
+    def stop(self):
+        for sender in self.senders:
+            sender.queue.put(_STOP)
+        for sender in self.senders:
+            sender.join()
+        for sender in self.senders:
+            logger.info("%s: sent %i, failed %i, %i connection failures" % (
+                sender, sender.sent, sender.failed, sender.failures))
+
 class SyslogSink(IPlugin):
     """
     Send received events to a syslog server via TCP or UDP.
@@ -40,106 +508,201 @@ class SyslogSink(IPlugin):
     PROCID = FieldIdentifier('procid', FieldIdentifier.LITERAL)
     MSGID = FieldIdentifier('msgid', FieldIdentifier.LITERAL)
 
-    SDID_SCHEMA = "schema@%d" % PEN
-    SDID_VALUES = "values@%d" % PEN
+    SDID_SCHEMA = SDID_SCHEMA
+    SDID_VALUES = SDID_VALUES
 
     def __init__(self, *args, **kwargs):
         self.factory = TCPSyslogEmitter
         self.address = 'localhost'
         self.port = 514
         self.args = dict(address=(self.address,self.port))
-        self.emitter = None
+        self.connection = None
         self._schema = dict()
-        self._alwayssendschema = True
+        self._schemaparams = dict()
+        self.schemainterval = None
+        self.background = False
+        self.queuesize = 10000
+        self.block = True
+        self.sendsize = 65536
+        self.sender = None
+        self.encoder = RFC5424Encoder()
+        self.spooldir = None
+        self.spoolsize = 1024 * 1024 * 1024
+        self.segmentsize = 16 * 1024 * 1024
+        self.hosts = list()
+        self.leastloaded = False
 
     def __str__(self):
         return "SyslogSink(%s, %s)" % (self.factory.__name__,
           " ".join(["%s=%s" % (k,v) for k,v in self.args.items()]))
 
+    def _parsehost(self, url):
+        """
+        Parse a host URL into an emitter factory and its arguments.
+
+        :returns: A tuple containing the factory and a dict of arguments.
+        :rtype: tuple
+        """
+        url = urlparse.urlparse(url)
+        netloc = url.netloc if url.netloc != '' else url.path
+        if netloc == '':
+            raise ConfigureError("host '%s' is not a valid value" % netloc)
+        address,port = netloc.split(':', 1)
+        args = dict(address=(address,int(port)))
+        if url.scheme == 'syslog.udp':
+            factory = UDPSyslogEmitter
+        elif url.scheme == 'syslog.tcp' or url.scheme == '':
+            factory = TCPSyslogEmitter
+        elif url.scheme == 'syslog.tcptls':
+            factory = TCPSyslogEmitter
+            args.update(dict(cert_reqs=ssl.CERT_NONE))
+        else:
+            raise ConfigureError("host has unknown transport scheme '%s'" % url.scheme)
+        return factory, args
+
     def configure(self, section):
-        url = section.getString("host", None)
-        if url != None:
-            url = urlparse.urlparse(url)
-            netloc = url.netloc if url.netloc != '' else url.path
-            if netloc == '':
-                raise ConfigureError("host '%s' is not a valid value" % netloc)
-            self.address,port = netloc.split(':', 1)
-            self.port = int(port)
-            self.args.update(dict(address=(self.address,self.port)))
-            if url.scheme == 'syslog.udp':
-                self.factory = UDPSyslogEmitter
-            elif url.scheme == 'syslog.tcp' or url.scheme == '':
-                self.factory = TCPSyslogEmitter
-            elif url.scheme == 'syslog.tcptls':
-                self.factory = TCPSyslogEmitter
-                self.args.update(dict(cert_reqs=ssl.CERT_NONE))
-            else:
-                raise ConfigureError("host has unknown transport scheme '%s'" % url.scheme)
+        # a comma-separated list of hosts is sent to using a connection pool
+        urls = section.getList("host", str, None)
+        if urls != None and len(urls) > 0:
+            self.factory,args = self._parsehost(urls[0])
+            self.address,self.port = args['address']
+            self.args.update(args)
+            self.hosts = list()
+            for url in urls[1:]:
+                factory,args = self._parsehost(url)
+                if factory is not self.factory:
+                    raise ConfigureError("every host must use the same transport")
+                self.hosts.append(args)
+        # distribute events between hosts 'round-robin' or 'least-loaded'
+        distribution = section.getString("distribution", "least-loaded" if self.leastloaded else "round-robin")
+        if distribution not in ('round-robin', 'least-loaded'):
+            raise ConfigureError("distribution must be 'round-robin' or 'least-loaded'")
+        self.leastloaded = distribution == 'least-loaded'
+        # send from a background thread instead of the pipeline thread
+        self.background = section.getBoolean("async", self.background)
+        # the maximum number of messages waiting to be sent
+        self.queuesize = section.getInt("queue size", self.queuesize)
+        # when the queue is full, either block the pipeline or drop the event
+        queuefull = section.getString("queue full", "block" if self.block else "drop")
+        if queuefull not in ('block', 'drop'):
+            raise ConfigureError("queue full must be 'block' or 'drop'")
+        self.block = queuefull == 'block'
+        # coalesce queued messages into writes of up to this many bytes
+        self.sendsize = section.getInt("send size", self.sendsize)
+        # spool messages to disk when the network is congested or down
+        self.spooldir = section.getPath("spool directory", self.spooldir)
+        self.spoolsize = section.getInt("spool size", self.spoolsize)
+        self.segmentsize = section.getInt("spool segment size", self.segmentsize)
+        # each field's schema is sent once per TCP connection, but UDP has
+        # no connection, so resend the whole schema this often (0 means
+        # with every message)
+        self.schemainterval = section.getFloat("schema interval", self.schemainterval)
+        if self.spooldir != None and not self.background:
+            logger.info("enabling async mode, which is required by the spool")
+            self.background = True
+        if len(self.hosts) > 0 and not self.background:
+            logger.info("enabling async mode, which is required by multiple hosts")
+            self.background = True
 
     def init(self):
         logger.debug("using %s with params %s" % (self.factory.__name__,
           " ".join(["%s=%s" % (k,v) for k,v in self.args.items()])))
-        self.emitter = self.factory(**self.args)
-        if self.factory == TCPSyslogEmitter:
-            self._alwayssendschema = False
+        interval = self.schemainterval
+        if interval == None and self.factory == UDPSyslogEmitter:
+            interval = 60.0
+        if not self.background:
+            self.connection = SyslogSender(self.factory, self.args,
+                tracker=SchemaTracker(self._schemaparams, interval))
+            self.connection.connect()
+            return
+        spool = None
+        if self.spooldir != None:
+            spool = Spool(self.spooldir, self.spoolsize, self.segmentsize)
+        if len(self.hosts) > 0:
+            senders = list()
+            for args in [self.args] + self.hosts:
+                senders.append(SyslogSender(self.factory, args, self.queuesize,
+                    self.block, self.sendsize,
+                    tracker=SchemaTracker(self._schemaparams, interval)))
+            self.sender = SyslogPool(senders, self.leastloaded, self.block, spool)
+            self.sender.start()
+            return
+        self.sender = SyslogSender(self.factory, self.args, self.queuesize,
+            self.block, self.sendsize, spool,
+            tracker=SchemaTracker(self._schemaparams, interval))
+        # without a spool there is nowhere to put events if the server is down
+        if spool == None:
+            self.sender.connect()
+        self.sender.start()
 
     def fini(self):
-        if self.emitter != None:
-            self.emitter.close()
+        if self.sender != None:
+            self.sender.stop()
+            if self.sender.failed > 0:
+                logger.warning("failed to send %i messages" % self.sender.failed)
+            if self.sender.spool != None:
+                self.sender.spool.close()
+            self.sender = None
+        if self.connection != None:
+            self.connection.close()
+            self.connection = None
 
-    def _stringtoprival(self, facility, severity):
-        _facility = getattr(constants, "LOG_" + facility.upper())
-        _severity = getattr(constants, "LOG_" + severity.upper())
-        return _facility + _severity
+    _special = frozenset((Event.SOURCE, Event.ORIGIN, Event.TIMESTAMP, Event.MESSAGE, FACILITY, SEVERITY, APPNAME, PROCID, MSGID))
 
-    _special = (Event.SOURCE, Event.ORIGIN, Event.TIMESTAMP, Event.MESSAGE, FACILITY, SEVERITY, APPNAME, PROCID, MSGID)
-
-    def consume(self, event):
+    def _format(self, event):
         """
-        Convert the incoming event into a syslog message and send it.
+        Convert the event into a syslog message.  The schema SD-ELEMENT is
+        left out, and is added by the connection the message is sent over.
 
-        :param event: The :class:`Event` to send
+        :param event: The :class:`Event` to format
         :type event: :class:`Event`
+        :returns: The formatted message
+        :rtype: :class:`SyslogMessage`
         """
         origin = event.origin(None)
         timestamp = event.timestamp(None)
         message = event.message(None)
         severity = event.get(SyslogSink.SEVERITY, "info")
         facility = event.get(SyslogSink.FACILITY, "daemon")
-        prival = self._stringtoprival(facility, severity)
+        prival = stringtoprival(facility, severity)
         appname = event.get(SyslogSink.APPNAME, None)
         procid = event.get(SyslogSink.PROCID, None)
         msgid = event.get(SyslogSink.MSGID, None)
 
-        schema = list()
-        values = dict()
-        for (fieldname,fieldtype) in event.keys():
-            field = FieldIdentifier(fieldname, fieldtype)
+        fields = list()
+        values = list()
+        for field in event.keys():
             if not field in SyslogSink._special:
-                if not field in self._schema:
+                ident = self._schema.get(field)
+                if ident is None:
                     ident = str(len(self._schema) + 1)
-                    schema.append(field)
                     self._schema[field] = ident
-                    values[ident] = event.stringify(field)
-                else:
-                    ident = self._schema[field]
-                    if self._alwayssendschema:
-                        schema.append(field)
-                    values[ident] = event.stringify(field)
-
-        elements = list()
-        if len(schema) > 0:
-            elements.append(SDElement(SyslogSink.SDID_SCHEMA, [(self._schema[f],str(f)) for f in schema]))
+                    self._schemaparams[field] = encodeparam(ident, str(field))
+                fields.append(field)
+                values.append((ident, event.stringify(field)))
+
+        encoder = self.encoder
+        header = encoder.header(prival, timestamp, origin, appname, procid, msgid)
         if len(values) > 0:
-            elements.append(SDElement(SyslogSink.SDID_VALUES, values))
-        sdata = None if len(elements) == 0 else StructuredData(elements)
-
-        msg = SyslogEntry(prival=prival,
-                          timestamp=timestamp,
-                          hostname=origin,
-                          app_name=appname,
-                          procid=procid,
-                          msgid=msgid,
-                          structured_data=sdata,
-                          msg=message)
-        self.emitter.emit(msg)
+            values = encoder.elements([(SDID_VALUES, values)])
+        else:
+            values = ''
+        return SyslogMessage(header, fields, values, encoder.message(message))
+
+    def consume(self, event):
+        """
+        Convert the incoming event into a syslog message and send it.  In
+        async mode the message is queued for the sender thread, and if the
+        queue is full and the sink is configured to drop then DropEvent is
+        raised.
+
+        :param event: The :class:`Event` to send
+        :type event: :class:`Event`
+        :raises: :class:`DropEvent`
+        """
+        msg = self._format(event)
+        if self.sender == None:
+            self.connection.write([msg])
+            return
+        if not self.sender.put(msg):
+            raise DropEvent("send queue is full")
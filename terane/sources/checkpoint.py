@@ -0,0 +1,113 @@
+# Copyright 2013 Michael Frank <msfrank@syntaxjockey.com>
+#
+# This file is part of Terane.
+#
+# Terane is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Terane is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Terane.  If not, see <http://www.gnu.org/licenses/>.
+
+import os, time, json, errno
+from terane.loggers import getLogger
+
+logger = getLogger('terane.sources.checkpoint')
+
+class CheckpointStore(object):
+    """
+    Persists the read offsets of file sources in a small state file, so a
+    source can resume where it left off after a restart.  Each offset is
+    keyed by path, and records the inode and device of the file it refers
+    to, so a file which was replaced while we were down is detected.
+
+    Updates are kept in memory and written to disk when either interval
+    seconds have elapsed or count updates have accumulated since the last
+    write.  The state file is replaced atomically and fsync'd on every write.
+    """
+
+    def __init__(self, path, interval=5.0, count=1000):
+        self.path = path
+        self.interval = interval
+        self.count = count
+        self._entries = dict()
+        self._updates = 0
+        self._lastflush = time.time()
+        self._load()
+
+    def __str__(self):
+        return "CheckpointStore(path=%s, interval=%s, count=%i)" % (self.path, self.interval, self.count)
+
+    def _load(self):
+        try:
+            with open(self.path, 'r') as f:
+                self._entries = json.load(f)
+            logger.debug("loaded %i checkpoints from %s" % (len(self._entries), self.path))
+        except (IOError,OSError), e:
+            if e.errno != errno.ENOENT:
+                raise
+        except ValueError, e:
+            logger.warning("ignoring corrupt checkpoint file %s: %s" % (self.path, e))
+
+    def lookup(self, path, stats):
+        """
+        Return the checkpointed offset for the specified file.
+
+        :param path: The file path
+        :type path: str
+        :param stats: The current stat() result for the file
+        :returns: The offset to resume from, 0 if the file was replaced or
+          truncated since the checkpoint was taken, or None if there is no
+          checkpoint for the path.
+        :rtype: int
+        """
+        entry = self._entries.get(path, None)
+        if entry is None:
+            return None
+        if entry['ino'] != stats.st_ino or entry['dev'] != stats.st_dev:
+            logger.info("%s was replaced since the last checkpoint" % path)
+            return 0
+        if entry['offset'] > stats.st_size:
+            logger.info("%s was truncated since the last checkpoint" % path)
+            return 0
+        return entry['offset']
+
+    def update(self, path, ino, dev, offset):
+        """
+        Record the offset for the specified file, writing the state file if
+        the flush interval or count has been reached.
+        """
+        self._entries[path] = {'ino': ino, 'dev': dev, 'offset': offset}
+        self._updates += 1
+        if self._updates >= self.count or time.time() - self._lastflush >= self.interval:
+            self.flush()
+
+    def flush(self):
+        """
+        Write all pending updates to the state file.
+        """
+        self._lastflush = time.time()
+        if self._updates == 0:
+            return
+        tmppath = self.path + '.tmp'
+        with open(tmppath, 'w') as f:
+            json.dump(self._entries, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(tmppath, self.path)
+        # fsync the directory so the rename is durable
+        dirfd = os.open(os.path.dirname(os.path.abspath(self.path)), os.O_RDONLY)
+        try:
+            os.fsync(dirfd)
+        finally:
+            os.close(dirfd)
+        self._updates = 0
+
+    def close(self):
+        self.flush()
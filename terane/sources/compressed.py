@@ -0,0 +1,315 @@
+# Copyright 2013 Michael Frank <msfrank@syntaxjockey.com>
+#
+# This file is part of Terane.
+#
+# Terane is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Terane is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Terane.  If not, see <http://www.gnu.org/licenses/>.
+
+import io, zlib, bz2, threading, Queue
+from terane.loggers import getLogger
+
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma = None
+
+logger = getLogger('terane.sources.compressed')
+
+GZIP = 'gzip'
+BZIP2 = 'bzip2'
+XZ = 'xz'
+
+_magic = [
+    ('\x1f\x8b', GZIP),
+    ('BZh', BZIP2),
+    ('\xfd7zXZ\x00', XZ),
+    ]
+
+def _gzipdecompressor():
+    return zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+def _xzdecompressor():
+    return lzma.LZMADecompressor()
+
+_decompressors = {
+    GZIP: _gzipdecompressor,
+    BZIP2: bz2.BZ2Decompressor,
+    XZ: _xzdecompressor,
+    }
+
+def _gzipended(decompressor):
+    # python 2 zlib has no eof attribute, but input following the end of
+    # the stream is left in unused_data
+    probe = decompressor.copy()
+    try:
+        probe.decompress('\x00')
+    except zlib.error:
+        return False
+    return probe.unused_data == '\x00'
+
+def _bzip2ended(decompressor):
+    try:
+        decompressor.decompress('')
+    except EOFError:
+        return True
+    return False
+
+def _xzended(decompressor):
+    # pyliblzma has no eof attribute, so the end of the stream can't be checked
+    return getattr(decompressor, 'eof', True)
+
+_ended = {
+    GZIP: _gzipended,
+    BZIP2: _bzip2ended,
+    XZ: _xzended,
+    }
+
+_errors = (zlib.error, IOError, EOFError)
+if lzma is not None:
+    _errors += (lzma.LZMAError,)
+
+class CompressionError(Exception):
+    """
+    Raised when a compressed file can't be decompressed.
+    """
+
+def detectcompression(path):
+    """
+    Detect the compression format of the specified file from its magic bytes.
+
+    :param path: The file path
+    :type path: str
+    :returns: GZIP, BZIP2 or XZ, or None if the file is not compressed.
+    :rtype: str
+    """
+    with open(path, 'rb') as f:
+        header = f.read(6)
+    for magic,compression in _magic:
+        if header.startswith(magic):
+            return compression
+    return None
+
+class DecompressingReader(io.RawIOBase):
+    """
+    A raw stream which decompresses the underlying file as it is read.
+    Concatenated streams, as produced by 'cat a.gz b.gz' or pbzip2, are
+    decompressed one after another.
+
+    Output is produced in bounded pieces, so a small file which expands to
+    a huge amount of data can't exhaust memory.  gzip output is limited to
+    blocksize bytes per step using the max_length argument of zlib.  The
+    bz2 and lzma decompressors in python 2 have no such argument, so their
+    input is fed in slices which start at minfeed bytes, grow while the
+    output is small and shrink while it is larger than blocksize.  A step
+    then produces at most the output of the compressed blocks in the slice;
+    note that a single bzip2 block can expand to about 45MB.
+
+    If the file ends before the end of the last stream, or the data is
+    corrupt, :class:`CompressionError` is raised.
+    """
+
+    def __init__(self, f, compression, blocksize=1024 * 1024, minfeed=16, maxfeed=64 * 1024):
+        if compression == XZ and lzma is None:
+            raise CompressionError("xz decompression requires the lzma module")
+        self._f = f
+        self._factory = _decompressors[compression]
+        self._decompressor = self._factory()
+        self._ended = _ended[compression]
+        self._fed = False
+        self._bounded = compression == GZIP
+        self._blocksize = blocksize
+        self._minfeed = minfeed
+        self._maxfeed = maxfeed
+        self._feedsize = minfeed
+        self._input = ''
+        self._inoffset = 0
+        self._pending = ''
+        self._offset = 0
+
+    def readable(self):
+        return True
+
+    def _decompress(self):
+        """
+        Decompress the next piece of the pending input.
+
+        :returns: The decompressed data, or '' if the input is exhausted.
+        :rtype: str
+        """
+        while self._inoffset < len(self._input):
+            try:
+                self._fed = True
+                if self._bounded:
+                    data = self._decompressor.decompress(self._input, self._blocksize)
+                    self._input = self._decompressor.unconsumed_tail
+                else:
+                    end = self._inoffset + self._feedsize
+                    data = self._decompressor.decompress(self._input[self._inoffset:end])
+                    self._inoffset = min(end, len(self._input))
+            except EOFError:
+                # the previous stream ended exactly at the end of the input
+                self._decompressor = self._factory()
+                self._fed = False
+                continue
+            # start a new decompressor for each concatenated stream
+            unused = self._decompressor.unused_data
+            if unused != '':
+                self._decompressor = self._factory()
+                self._fed = False
+                self._input = unused + self._input[self._inoffset:]
+                self._inoffset = 0
+            if not self._bounded:
+                if len(data) > self._blocksize:
+                    self._feedsize = max(self._minfeed, self._feedsize / 2)
+                elif len(data) < self._blocksize / 4:
+                    self._feedsize = min(self._maxfeed, self._feedsize * 2)
+            if data != '':
+                return data
+        return ''
+
+    def _finish(self):
+        """
+        Check that the last stream is complete once the input is exhausted.
+
+        :returns: Any remaining decompressed data.
+        :rtype: str
+        :raises: :class:`CompressionError`
+        """
+        if not self._fed:
+            return ''
+        self._fed = False
+        if not self._ended(self._decompressor):
+            raise CompressionError("failed to decompress %s: unexpected end of file" % self._f.name)
+        if self._bounded:
+            return self._decompressor.flush()
+        return ''
+
+    def readinto(self, b):
+        while self._offset == len(self._pending):
+            eof = False
+            if self._inoffset == len(self._input):
+                self._input = self._f.read(self._blocksize)
+                self._inoffset = 0
+                eof = self._input == ''
+            try:
+                if eof:
+                    self._pending = self._finish()
+                else:
+                    self._pending = self._decompress()
+            except _errors, e:
+                raise CompressionError("failed to decompress %s: %s" % (self._f.name, e))
+            self._offset = 0
+            if eof and self._pending == '':
+                return 0
+        n = min(len(b), len(self._pending) - self._offset)
+        b[:n] = self._pending[self._offset:self._offset + n]
+        self._offset += n
+        return n
+
+    def close(self):
+        if not self.closed:
+            self._f.close()
+        io.RawIOBase.close(self)
+
+class BackgroundReader(io.RawIOBase):
+    """
+    A raw stream which reads blocks from another stream in a background
+    thread, so that reading (and decompressing) the input overlaps with
+    processing it.  At most depth blocks are buffered.
+    """
+
+    def __init__(self, raw, blocksize=1024 * 1024, depth=4):
+        self._raw = raw
+        self._blocksize = blocksize
+        self._queue = Queue.Queue(depth)
+        self._stopped = False
+        self._pending = ''
+        self._offset = 0
+        self._eof = False
+        self._thread = threading.Thread(target=self._run, name="BackgroundReader")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def readable(self):
+        return True
+
+    def _run(self):
+        try:
+            while not self._stopped:
+                data = self._raw.read(self._blocksize)
+                self._queue.put(data)
+                if data == '':
+                    break
+        except Exception, e:
+            self._queue.put(e)
+
+    def readinto(self, b):
+        while self._offset == len(self._pending):
+            if self._eof:
+                return 0
+            data = self._queue.get()
+            if isinstance(data, Exception):
+                self._eof = True
+                raise data
+            if data == '':
+                self._eof = True
+                return 0
+            self._pending = data
+            self._offset = 0
+        n = min(len(b), len(self._pending) - self._offset)
+        b[:n] = self._pending[self._offset:self._offset + n]
+        self._offset += n
+        return n
+
+    def close(self):
+        if not self.closed:
+            self._stopped = True
+            # unblock the reader thread if it is waiting for queue space
+            while self._thread.is_alive():
+                try:
+                    self._queue.get_nowait()
+                except Queue.Empty:
+                    pass
+                self._thread.join(0.1)
+            self._raw.close()
+        io.RawIOBase.close(self)
+
+def opencompressed(path, compression, encoding, buffersize=1024 * 1024, background=False):
+    """
+    Open the specified compressed file for reading decoded lines.
+
+    :param path: The file path
+    :type path: str
+    :param compression: The compression format, as returned by detectcompression()
+    :type compression: str
+    :param encoding: The text encoding of the decompressed data
+    :type encoding: str
+    :param buffersize: The size of the compressed and decompressed read buffers
+    :type buffersize: int
+    :param background: If True, decompress in a background thread
+    :type background: bool
+    :returns: A text stream
+    :rtype: :class:`io.TextIOWrapper`
+    """
+    f = io.open(path, 'rb', buffering=0)
+    try:
+        raw = DecompressingReader(f, compression, buffersize)
+    except:
+        f.close()
+        raise
+    if background:
+        raw = BackgroundReader(raw, buffersize)
+    return io.TextIOWrapper(io.BufferedReader(raw, buffersize), encoding=encoding, newline='\n')
@@ -15,9 +15,15 @@
 # You should have received a copy of the GNU General Public License
 # along with Terane.  If not, see <http://www.gnu.org/licenses/>.
 
-import sys, codecs, time, socket
+import os, sys, codecs, socket, mmap, errno
+from collections import deque
+from multiprocessing import Pool
 from terane.plugin import IPlugin
-from terane.event import Event
+from terane.event import Event, CoarseClock, parsefield
+from terane.sources.checkpoint import CheckpointStore
+from terane.sources.compressed import detectcompression, opencompressed
+from terane.parallel import imapbounded, ignoresigint
+from terane.settings import ConfigureError
 from terane.loggers import getLogger
 
 logger = getLogger('terane.sources.file')
@@ -27,14 +33,60 @@ class AbstractFileSource(object):
     Abstract base class for file sources, implementing common logic.
     """
     def __init__(self, *args, **kwargs):
+        self._clock = CoarseClock()
         self.hostname = socket.getfqdn()
         self.linemax = 16384
+        self.checkpointfile = None
+        self.checkpointinterval = 5.0
+        self.checkpointcount = 1000
+        self.checkpoints = None
+        self._emitted = None
 
     def configure(self, section):
         # use the specified origin, otherwise default to host fqdn
         self.hostname = section.getString("origin", self.hostname)
         # ignore lines longer than max line length
         self.linemax = section.getInt("max line length", self.linemax)
+        # persist read offsets to the checkpoint file, if specified
+        self.checkpointfile = section.getPath("checkpoint file", self.checkpointfile)
+        self.checkpointinterval = section.getFloat("checkpoint interval", self.checkpointinterval)
+        self.checkpointcount = section.getInt("checkpoint count", self.checkpointcount)
+
+    def _initcheckpoints(self):
+        if self.checkpointfile != None:
+            self.checkpoints = CheckpointStore(self.checkpointfile,
+                self.checkpointinterval, self.checkpointcount)
+        self._emitted = None
+
+    def _finicheckpoints(self):
+        if self.checkpoints != None:
+            self.checkpoints.close()
+            self.checkpoints = None
+
+    def _mark(self):
+        """
+        Subclasses supporting checkpoints must implement this method.
+
+        :returns: The path, inode, device and offset of the next unread line.
+        :rtype: tuple
+        """
+        raise NotImplementedError()
+
+    def checkpoint(self):
+        """
+        Return a token marking the position after the last emitted event.
+        Once the event has been consumed the token should be passed to
+        commit().
+        """
+        return self._emitted
+
+    def commit(self, token):
+        """
+        Record the position marked by the specified token in the checkpoint
+        file, if checkpointing is enabled.
+        """
+        if token != None and self.checkpoints != None:
+            self.checkpoints.update(*token)
 
     def readline(self):
         """
@@ -58,6 +110,30 @@ class AbstractFileSource(object):
                 if line[-1] == '\n' and len(stripped) > 0:
                     return line
 
+    def _gethostname(self):
+        return self._hostname
+
+    def _sethostname(self, hostname):
+        self._hostname = hostname
+        # convert the origin once, rather than for every event
+        self._origin = parsefield(Event.ORIGIN, hostname)
+
+    hostname = property(_gethostname, _sethostname)
+
+    def _makeevent(self, message):
+        """
+        Construct an event for the specified message.  The values are built
+        as native types directly, avoiding the float to datetime conversion
+        in :class:`Event`, and the timestamp comes from a coarse clock.
+        """
+        if message.__class__ is not unicode:
+            message = unicode(message)
+        return Event.fromparsed(Event.EMPTY_ID, {
+            Event.MESSAGE: message,
+            Event.TIMESTAMP: self._clock.now(),
+            Event.ORIGIN: self._origin,
+        })
+
     def _emit(self):
         line = self.readline()
         # no more data is available
@@ -66,19 +142,9 @@ class AbstractFileSource(object):
         stripped = line.strip()
         # we read a complete line, return it
         if line[-1] == '\n' and len(stripped) > 0:
-            values = {
-                Event.MESSAGE: stripped,
-                Event.TIMESTAMP: time.time() * 1000.0,
-            	Event.ORIGIN: self.hostname,
-            }
-            return Event(Event.EMPTY_ID, values)
+            return self._makeevent(stripped)
         # else we have encountered a long line, throw away data until the next line
-        values = {
-            Event.MESSAGE: self._skipnext().strip(),
-            Event.TIMESTAMP: time.time() * 1000.0,
-            Event.ORIGIN: self.hostname,
-        }
-        return Event(Event.EMPTY_ID, values)
+        return self._makeevent(self._skipnext().strip())
 
     def emit(self):
         """
@@ -90,51 +156,332 @@ class AbstractFileSource(object):
         :raises: StopIteration
         """
         try:
-            return self._emit()
+            event = self._emit()
         except KeyboardInterrupt:
             raise StopIteration
+        if self.checkpoints != None:
+            self._emitted = self._mark()
+        return event
 
 
+_mapped = dict()
+
+def _readchunk(args):
+    """
+    Decode the lines in the specified byte range of a file.  This runs in a
+    worker process; the file is mapped once per process and reused for
+    every subsequent chunk.
+
+    :param args: A tuple of (path, start, end, encoding, linemax)
+    :returns: A tuple of (start, end, lines), where lines is a list of the
+      stripped, non-empty lines in the chunk no longer than linemax.
+    :rtype: tuple
+    """
+    path,start,end,encoding,linemax = args
+    m = _mapped.get(path, None)
+    if m is None or len(m) < end:
+        with open(path, 'rb') as f:
+            m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        _mapped[path] = m
+    lines = m[start:end].decode(encoding).split(u'\n')
+    # the last line is empty if the chunk ends with a newline, otherwise it
+    # is an incomplete line at the end of the file, which is discarded
+    lines.pop()
+    # linemax includes the trailing newline, as with readline()
+    linemax = sys.maxint if linemax == None else linemax - 1
+    chunk = list()
+    for line in lines:
+        if len(line) > linemax:
+            continue
+        line = line.strip()
+        if line != u'':
+            chunk.append(line)
+    return start, end, chunk
+
 class FileSource(IPlugin, AbstractFileSource):
     """
-    Read in lines from the specified file.
+    Read in lines from the specified file.  If workers is greater than 1,
+    the file is memory-mapped and split into newline-aligned chunks, which
+    are decoded in parallel by a pool of worker processes.  Files compressed
+    with gzip, bzip2 or xz are detected by their magic bytes and decompressed
+    as they are read.
     """
     def __init__(self, *args, **kwargs):
         AbstractFileSource.__init__(self, *args, **kwargs)
         self.path = None
         self.encoding = 'utf-8'
+        self.workers = 1
+        self.chunksize = 4 * 1024 * 1024
+        self.ordered = True
+        self.buffersize = 1024 * 1024
+        self.decompressthread = False
+        self.parallel = False
 
     def __str__(self):
-        return "FileSource(path=%s, encoding=%s, origin=%s, linemax=%d)" % (self.path, self.encoding, self.hostname, self.linemax)
+        return "FileSource(path=%s, encoding=%s, origin=%s, linemax=%d, workers=%d)" % (self.path, self.encoding, self.hostname, self.linemax, self.workers)
 
     def configure(self, section):
         AbstractFileSource.configure(self, section)
         self.path = section.getPath("path", self.path)
         self.encoding = section.getString("encoding", self.encoding)
+        # decode the file in parallel using this many worker processes
+        self.workers = section.getInt("workers", self.workers)
+        # the approximate size in bytes of the chunks handed to each worker
+        self.chunksize = section.getInt("chunk size", self.chunksize)
+        # if False, emit chunks in the order they finish decoding
+        self.ordered = section.getBoolean("ordered", self.ordered)
+        # read compressed files in blocks of this size
+        self.buffersize = section.getInt("read buffer size", self.buffersize)
+        # decompress in a background thread, overlapping with processing
+        self.decompressthread = section.getBoolean("decompress thread", self.decompressthread)
+        if self.workers > 1:
+            try:
+                if u'\n'.encode(self.encoding) != '\n':
+                    raise ConfigureError("encoding %s is not supported with multiple workers" % self.encoding)
+            except LookupError, e:
+                raise ConfigureError(str(e))
+            if not self.ordered and self.checkpointfile != None:
+                logger.warning("checkpoints are disabled for unordered file source %s" % self.path)
+                self.checkpointfile = None
 
     def init(self):
+        self.parallel = False
+        compression = detectcompression(self.path)
+        if compression != None:
+            return self._initcompressed(compression)
+        if self.workers > 1:
+            self.parallel = True
+            return self._initparallel()
         self.f = codecs.open(self.path, mode='r', encoding=self.encoding)
+        self.fstats = os.fstat(self.f.fileno())
+        self.position = 0
+        self._initcheckpoints()
+        if self.checkpoints != None:
+            offset = self.checkpoints.lookup(self.path, self.fstats)
+            if offset:
+                logger.info("resuming %s from offset %i" % (self.path, offset))
+                self.f.seek(offset)
+                self.position = offset
 
     def readline(self):
         if self.linemax == None:
-            return self.f.readline()
-        return self.f.readline(self.linemax)
+            line = self.f.readline()
+        else:
+            line = self.f.readline(self.linemax)
+        # track the byte offset, which the codec reader doesn't expose
+        if self.checkpoints != None:
+            self.position += len(line.encode(self.encoding))
+        return line
+
+    def _initcompressed(self, compression):
+        logger.debug("reading %s compressed file %s" % (compression, self.path))
+        if self.workers > 1:
+            logger.info("%s is compressed, decoding it serially" % self.path)
+        # offsets in the decompressed stream can't be seeked to
+        if self.checkpointfile != None:
+            logger.warning("checkpoints are disabled for compressed file %s" % self.path)
+        self.checkpoints = None
+        self.f = opencompressed(self.path, compression, self.encoding,
+            self.buffersize, self.decompressthread)
+        self.fstats = os.stat(self.path)
+        self.position = 0
+
+    def _initparallel(self):
+        self.f = open(self.path, 'rb')
+        self.fstats = os.fstat(self.f.fileno())
+        self.position = 0
+        self._initcheckpoints()
+        if self.checkpoints != None:
+            offset = self.checkpoints.lookup(self.path, self.fstats)
+            if offset:
+                logger.info("resuming %s from offset %i" % (self.path, offset))
+                self.position = offset
+        if self.fstats.st_size > 0:
+            self.m = mmap.mmap(self.f.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            self.m = None
+        self.pool = Pool(self.workers, ignoresigint)
+        self.chunks = imapbounded(self.pool, _readchunk, self._splitchunks(self.position),
+            self.workers * 2, self.ordered)
+        self.lines = list()
+        self.lineno = 0
+        self.chunkend = self.position
+
+    def _splitchunks(self, offset):
+        """
+        Yield the arguments for _readchunk() for each newline-aligned chunk
+        of the file, starting at the specified offset.
+        """
+        if self.m is None:
+            return
+        size = len(self.m)
+        start = offset
+        while start < size:
+            end = start + self.chunksize
+            if end < size:
+                end = self.m.find('\n', end - 1)
+                end = size if end < 0 else end + 1
+            else:
+                end = size
+            yield self.path, start, end, self.encoding, self.linemax
+            start = end
+
+    def _emit(self):
+        if not self.parallel:
+            return AbstractFileSource._emit(self)
+        while self.lineno == len(self.lines):
+            start,end,self.lines = self.chunks.next()
+            self.lineno = 0
+            self.chunkend = end
+            self.position = start if len(self.lines) > 0 else end
+        line = self.lines[self.lineno]
+        self.lineno += 1
+        # the checkpoint only advances once every line in the chunk is emitted
+        if self.lineno == len(self.lines):
+            self.position = self.chunkend
+        return self._makeevent(line)
+
+    def _mark(self):
+        return (self.path, self.fstats.st_ino, self.fstats.st_dev, self.position)
 
     def fini(self):
+        if self.parallel:
+            self.pool.terminate()
+            self.pool.join()
+            self.chunks = None
+            if self.m is not None:
+                self.m.close()
         self.f.close()
+        self._finicheckpoints()
 
 class StdinSource(IPlugin, AbstractFileSource):
     """
-    Read in lines from stdin.
+    Read in lines from stdin.  If binary is True, stdin is read in large
+    blocks directly from the file descriptor, and the lines in each block are
+    split and decoded together, which is much faster than reading line by
+    line.  In binary mode undecodable bytes are replaced rather than raising
+    an error.
     """
     def __init__(self, *args, **kwargs):
         AbstractFileSource.__init__(self, *args, **kwargs)
         self.f = sys.stdin
+        self.binary = False
+        self.blocksize = 1024 * 1024
+        self.encoding = 'utf-8'
 
     def __str__(self):
-        return "StdinSource(origin=%s, linemax=%d)" % (self.hostname, self.linemax)
+        return "StdinSource(origin=%s, linemax=%d, binary=%s)" % (self.hostname, self.linemax, self.binary)
+
+    def configure(self, section):
+        AbstractFileSource.configure(self, section)
+        # read stdin in large blocks instead of line by line
+        self.binary = section.getBoolean("binary", self.binary)
+        # in binary mode, read blocks of this size
+        self.blocksize = section.getInt("block size", self.blocksize)
+        # in binary mode, decode lines using this encoding
+        self.encoding = section.getString("encoding", self.encoding)
+        if self.binary:
+            try:
+                if u'\n'.encode(self.encoding) != '\n':
+                    raise ConfigureError("encoding %s is not supported in binary mode" % self.encoding)
+            except LookupError, e:
+                raise ConfigureError(str(e))
+
+    def init(self):
+        self.lines = deque()
+        self.partial = ''
+        self.skipping = False
+        self.eof = False
 
     def readline(self):
         if self.linemax == None:
             return self.f.readline()
-        return self.f.readline(self.linemax)
\ No newline at end of file
+        return self.f.readline(self.linemax)
+
+    def _read(self):
+        while True:
+            try:
+                return os.read(self.f.fileno(), self.blocksize)
+            except OSError, e:
+                if e.errno != errno.EINTR:
+                    raise
+
+    def _fill(self):
+        """
+        Read blocks from stdin until at least one complete line is available.
+
+        :returns: False if stdin is at EOF and no lines are available.
+        :rtype: bool
+        """
+        linemax = sys.maxint if self.linemax == None else self.linemax
+        while len(self.lines) == 0:
+            if self.eof:
+                return False
+            data = self._read()
+            if data == '':
+                # an incomplete last line is discarded, as in line mode
+                self.eof = True
+                return False
+            segments = data.split('\n')
+            partial = segments.pop()
+            if len(segments) > 0:
+                segments[0] = self.partial + segments[0]
+                # throw away the rest of a long line
+                if self.skipping:
+                    del segments[0]
+                    self.skipping = False
+                self.partial = partial
+            else:
+                self.partial += partial
+            if len(self.partial) >= linemax:
+                self.partial = ''
+                self.skipping = True
+            segments = [segment for segment in segments if len(segment) < linemax]
+            if len(segments) == 0:
+                continue
+            # decode every line in the block at once
+            for line in '\n'.join(segments).decode(self.encoding, 'replace').split(u'\n'):
+                line = line.strip()
+                if line != u'':
+                    self.lines.append(line)
+        return True
+
+    def _emit(self):
+        if not self.binary:
+            return AbstractFileSource._emit(self)
+        if len(self.lines) == 0 and not self._fill():
+            raise StopIteration
+        return self._makeevent(self.lines.popleft())
+
+    def emit_batch(self, count):
+        """
+        Return up to count events, or raise StopIteration.
+
+        :param count: The maximum number of events to return
+        :type count: int
+        :returns: A list of :class:`Event`
+        :rtype: list
+        :raises: StopIteration
+        """
+        events = list()
+        if not self.binary:
+            try:
+                while len(events) < count:
+                    events.append(self.emit())
+            except StopIteration:
+                if len(events) == 0:
+                    raise
+            return events
+        try:
+            while len(events) < count:
+                if len(self.lines) == 0 and not self._fill():
+                    if len(events) == 0:
+                        raise StopIteration
+                    break
+                lines = self.lines
+                makeevent = self._makeevent
+                for i in xrange(min(count - len(events), len(lines))):
+                    events.append(makeevent(lines.popleft()))
+        except KeyboardInterrupt:
+            raise StopIteration
+        return events
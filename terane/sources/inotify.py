@@ -0,0 +1,142 @@
+# Copyright 2013 Michael Frank <msfrank@syntaxjockey.com>
+#
+# This file is part of Terane.
+#
+# Terane is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Terane is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Terane.  If not, see <http://www.gnu.org/licenses/>.
+
+import os, errno, select, struct, ctypes, ctypes.util
+from terane.loggers import getLogger
+
+logger = getLogger('terane.sources.inotify')
+
+IN_MODIFY       = 0x00000002
+IN_ATTRIB       = 0x00000004
+IN_CLOSE_WRITE  = 0x00000008
+IN_MOVED_FROM   = 0x00000040
+IN_MOVED_TO     = 0x00000080
+IN_CREATE       = 0x00000100
+IN_DELETE       = 0x00000200
+IN_DELETE_SELF  = 0x00000400
+IN_MOVE_SELF    = 0x00000800
+IN_Q_OVERFLOW   = 0x00004000
+IN_IGNORED      = 0x00008000
+
+IN_NONBLOCK     = 0x00000800
+IN_CLOEXEC      = 0x00080000
+
+_header = struct.Struct('iIII')
+
+_libc = None
+
+def _getlibc():
+    global _libc
+    if _libc is None:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        libc.inotify_init1.argtypes = [ctypes.c_int]
+        libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+        _libc = libc
+    return _libc
+
+class INotifyError(Exception):
+    """
+    Raised when inotify is not available or a watch could not be added.
+    """
+
+class INotify(object):
+    """
+    A minimal ctypes wrapper around the Linux inotify API.
+    """
+
+    def __init__(self):
+        try:
+            self._libc = _getlibc()
+        except (OSError, AttributeError), e:
+            raise INotifyError("inotify is not available: %s" % e)
+        fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if fd < 0:
+            _errno = ctypes.get_errno()
+            raise INotifyError("inotify_init1() failed: %s" % os.strerror(_errno))
+        self._fd = fd
+
+    def fileno(self):
+        return self._fd
+
+    def addwatch(self, path, mask):
+        """
+        Watch the specified path for the events in mask.
+
+        :returns: The watch descriptor
+        :rtype: int
+        :raises: :class:`INotifyError`
+        """
+        wd = self._libc.inotify_add_watch(self._fd, path, mask)
+        if wd < 0:
+            _errno = ctypes.get_errno()
+            raise INotifyError("inotify_add_watch(%s) failed: %s" % (path, os.strerror(_errno)))
+        return wd
+
+    def rmwatch(self, wd):
+        self._libc.inotify_rm_watch(self._fd, wd)
+
+    def read(self):
+        """
+        Read all pending events without blocking.
+
+        :returns: A list of (wd, mask, cookie, name) tuples
+        :rtype: list
+        """
+        events = list()
+        while True:
+            try:
+                data = os.read(self._fd, 65536)
+            except OSError, e:
+                if e.errno == errno.EAGAIN:
+                    break
+                if e.errno == errno.EINTR:
+                    continue
+                raise
+            if len(data) == 0:
+                break
+            offset = 0
+            while offset + _header.size <= len(data):
+                wd,mask,cookie,length = _header.unpack_from(data, offset)
+                offset += _header.size
+                name = data[offset:offset + length].rstrip('\0')
+                offset += length
+                events.append((wd, mask, cookie, name))
+        return events
+
+    def wait(self, timeout):
+        """
+        Wait up to timeout seconds for events to arrive.
+
+        :returns: A list of (wd, mask, cookie, name) tuples, which is empty
+          if the timeout expired.
+        :rtype: list
+        """
+        try:
+            readable,_,_ = select.select([self._fd], [], [], timeout)
+        except select.error, (_errno, errstr):
+            if _errno == errno.EINTR:
+                return list()
+            raise
+        if len(readable) == 0:
+            return list()
+        return self.read()
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
@@ -0,0 +1,223 @@
+# Copyright 2013 Michael Frank <msfrank@syntaxjockey.com>
+#
+# This file is part of Terane.
+#
+# Terane is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Terane is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Terane.  If not, see <http://www.gnu.org/licenses/>.
+
+import os, sys, glob, time
+from terane.plugin import IPlugin
+from terane.sources.file import AbstractFileSource
+from terane.sources.tail import TailSource, emitavailable
+from terane.sources.inotify import INotify, INotifyError, IN_MODIFY, IN_ATTRIB, \
+     IN_CLOSE_WRITE, IN_MOVED_TO, IN_CREATE
+from terane.event import FieldIdentifier
+from terane.settings import ConfigureError
+from terane.loggers import getLogger
+
+logger = getLogger('terane.sources.multitail')
+
+class MultiTailSource(IPlugin, AbstractFileSource):
+    """
+    Tail every file matching a glob pattern from a single process.  New
+    files matching the pattern are discovered as they appear and read from
+    the beginning, while files which exist when the source starts are read
+    from the end (or from their checkpoint).  Files are scheduled round-robin,
+    one line at a time, so a busy file can't starve the others.  Each event
+    has a 'path' field containing the path of the file it was read from.
+    """
+
+    PATH = FieldIdentifier('path', FieldIdentifier.LITERAL)
+
+    def __init__(self, *args, **kwargs):
+        AbstractFileSource.__init__(self, *args, **kwargs)
+        self.pattern = None
+        self.sleeptime = 5
+        self.rescaninterval = 10.0
+        self.inotify = True
+        self.blocksize = 65536
+
+    def __str__(self):
+        return "MultiTailSource(pattern=%s, origin=%s, linemax=%d, inotify=%s)" % (self.pattern, self.hostname, self.linemax, self.inotify)
+
+    def configure(self, section):
+        AbstractFileSource.configure(self, section)
+        self.pattern = section.getString("pattern", self.pattern)
+        if self.pattern == None:
+            raise ConfigureError("multitail_source requires a pattern")
+        # look for new files matching the pattern this often
+        self.rescaninterval = section.getFloat("rescan interval", self.rescaninterval)
+        # wake up on inotify events instead of polling, if available
+        self.inotify = section.getBoolean("inotify", self.inotify)
+        # read files in blocks of this size
+        self.blocksize = section.getInt("block size", self.blocksize)
+
+    def init(self):
+        self.tails = list()
+        self.paths = dict()
+        self.current = None
+        self.last = None
+        self.index = 0
+        self.lastscan = 0
+        self.watcher = None
+        self.watched = set()
+        self._initcheckpoints()
+        if self.inotify:
+            try:
+                self.watcher = INotify()
+            except INotifyError, e:
+                logger.info("falling back to polling %s: %s" % (self.pattern, e))
+        self._scan(initial=True)
+
+    def fini(self):
+        for tail in self.tails:
+            self._finitail(tail)
+        self.tails = list()
+        self.paths = dict()
+        if self.watcher is not None:
+            self.watcher.close()
+            self.watcher = None
+        self._finicheckpoints()
+
+    def _inittail(self, path, initial):
+        tail = TailSource()
+        tail.path = path
+        tail.hostname = self.hostname
+        tail.linemax = self.linemax
+        tail.blocksize = self.blocksize
+        tail.inotify = False
+        tail.fromstart = not initial
+        tail.init()
+        # the per-file sources share our checkpoint store
+        tail.checkpoints = self.checkpoints
+        # open the file now, so the starting position is fixed when the
+        # file is discovered rather than when it is first read
+        tail._fill()
+        tail.upath = path.decode(sys.getfilesystemencoding() or 'utf-8', 'replace')
+        return tail
+
+    def _finitail(self, tail):
+        tail.checkpoints = None
+        tail.fini()
+
+    _watchmask = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+
+    def _watch(self, dirname):
+        if self.watcher is None or dirname in self.watched:
+            return
+        try:
+            self.watcher.addwatch(dirname, MultiTailSource._watchmask)
+            self.watched.add(dirname)
+            logger.debug("watching %s using inotify" % dirname)
+        except INotifyError, e:
+            logger.warning("failed to watch %s: %s" % (dirname, e))
+
+    def _scan(self, initial=False):
+        """
+        Start tailing any new files matching the pattern, and stop tailing
+        files which no longer exist and have been completely read.
+        """
+        self.lastscan = time.time()
+        matches = set(glob.glob(self.pattern))
+        for path in sorted(matches):
+            if path not in self.paths:
+                logger.debug("tailing %s" % path)
+                tail = self._inittail(path, initial)
+                self.tails.append(tail)
+                self.paths[path] = tail
+                self._watch(os.path.dirname(os.path.abspath(path)))
+        # watch the directory the pattern refers to, if it is not a glob
+        dirname = os.path.dirname(os.path.abspath(self.pattern))
+        if not glob.has_magic(dirname) and os.path.isdir(dirname):
+            self._watch(dirname)
+        for tail in list(self.tails):
+            if tail.path in matches or os.path.exists(tail.path):
+                continue
+            if tail is self.current or tail._fill():
+                continue
+            # keep the file until its buffered lines have been read
+            if tail._hasline():
+                continue
+            logger.debug("no longer tailing %s" % tail.path)
+            self.tails.remove(tail)
+            del self.paths[tail.path]
+            self._finitail(tail)
+
+    def _wait(self):
+        """
+        Wait for activity on any of the files, rescanning for new files if
+        one was created or the rescan interval has passed.
+        """
+        if self.watcher is None:
+            time.sleep(min(self.sleeptime, self.rescaninterval))
+        else:
+            for wd,mask,cookie,name in self.watcher.wait(min(self.sleeptime, self.rescaninterval)):
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    self.lastscan = 0
+        if time.time() - self.lastscan >= self.rescaninterval:
+            self._scan()
+
+    def readline(self):
+        """
+        Return the next line from the next file with data available.  If the
+        previous line was incomplete then keep reading from the same file, so
+        the rest of a long line is skipped correctly.
+        """
+        while True:
+            if self.current is not None:
+                line = self.current._poll()
+                if line is not None:
+                    if line.endswith('\n'):
+                        self.current = None
+                    return line
+            else:
+                ntails = len(self.tails)
+                for i in xrange(ntails):
+                    tail = self.tails[(self.index + i) % ntails]
+                    line = tail._poll()
+                    if line is not None:
+                        self.index = (self.index + i + 1) % ntails
+                        if not line.endswith('\n'):
+                            self.current = tail
+                        self.last = tail
+                        return line
+            self._wait()
+
+    def _ready(self):
+        """
+        Check whether a line can be read from any of the files without
+        waiting.
+
+        :rtype: bool
+        """
+        if self.current is not None:
+            return self.current._ready()
+        for tail in self.tails:
+            if tail._ready():
+                return True
+        return False
+
+    def emit_batch(self, count):
+        """
+        Return up to count events, or fewer if no more lines are available
+        without waiting.  See :func:`terane.sources.tail.emitavailable`.
+        """
+        return emitavailable(self, count)
+
+    def _emit(self):
+        event = AbstractFileSource._emit(self)
+        event.set(MultiTailSource.PATH, self.last.upath)
+        return event
+
+    def _mark(self):
+        return self.last._mark()
@@ -15,14 +15,46 @@
 # You should have received a copy of the GNU General Public License
 # along with Terane.  If not, see <http://www.gnu.org/licenses/>.
 
-import os, socket, time, errno
+import os, io, socket, time, errno
 from terane.plugin import IPlugin
 from terane.sources.file import AbstractFileSource
+from terane.sources.inotify import INotify, INotifyError, IN_MODIFY, IN_ATTRIB, \
+     IN_CLOSE_WRITE, IN_MOVED_FROM, IN_MOVED_TO, IN_CREATE, IN_DELETE, \
+     IN_DELETE_SELF, IN_MOVE_SELF, IN_Q_OVERFLOW
 from terane.event import Event
 from terane.loggers import getLogger
 
 logger = getLogger('terane.sources.tail')
 
+def emitavailable(source, count):
+    """
+    Return up to count events from a tailing source, without waiting for a
+    full batch.  If no line is available the source waits for activity once,
+    and the batch ends as soon as no more lines can be read without waiting,
+    so events from a quiet file aren't held back until more lines arrive.
+
+    :param source: A source implementing _ready() and _wait()
+    :param count: The maximum number of events to return
+    :type count: int
+    :returns: A list of :class:`Event`, which is empty if no lines arrived
+      while waiting.
+    :rtype: list
+    :raises: StopIteration
+    """
+    events = list()
+    if not source._ready():
+        try:
+            source._wait()
+        except KeyboardInterrupt:
+            raise StopIteration
+        if not source._ready():
+            return events
+    while len(events) < count:
+        events.append(source.emit())
+        if not source._ready():
+            break
+    return events
+
 class TailSource(IPlugin, AbstractFileSource):
     """
     Read in lines from the specified file by tailing.
@@ -31,98 +63,254 @@ class TailSource(IPlugin, AbstractFileSource):
         AbstractFileSource.__init__(self, *args, **kwargs)
         self.path = None
         self.sleeptime = 5
+        self.inotify = True
+        self.blocksize = 65536
+        self.fromstart = False
 
     def __str__(self):
-        return "TailSource(path=%s, origin=%s, linemax=%d)" % (self.path, self.hostname, self.linemax)
+        return "TailSource(path=%s, origin=%s, linemax=%d, inotify=%s)" % (self.path, self.hostname, self.linemax, self.inotify)
 
     def configure(self, section):
         AbstractFileSource.configure(self, section)
         self.path = section.getPath("path", self.path)
+        # wake up on inotify events instead of polling, if available
+        self.inotify = section.getBoolean("inotify", self.inotify)
+        # read the file in blocks of this size
+        self.blocksize = section.getInt("block size", self.blocksize)
 
     def init(self):
         self.f = None
         self.prevstats = None
         self.position = 0
-        self.buffer = ""
+        self.rotated = False
+        self.buffer = bytearray()
+        self.offset = 0
+        self.block = bytearray(self.blocksize)
+        self.blockview = memoryview(self.block)
         self.errno = None
-        self.skipcount = 0
+        self.watcher = None
+        if self.inotify:
+            self._watch()
+        self._initcheckpoints()
+
+    def fini(self):
+        if self.f is not None:
+            self.f.close()
+            self.f = None
+        if self.watcher is not None:
+            self.watcher.close()
+            self.watcher = None
+        self._finicheckpoints()
+
+    def _mark(self):
+        offset = self.position - (len(self.buffer) - self.offset)
+        return (self.path, self.fstats.st_ino, self.fstats.st_dev, offset)
+
+    _watchmask = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF
+
+    def _watch(self):
+        """
+        Watch the directory containing the file, so we are woken up when the
+        file is modified, and when it is moved, deleted or created during
+        rotation.  If inotify isn't available, fall back to polling.
+        """
+        dirname,self._basename = os.path.split(os.path.abspath(self.path))
+        try:
+            self.watcher = INotify()
+            self.watcher.addwatch(dirname, TailSource._watchmask)
+            logger.debug("watching %s using inotify" % dirname)
+        except INotifyError, e:
+            logger.info("falling back to polling %s: %s" % (self.path, e))
+            if self.watcher is not None:
+                self.watcher.close()
+            self.watcher = None
 
     def _wait(self):
-        time.sleep(self.sleeptime)
+        """
+        Wait for activity on the file.  When using inotify, wait until an
+        event for the file arrives, otherwise sleep.  In either case we
+        wait no longer than sleeptime seconds.
+        """
+        if self.watcher is None:
+            time.sleep(self.sleeptime)
+            return
+        deadline = time.time() + self.sleeptime
+        timeout = self.sleeptime
+        while timeout > 0:
+            for wd,mask,cookie,name in self.watcher.wait(timeout):
+                if name == self._basename or name == '' or mask & IN_Q_OVERFLOW:
+                    return
+            timeout = deadline - time.time()
 
-    def readline(self):
+    def _read(self):
         """
-        Loop forever adding bytes read to the buffer until we encounter
-        one of two exit conditions:
+        Read the next block from the file into the buffer.
 
-          1) we encounter a newline
-          2) we fill the buffer without encountering a newline
+        :returns: The number of bytes read.
+        :rtype: int
+        """
+        # discard consumed lines before appending, so the buffer only holds
+        # at most one partial line plus the new block
+        if self.offset == len(self.buffer):
+            del self.buffer[:]
+            self.offset = 0
+        elif self.offset > 0:
+            del self.buffer[:self.offset]
+            self.offset = 0
+        nread = self.f.readinto(self.block)
+        if nread > 0:
+            self.buffer += self.blockview[:nread]
+            self.position += nread
+            logger.debug("read %i bytes" % nread)
+        return nread
 
-        In either case, we return the contents of the buffer and rely on
-        the AbstractFileSource implementation of emit() to ignore messages
-        which are too long.
+    def _nextline(self):
         """
-        while True:
-            # get current file statistics
-            try:
-                currstats = os.stat(self.path)
-            except (IOError,OSError), (_errno, errstr):
-                if _errno != errno.ENOENT and _errno != self.errno:
-                    logger.warning("failed to stat() %s: %s" % (self.path, errstr))
-                    self.errno = errno
-                continue
-            if self.errno is not None:
-                self.errno = None
-            prevstats = self.prevstats
-            self.prevstats = currstats
-
-            # open the file if needed
-            if self.f is None:
-                self.f = open(self.path, 'r')
-                logger.debug("opened %s" % self.path)
-                self.skipcount = 0
-                # if this is the first file open, then start reading from
-                # the end of the file
-                if prevstats is None:
-                    self.position = currstats.st_size
-                # otherwise start reading from the beginning of the file
-                else:
+        Split the next line out of the buffer.  If the buffer holds at least
+        linemax bytes without a newline, then return the first linemax bytes
+        and rely on the AbstractFileSource implementation of emit() to
+        ignore the rest of the long line.
+
+        :returns: The next line, or None if there is no complete line.
+        :rtype: str
+        """
+        start = self.offset
+        end = self.buffer.find('\n', start, start + self.linemax)
+        if end >= 0:
+            self.offset = end + 1
+            return str(self.buffer[start:end + 1])
+        if len(self.buffer) - start >= self.linemax:
+            self.offset = start + self.linemax
+            return str(self.buffer[start:self.offset])
+        return None
+
+    def _fill(self):
+        """
+        Check the file for changes and read any new data into the buffer.
+
+        :returns: True if the buffer may contain new lines, False if there
+          was no activity on the file.
+        :rtype: bool
+        """
+        # get current file statistics
+        try:
+            currstats = os.stat(self.path)
+        except (IOError,OSError), (_errno, errstr):
+            if _errno != errno.ENOENT and _errno != self.errno:
+                logger.warning("failed to stat() %s: %s" % (self.path, errstr))
+                self.errno = _errno
+            return False
+        if self.errno is not None:
+            self.errno = None
+        prevstats = self.prevstats
+        self.prevstats = currstats
+
+        # the file inode and/or underlying block device changed, so finish
+        # reading the old file before switching to the new one
+        if self.f is not None and prevstats is not None:
+            if prevstats.st_dev != currstats.st_dev or prevstats.st_ino != currstats.st_ino:
+                logger.debug("detected VFS change to %s" % self.path)
+                self.rotated = True
+        if self.rotated:
+            if self._read() > 0:
+                return True
+            self.f.close()
+            self.f = None
+            self.rotated = False
+
+        # open the file if needed
+        if self.f is None:
+            self.f = io.open(self.path, 'rb', buffering=0)
+            self.fstats = os.fstat(self.f.fileno())
+            logger.debug("opened %s" % self.path)
+            # if this is the first file open, then resume from the checkpoint
+            # if there is one, otherwise start reading from the end of the file
+            # (or the beginning, if fromstart is set)
+            if prevstats is None:
+                offset = None
+                if self.checkpoints is not None:
+                    offset = self.checkpoints.lookup(self.path, self.fstats)
+                if offset is not None:
+                    logger.info("resuming %s from offset %i" % (self.path, offset))
+                    self.position = offset
+                elif self.fromstart:
                     self.position = 0
-            f = self.f
-
-            # check for file metadata changes
-            if prevstats is not None:
-                # the file inode and/or underlying block device changed
-                if prevstats.st_dev != currstats.st_dev or prevstats.st_ino != currstats.st_ino:
-                    logger.debug("detected VFS change to %s" % self.path)
-                    self.f = None
-                # the file shrank
-                elif self.position > currstats.st_size:
-                    delta = self.position - currstats.st_size
-                    logger.info("file %s shrank by %i bytes" % (self.path, delta))
-                    # reset the buffer
-                    self.buffer = ""
-                    # reset position to the new end of the file
-                    self.position = currstats.st_size
-
-            # delta is the number of unread bytes we know about
-            delta = currstats.st_size - self.position
-            # if the file hasn't changed, then wait for activity
-            if delta == 0:
-                self._wait()
-                continue
-            logger.debug("position=%i, st_size=%i" % (self.position, currstats.st_size))
-
-            # read up to readsize bytes into buffer
-            readsize = min(self.linemax - len(self.buffer), currstats.st_size - self.position)
-            f.seek(self.position)
-            data = f.readline(readsize)
-            logger.debug("read %i bytes" % len(data))
-            self.buffer = self.buffer + data
-            self.position = f.tell()
-
-            # return the buffer, which may or may not be complete
-            if self.buffer.endswith('\n') or len(self.buffer) == self.linemax:
-                buffer = self.buffer
-                self.buffer = ""
-                return buffer
+                else:
+                    self.position = self.fstats.st_size
+            # otherwise start reading from the beginning of the file
+            else:
+                self.position = 0
+            self.f.seek(self.position)
+
+        # the file shrank
+        if self.position > currstats.st_size:
+            delta = self.position - currstats.st_size
+            logger.info("file %s shrank by %i bytes" % (self.path, delta))
+            # reset the buffer
+            del self.buffer[:]
+            self.offset = 0
+            # reset position to the new end of the file
+            self.position = currstats.st_size
+            self.f.seek(self.position)
+
+        # if the file hasn't changed, then wait for activity
+        if currstats.st_size == self.position:
+            return False
+        logger.debug("position=%i, st_size=%i" % (self.position, currstats.st_size))
+        return self._read() > 0
+
+    def readline(self):
+        """
+        Return the next line from the buffer, reading blocks of up to
+        blocksize bytes from the file as needed and waiting for activity
+        when there is no new data.  Lines longer than linemax are returned
+        in pieces of linemax bytes.
+        """
+        while True:
+            line = self._poll()
+            if line is not None:
+                return line
+            self._wait()
+
+    def _hasline(self):
+        """
+        Check whether the buffer holds a line which _nextline() would return,
+        without consuming it.
+
+        :rtype: bool
+        """
+        start = self.offset
+        if self.buffer.find('\n', start, start + self.linemax) >= 0:
+            return True
+        return len(self.buffer) - start >= self.linemax
+
+    def _ready(self):
+        """
+        Check whether a line can be read without waiting, reading any new
+        data from the file into the buffer.
+
+        :rtype: bool
+        """
+        while not self._hasline():
+            if not self._fill():
+                return False
+        return True
+
+    def emit_batch(self, count):
+        """
+        Return up to count events, or fewer if no more lines are available
+        without waiting.  See :func:`emitavailable`.
+        """
+        return emitavailable(self, count)
+
+    def _poll(self):
+        """
+        Return the next line if one is available without waiting.
+
+        :returns: The next line, or None if no complete line is available.
+        :rtype: str
+        """
+        line = self._nextline()
+        while line is None and self._fill():
+            line = self._nextline()
+        return line
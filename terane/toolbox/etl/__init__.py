@@ -21,7 +21,7 @@ from terane.settings import Settings, ConfigureError
 
 def etl_main():
     settings = Settings(
-        usage="[OPTIONS...] PIPELINE [ - | FILE...]",
+        usage="[OPTIONS...] [ - | FILE...]",
         description="Process the specified ETL pipeline",
         section="etl")
     try:
@@ -34,6 +34,15 @@ def etl_main():
         settings.addOption("s", "sink",
             override="sink", help="publish events to the specified STORE", metavar="STORE"
             )
+        settings.addOption("b", "batch-size",
+            override="batch size", help="process events in batches of NUM", metavar="NUM"
+            )
+        settings.addOption("w", "workers",
+            override="workers", help="process files in NUM worker processes", metavar="NUM"
+            )
+        settings.addLongSwitch("binary",
+            override="binary", help="Read stdin in large binary blocks"
+            )
         settings.addLongOption("log-config",
             override="log config file", help="use logging configuration file FILE", metavar="FILE"
             )
@@ -15,18 +15,114 @@
 # You should have received a copy of the GNU General Public License
 # along with Terane.  If not, see <http://www.gnu.org/licenses/>.
 
-import sys
-from terane.sources.file import StdinSource
+import os, sys, time, errno, traceback, Queue
+from multiprocessing import Pool, Array, cpu_count
+from multiprocessing import Queue as ProcessQueue
+from multiprocessing.util import Finalize
+from terane.sources.file import StdinSource, FileSource
 from terane.sinks.syslog import SyslogSink
 from terane.plugin import PluginManager
-from terane.pipeline import Pipeline, parsenodespec, makepipeline
+from terane.pipeline import Pipeline, parsenodespec, makepipeline, makefilterchain, \
+     emitbatch, consumebatch
+from terane.parallel import ignoresigint
+from terane.settings import ConfigureError
 from terane.loggers import getLogger, startLogging, StdoutHandler, DEBUG
 
 logger = getLogger('terane.toolbox.etl.etl')
 
+_workerqueue = None
+_workerpids = None
+_workerchain = None
+_workererror = None
+
+def _initworker(queue, pids, nodes):
+    """
+    Construct and initialize the filter chain in a worker process.  Errors
+    are not raised from here, since multiprocessing.Pool would replace the
+    failed worker forever; instead every file given to the worker fails.
+    """
+    global _workerqueue, _workerpids, _workerchain, _workererror
+    ignoresigint()
+    _workerqueue = queue
+    _workerpids = pids
+    try:
+        chain = makefilterchain(nodes)
+        chain.init()
+    except Exception, e:
+        logger.debug("failed to initialize filters:\n%s" % traceback.format_exc())
+        _workererror = "failed to initialize filters: %s" % e
+        return
+    _workerchain = chain
+    Finalize(None, chain.fini, exitpriority=10)
+
+def _extractfile(args):
+    """
+    Read every event from the source in a worker process, run them through
+    the worker's filter chain, and pass the filtered batches to the parent
+    process over the queue.  Each message is a tuple of the message kind,
+    the path and a value: an 'events' message is sent for each batch, and
+    finally a 'done' message containing the number of events dropped, the
+    elapsed time and the error (if any).  The pid of the worker is stored in
+    the shared pids array while the file is processed, so the parent can
+    tell if the worker dies.
+    """
+    index,source,batchsize = args
+    _workerpids[index] = os.getpid()
+    started = time.time()
+    dropped = 0
+    error = None
+    try:
+        if _workerchain == None:
+            raise Exception(_workererror)
+        source.init()
+        try:
+            while True:
+                try:
+                    events,_dropped = emitbatch(source, batchsize)
+                except StopIteration:
+                    break
+                events,__dropped = _workerchain.process_batch(events)
+                dropped += _dropped + __dropped
+                if len(events) > 0:
+                    _workerqueue.put(('events', source.path, events))
+        finally:
+            source.fini()
+    except Exception, e:
+        error = str(e)
+    _workerqueue.put(('done', source.path, (dropped, time.time() - started, error)))
+
+def _isalive(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError, e:
+        if e.errno == errno.ESRCH:
+            return False
+    return True
+
+class FileSummary(object):
+    """
+    Per-file counters for a multi-file extract.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.processed = 0
+        self.dropped = 0
+        self.elapsed = 0.0
+        self.error = None
+
+    def __str__(self):
+        if self.error != None:
+            return "%s: failed after %i events: %s" % (self.path, self.processed, self.error)
+        rate = self.processed / self.elapsed if self.elapsed > 0.0 else 0.0
+        return "%s: %i events, %i dropped in %.2f seconds (%.1f events/sec)" % (
+            self.path, self.processed, self.dropped, self.elapsed, rate)
+
 class ETL(object):
     """
     ETL contains all of the logic necessary to perform an extract-transform-load.
+    If files are specified then each file is read and filtered in a pool of
+    worker processes, and the filtered events from every file are published
+    through a single sink in the parent process.
     """
     def configure(self, ns):
         # load configuration
@@ -34,13 +130,37 @@ class ETL(object):
         # publish to the specified sink
         self.store = section.getString("sink", "main")
         # configure pipeline
-        source = StdinSource()
-        source.configure(section)
-        sink = SyslogSink()
-        sink.configure(section)
+        self.sink = SyslogSink()
+        self.sink.configure(section)
         plugins = PluginManager()
         nodes = parsenodespec(section.getString("filters", None))
-        self.pipeline = Pipeline(source, sink, makepipeline(nodes))
+        batchsize = section.getInt("batch size", None)
+        paths = ns.args
+        if len(paths) == 0 or paths == ['-']:
+            source = StdinSource()
+            source.configure(section)
+            self.sources = None
+            self.pipeline = Pipeline(source, self.sink, makepipeline(nodes), batchsize)
+        else:
+            if '-' in paths:
+                raise ConfigureError("stdin can't be read along with files")
+            self.sources = list()
+            for path in paths:
+                source = FileSource()
+                source.configure(section)
+                source.path = path
+                # the file is already being read in a worker process
+                source.workers = 1
+                # checkpoints would be committed before the events are consumed
+                source.checkpointfile = None
+                self.sources.append(source)
+            self.nodes = list(nodes)
+            # the workers construct their own filters, so check the filters
+            # can be configured before starting them
+            makefilterchain(self.nodes)
+            self.batchsize = batchsize if batchsize != None and batchsize > 1 else 256
+            self.workers = min(section.getInt("workers", cpu_count()), len(paths))
+            self.pipeline = None
         # configure server logging
         logconfigfile = section.getString('log config file', "%s.logconfig" % ns.appname)
         if section.getBoolean("debug", False):
@@ -48,7 +168,94 @@ class ETL(object):
         else:
             startLogging(None)
 
+    def _runfiles(self):
+        """
+        Process each file concurrently, returning the summary for each file.
+
+        :rtype: [:class:`FileSummary`]
+        """
+        summaries = dict()
+        for source in self.sources:
+            summaries[source.path] = FileSummary(source.path)
+        # initialize the filters in this process first, so errors are raised
+        # here rather than in every worker
+        chain = makefilterchain(self.nodes)
+        chain.init()
+        chain.fini()
+        queue = ProcessQueue(self.workers * 4)
+        # the pid of the worker processing each file, or 0 if not started
+        pids = Array('i', len(self.sources), lock=False)
+        self.sink.init()
+        try:
+            pool = Pool(self.workers, _initworker, (queue, pids, self.nodes))
+        except:
+            self.sink.fini()
+            raise
+        try:
+            tasks = [(i, source, self.batchsize) for i,source in enumerate(self.sources)]
+            pending = pool.map_async(_extractfile, tasks, chunksize=1)
+            remaining = len(tasks)
+            # the index of each file which hasn't finished
+            running = dict([(source.path, i) for i,source in enumerate(self.sources)])
+            lost = False
+            while remaining > 0:
+                try:
+                    kind,path,value = queue.get(True, 1.0)
+                except Queue.Empty:
+                    # raise the error if a task failed outside of _extractfile
+                    if pending.ready() and not pending.successful():
+                        pending.get()
+                    # give up on files whose worker has died
+                    for path,index in running.items():
+                        pid = pids[index]
+                        if pid != 0 and not _isalive(pid):
+                            logger.warning("worker %i exited while processing %s" % (pid, path))
+                            summaries[path].error = "worker exited unexpectedly"
+                            del running[path]
+                            remaining -= 1
+                            lost = True
+                    continue
+                summary = summaries[path]
+                if kind == 'done':
+                    # the file was given up on if its worker exited after sending this
+                    if running.pop(path, None) == None:
+                        continue
+                    dropped,summary.elapsed,summary.error = value
+                    summary.dropped += dropped
+                    remaining -= 1
+                elif summary.error == None:
+                    processed,dropped = consumebatch(self.sink, value)
+                    summary.processed += processed
+                    summary.dropped += dropped
+            # the task of a worker which died never completes, so the pool
+            # can't be closed cleanly
+            if lost:
+                pool.terminate()
+            else:
+                pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+            self.sink.fini()
+        return [summaries[source.path] for source in self.sources]
+
     def run(self):
-        logger.info("executing pipeline '%s'" % self.pipeline)
-        self.pipeline.run()
+        if self.sources == None:
+            logger.info("executing pipeline '%s'" % self.pipeline)
+            self.pipeline.run()
+            return 0
+        logger.info("extracting %i files using %i workers" % (len(self.sources), self.workers))
+        started = time.time()
+        summaries = self._runfiles()
+        elapsed = time.time() - started
+        for summary in summaries:
+            print summary
+        processed = sum([summary.processed for summary in summaries])
+        rate = processed / elapsed if elapsed > 0.0 else 0.0
+        print "total: %i events in %.2f seconds (%.1f events/sec)" % (processed, elapsed, rate)
+        for summary in summaries:
+            if summary.error != None:
+                return 1
         return 0
@@ -21,13 +21,22 @@ from terane.settings import Settings, ConfigureError
 
 def relay_main():
     settings = Settings(
-        usage="[OPTIONS...]",
+        usage="[OPTIONS...] PIPELINE",
         description="Logging event relay",
         section="relay")
     try:
         settings.addOption('n', "nprocs",
             override="num processes", help="create NUM child processes", metavar="NUM"
             )
+        settings.addOption("b", "batch-size",
+            override="batch size", help="pass events to the sink in batches of up to NUM", metavar="NUM"
+            )
+        settings.addOption('u', "udp-port",
+            override="udp listen port", help="also listen for UDP messages on PORT", metavar="PORT"
+            )
+        settings.addLongSwitch("reuse-port",
+            override="reuse port", help="bind a socket in each process with SO_REUSEPORT"
+            )
         settings.addLongOption("log-config",
             override="log config file", help="use logging configuration file FILE", metavar="FILE"
             )
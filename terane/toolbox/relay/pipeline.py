@@ -0,0 +1,194 @@
+# Copyright 2013 Michael Frank <msfrank@syntaxjockey.com>
+#
+# This file is part of Terane.
+#
+# Terane is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Terane is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Terane.  If not, see <http://www.gnu.org/licenses/>.
+
+import traceback
+from tornado.ioloop import IOLoop
+from terane.event import Event, FieldIdentifier, parsefield
+from terane.sinks.syslog import SyslogSink
+from terane.sinks.rfc5424 import privaltostring
+from terane.pipeline import consumebatch, DropEvent
+from terane.loggers import getLogger
+
+logger = getLogger('terane.toolbox.relay.pipeline')
+
+def makeevent(message, schema, maxfields=1024):
+    """
+    Convert a parsed syslog message into an :class:`Event`.  Fields sent by
+    a terane syslog sink in the values@42785 SD-ELEMENT are decoded using
+    the schema announced earlier on the same connection, which is updated
+    from the message's schema@42785 SD-ELEMENT if it has one.  Field names
+    are chosen by the sender, so they aren't interned, and at most maxfields
+    fields are added to the schema.
+
+    :param message: The parsed message
+    :type message: :class:`terane.toolbox.relay.rfc5424.ParsedMessage`
+    :param schema: A dict mapping SD-PARAM names to :class:`FieldIdentifier`,
+      which is kept for the lifetime of the connection, or None to ignore
+      the fields sent with the message.
+    :type schema: dict
+    :param maxfields: The most fields which are kept in the schema
+    :type maxfields: int
+    :rtype: :class:`Event`
+    """
+    values = dict()
+    if message.hostname is not None:
+        values[Event.ORIGIN] = message.hostname.encode('utf-8')
+    if message.timestamp is not None:
+        values[Event.TIMESTAMP] = message.timestamp
+    if message.msg is not None:
+        values[Event.MESSAGE] = message.msg
+    facility,severity = privaltostring(message.prival)
+    if facility is not None:
+        values[SyslogSink.FACILITY] = unicode(facility)
+    values[SyslogSink.SEVERITY] = unicode(severity)
+    if message.appname is not None:
+        values[SyslogSink.APPNAME] = message.appname
+    if message.procid is not None:
+        values[SyslogSink.PROCID] = message.procid
+    if message.msgid is not None:
+        values[SyslogSink.MSGID] = message.msgid
+    elements = message.elements
+    if len(elements) > 0 and schema is not None:
+        for sdid,params in elements:
+            if sdid == SyslogSink.SDID_SCHEMA:
+                for ident,field in params:
+                    if ident not in schema and len(schema) >= maxfields:
+                        logger.debug("ignoring schema entry %s=%s, too many fields" % (ident, field))
+                        continue
+                    try:
+                        fieldtype,fieldname = field.split(':', 1)
+                        schema[ident] = FieldIdentifier.fromstring(fieldname, fieldtype, intern=False)
+                    except (ValueError, KeyError):
+                        logger.debug("ignoring invalid schema entry %s=%s" % (ident, field))
+        for sdid,params in elements:
+            if sdid == SyslogSink.SDID_VALUES:
+                for ident,value in params:
+                    field = schema.get(ident)
+                    if field is None:
+                        logger.debug("ignoring value for unknown field %s" % ident)
+                        continue
+                    try:
+                        values[field] = parsefield(field, value)
+                    except (ValueError, OverflowError, TypeError):
+                        logger.debug("ignoring invalid value for %s" % (field,))
+    return Event.fromparsed(Event.EMPTY_ID, values)
+
+class RelayPipeline(object):
+    """
+    Runs events received by the relay through a filter chain and into a
+    sink from the IOLoop.  Events are collected into batches rather than
+    processed as each message is read: a batch is processed once it holds
+    batchsize events, or at the end of the current IOLoop iteration, so
+    every message read from the network in one iteration is handed to the
+    sink at once.  The sink must not block, since it runs on the IOLoop.
+
+    Errors raised by the filters or the sink are logged rather than passed
+    to the IOLoop.  If the filters fail, the batch is filtered again one
+    event at a time so only the events which fail are dropped; if the sink
+    fails, the whole batch is counted as dropped.
+    """
+
+    def __init__(self, filters, sink, batchsize=256, ioloop=None):
+        self.filters = filters
+        self.sink = sink
+        self.batchsize = batchsize
+        self.ioloop = ioloop
+        self.pending = list()
+        self.scheduled = False
+        self.processed = 0
+        self.dropped = 0
+
+    def __str__(self):
+        if len(self.filters.filters) > 0:
+            return "%s ~> %s" % (self.filters, self.sink)
+        return str(self.sink)
+
+    def init(self):
+        if self.ioloop is None:
+            self.ioloop = IOLoop.current()
+        self.filters.init()
+        self.sink.init()
+
+    def put(self, event):
+        """
+        Queue the event for processing.
+
+        :param event: The event
+        :type event: :class:`Event`
+        """
+        self.pending.append(event)
+        if len(self.pending) >= self.batchsize:
+            self.flush()
+        elif not self.scheduled:
+            self.scheduled = True
+            self.ioloop.add_callback(self.flush)
+
+    def flush(self):
+        """
+        Process every queued event.
+        """
+        self.scheduled = False
+        if len(self.pending) == 0:
+            return
+        events = self.pending
+        self.pending = list()
+        try:
+            events,dropped = self.filters.process_batch(events)
+        except Exception, e:
+            logger.warning("filtering a batch of %i events failed, filtering each event: %s\n%s" % (
+                len(events), e, traceback.format_exc()))
+            events,dropped = self._filtereach(events)
+        self.dropped += dropped
+        if len(events) > 0:
+            try:
+                processed,dropped = consumebatch(self.sink, events)
+            except Exception, e:
+                logger.warning("dropped a batch of %i events: %s\n%s" % (
+                    len(events), e, traceback.format_exc()))
+                processed,dropped = 0, len(events)
+            self.processed += processed
+            self.dropped += dropped
+
+    def _filtereach(self, events):
+        filtered = list()
+        dropped = 0
+        for event in events:
+            try:
+                filtered.append(self.filters.process(event))
+            except DropEvent, e:
+                logger.debug("dropped event: %s" % str(e))
+                dropped += 1
+            except Exception, e:
+                logger.warning("dropped event: %s" % e)
+                dropped += 1
+        return filtered, dropped
+
+    def drain(self, callback):
+        """
+        Process every queued event, then call callback once the sink has
+        finished sending, if the sink implements drain().
+        """
+        self.flush()
+        if hasattr(self.sink, 'drain'):
+            self.sink.drain(callback)
+        else:
+            callback()
+
+    def fini(self):
+        self.flush()
+        self.sink.fini()
+        self.filters.fini()
@@ -0,0 +1,309 @@
+# Copyright 2013 Michael Frank <msfrank@syntaxjockey.com>
+#
+# This file is part of Terane.
+#
+# Terane is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Terane is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Terane.  If not, see <http://www.gnu.org/licenses/>.
+
+import re
+from datetime import datetime, timedelta
+from dateutil.tz import tzutc
+from loggerglue.rfc5424 import SyslogEntry, syslog_msg
+from terane.loggers import getLogger
+
+logger = getLogger('terane.toolbox.relay.rfc5424')
+
+BOM = '\xef\xbb\xbf'
+
+_utc = tzutc()
+
+class ParseError(Exception):
+    """
+    Raised when a message is not a valid RFC 5424 syslog message.
+    """
+
+class ParsedMessage(object):
+    """
+    A parsed syslog message.  Text fields are unicode, or None if the
+    NILVALUE was sent, and the timestamp is a timezone-aware datetime in
+    UTC.  elements is a list of (sdid, params) tuples, where params is a
+    list of (name, value) tuples.
+    """
+
+    __slots__ = ('prival', 'version', 'timestamp', 'hostname', 'appname',
+                 'procid', 'msgid', 'elements', 'msg')
+
+    def __init__(self, prival, version, timestamp, hostname, appname, procid, msgid, elements, msg):
+        self.prival = prival
+        self.version = version
+        self.timestamp = timestamp
+        self.hostname = hostname
+        self.appname = appname
+        self.procid = procid
+        self.msgid = msgid
+        self.elements = elements
+        self.msg = msg
+
+    def __str__(self):
+        return "ParsedMessage(prival=%i, timestamp=%s, hostname=%s, appname=%s)" % (
+            self.prival, self.timestamp, self.hostname, self.appname)
+
+    @classmethod
+    def fromentry(cls, entry):
+        """
+        Construct a ParsedMessage from a loggerglue SyslogEntry.
+
+        :param entry: The parsed entry
+        :type entry: :class:`loggerglue.rfc5424.SyslogEntry`
+        :rtype: :class:`ParsedMessage`
+        """
+        elements = list()
+        if entry.structured_data is not None:
+            for element in entry.structured_data.elements:
+                elements.append((element.id, list(element.sd_params.allitems())))
+        timestamp = entry.timestamp
+        if timestamp is not None and timestamp.tzinfo is None:
+            timestamp = timestamp.replace(tzinfo=_utc)
+        # loggerglue returns an empty MSG when there is none
+        msg = entry.msg if entry.msg != u'' else None
+        return cls(entry.prival, entry.version, timestamp, entry.hostname, entry.app_name,
+            entry.procid, entry.msgid, elements, msg)
+
+_header = re.compile(r'<(\d{1,3})>([1-9]\d{0,2}) (\S+) (\S{1,255}) (\S{1,48}) (\S{1,128}) (\S{1,32}) ')
+_timestamp = re.compile(r'(\d{4})-(\d\d)-(\d\d)T(\d\d):(\d\d):(\d\d)(?:\.(\d{1,6}))?(?:(Z)|([+-])(\d\d):(\d\d))$')
+_sdname = re.compile(r'[^= \]"\x00-\x20\x7f-\xff]{1,32}')
+_paramname = re.compile(r' ([^= \]"\x00-\x20\x7f-\xff]{1,32})="')
+_unescape = re.compile(r'\\(["\\\]])')
+_version = re.compile(r'<\d{1,3}>[1-9]\d{0,2} ')
+_bsdheader = re.compile(r'<(\d{1,3})>(?:([A-Z][a-z]{2}) ([ \d]\d) (\d\d):(\d\d):(\d\d) (\S+) )?')
+_bsdtag = re.compile(r'([^\s\[\]:]{1,48})(?:\[([^\s\]]{1,128})\])?: ?')
+_months = {
+    'Jan': 1, 'Feb': 2, 'Mar': 3, 'Apr': 4, 'May': 5, 'Jun': 6,
+    'Jul': 7, 'Aug': 8, 'Sep': 9, 'Oct': 10, 'Nov': 11, 'Dec': 12
+}
+
+def _decode(value):
+    if value == '-':
+        return None
+    return value.decode('utf-8')
+
+class RFC5424Parser(object):
+    """
+    Parses RFC 5424 syslog messages.  Messages are parsed in place from a
+    byte string, so frames don't need to be copied out of a receive buffer
+    first.  The parser is written by hand because loggerglue's pyparsing
+    grammar is much too slow to keep up with a busy relay, but the grammar
+    is kept for strict validation: if strict is True every message is
+    parsed by loggerglue, and if fallback is True then messages which the
+    fast parser rejects are parsed by loggerglue before giving up.
+
+    If rfc3164 is True, then messages which don't have an RFC 5424 VERSION
+    are parsed as BSD syslog messages (RFC 3164), which have version 0.
+    BSD timestamps have no year or timezone, so they are assumed to be UTC
+    and within the last year.
+    """
+
+    def __init__(self, strict=False, fallback=True, rfc3164=True):
+        self.strict = strict
+        self.fallback = fallback
+        self.rfc3164 = rfc3164
+        self._lastts = None
+        self._lastdt = None
+        self._lastbsdts = None
+        self._lastbsddt = None
+
+    def __str__(self):
+        return "RFC5424Parser(strict=%s, fallback=%s, rfc3164=%s)" % (self.strict, self.fallback, self.rfc3164)
+
+    def _timestamp(self, ts):
+        if ts == '-':
+            return None
+        # messages from the same sender often share a timestamp
+        if ts == self._lastts:
+            return self._lastdt
+        m = _timestamp.match(ts)
+        if m is None:
+            raise ParseError("invalid TIMESTAMP '%s'" % ts)
+        year,month,day,hour,minute,second,frac,z,sign,offhour,offminute = m.groups()
+        usec = int(frac.ljust(6, '0')) if frac is not None else 0
+        try:
+            dt = datetime(int(year), int(month), int(day), int(hour), int(minute),
+                          int(second), usec, _utc)
+        except ValueError, e:
+            raise ParseError("invalid TIMESTAMP '%s': %s" % (ts, e))
+        if z is None:
+            offset = timedelta(hours=int(offhour), minutes=int(offminute))
+            dt = dt - offset if sign == '+' else dt + offset
+        self._lastts = ts
+        self._lastdt = dt
+        return dt
+
+    def _elements(self, data, pos, end):
+        """
+        Parse the SD-ELEMENTs beginning at pos.
+
+        :returns: A tuple containing the list of elements and the position
+          following the last element.
+        :rtype: tuple
+        """
+        elements = list()
+        while pos < end and data[pos] == '[':
+            m = _sdname.match(data, pos + 1, end)
+            if m is None:
+                raise ParseError("invalid SD-ID at offset %i" % (pos + 1))
+            sdid = m.group()
+            pos = m.end()
+            params = list()
+            while True:
+                if pos >= end:
+                    raise ParseError("unterminated SD-ELEMENT")
+                if data[pos] == ']':
+                    pos += 1
+                    break
+                m = _paramname.match(data, pos, end)
+                if m is None:
+                    raise ParseError("invalid SD-PARAM at offset %i" % pos)
+                name = m.group(1)
+                pos = m.end()
+                # find the closing quote, skipping escaped characters
+                close = data.find('"', pos, end)
+                if close == -1:
+                    raise ParseError("unterminated PARAM-VALUE")
+                escaped = data.find('\\', pos, close)
+                if escaped == -1:
+                    value = data[pos:close]
+                else:
+                    while escaped != -1:
+                        if escaped + 1 == close:
+                            close = data.find('"', close + 1, end)
+                            if close == -1:
+                                raise ParseError("unterminated PARAM-VALUE")
+                        escaped = data.find('\\', escaped + 2, close)
+                    value = _unescape.sub(r'\1', data[pos:close])
+                params.append((name, value.decode('utf-8')))
+                pos = close + 1
+            elements.append((sdid, params))
+        if len(elements) == 0:
+            raise ParseError("invalid STRUCTURED-DATA at offset %i" % pos)
+        return elements, pos
+
+    def _parsefast(self, data, start, end):
+        m = _header.match(data, start, end)
+        if m is None:
+            raise ParseError("invalid HEADER")
+        prival,version,ts,hostname,appname,procid,msgid = m.groups()
+        prival = int(prival)
+        if prival > 191:
+            raise ParseError("invalid PRI %i" % prival)
+        timestamp = self._timestamp(ts)
+        pos = m.end()
+        if pos < end and data[pos] == '-':
+            elements = list()
+            pos += 1
+        else:
+            elements,pos = self._elements(data, pos, end)
+        if pos == end:
+            msg = None
+        elif data[pos] == ' ':
+            if data.startswith(BOM, pos + 1, end):
+                msg = data[pos + 4:end].decode('utf-8')
+            else:
+                msg = data[pos + 1:end].decode('utf-8', 'replace')
+        else:
+            raise ParseError("expected SP after STRUCTURED-DATA at offset %i" % pos)
+        return ParsedMessage(prival, int(version), timestamp, _decode(hostname),
+            _decode(appname), _decode(procid), _decode(msgid), elements, msg)
+
+    def _bsdtimestamp(self, month, day, hour, minute, second):
+        key = (month, day, hour, minute, second)
+        if key == self._lastbsdts:
+            return self._lastbsddt
+        now = datetime.now(_utc)
+        try:
+            dt = datetime(now.year, _months[month], int(day), int(hour), int(minute),
+                          int(second), 0, _utc)
+        except (KeyError, ValueError), e:
+            raise ParseError("invalid TIMESTAMP: %s" % e)
+        # a timestamp in the future was probably sent last year
+        if dt - now > timedelta(days=1):
+            dt = dt.replace(year=now.year - 1)
+        self._lastbsdts = key
+        self._lastbsddt = dt
+        return dt
+
+    def _parsebsd(self, data, start, end):
+        m = _bsdheader.match(data, start, end)
+        if m is None:
+            raise ParseError("invalid PRI")
+        prival,month,day,hour,minute,second,hostname = m.groups()
+        prival = int(prival)
+        if prival > 191:
+            raise ParseError("invalid PRI %i" % prival)
+        timestamp = None
+        if month is not None:
+            timestamp = self._bsdtimestamp(month, day, hour, minute, second)
+            hostname = hostname.decode('utf-8', 'replace')
+        pos = m.end()
+        appname = procid = None
+        m = _bsdtag.match(data, pos, end)
+        if m is not None:
+            appname,procid = m.groups()
+            appname = appname.decode('utf-8', 'replace')
+            if procid is not None:
+                procid = procid.decode('utf-8', 'replace')
+            pos = m.end()
+        msg = data[pos:end].decode('utf-8', 'replace')
+        return ParsedMessage(prival, 0, timestamp, hostname, appname, procid, None, list(), msg)
+
+    def _parsestrict(self, data):
+        try:
+            parsed = syslog_msg.parseString(data)
+            entry = SyslogEntry.parse(parsed)
+        except Exception, e:
+            raise ParseError(str(e))
+        # loggerglue substitutes the current time for a NILVALUE timestamp
+        if parsed.TIMESTAMP == '-':
+            entry.timestamp = None
+        if entry.prival > 191:
+            raise ParseError("invalid PRI %i" % entry.prival)
+        return ParsedMessage.fromentry(entry)
+
+    def parse(self, data, start=0, end=None):
+        """
+        Parse the message contained in data[start:end].
+
+        :param data: The buffer containing the message
+        :type data: str
+        :param start: The offset of the start of the message
+        :type start: int
+        :param end: The offset of the end of the message, or None
+        :type end: int
+        :returns: The parsed message
+        :rtype: :class:`ParsedMessage`
+        :raises: :class:`ParseError`
+        """
+        if end is None:
+            end = len(data)
+        if self.rfc3164 and _version.match(data, start, end) is None:
+            return self._parsebsd(data, start, end)
+        if self.strict:
+            return self._parsestrict(data[start:end])
+        try:
+            return self._parsefast(data, start, end)
+        except (ParseError, ValueError), e:
+            if not self.fallback:
+                if isinstance(e, ParseError):
+                    raise
+                raise ParseError(str(e))
+            logger.debug("falling back to strict parsing: %s" % e)
+            return self._parsestrict(data[start:end])
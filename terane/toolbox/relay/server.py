@@ -15,26 +15,71 @@
 # You should have received a copy of the GNU General Public License
 # along with Terane.  If not, see <http://www.gnu.org/licenses/>.
 
-import os, sys, signal, traceback
+import os, sys, signal, socket, errno, traceback
 from tornado.tcpserver import TCPServer
 from tornado.iostream import StreamClosedError
-from tornado.ioloop import IOLoop
-from tornado.process import task_id
-from loggerglue.rfc5424 import SyslogEntry, syslog_msg
+from tornado.ioloop import IOLoop, PeriodicCallback
+from tornado.process import task_id, cpu_count
+from terane.pipeline import parsenodespec, makepipeline, makefilterchain
+from terane.toolbox.relay.pipeline import RelayPipeline, makeevent
+from terane.toolbox.relay.rfc5424 import RFC5424Parser, ParseError
+from terane.toolbox.relay.supervisor import Supervisor, bindreuseport, SO_REUSEPORT
+from terane.settings import ConfigureError
 from terane.loggers import getLogger, startLogging, StdoutHandler, DEBUG
 
 logger = getLogger('terane.toolbox.relay.server')
 
 class Server(object):
     """
-    Receives TCP syslog messages and processes them using the
-    specified pipeline.
+    Receives TCP (and optionally UDP) syslog messages and processes them
+    using the specified pipeline.
+
+    By default the listening sockets are bound before forking, so every
+    process accepts from the same queue.  If reuse port is enabled, each
+    worker binds its own sockets with SO_REUSEPORT so the kernel balances
+    connections between workers, and the parent process supervises the
+    workers, restarting any which exit and draining them on shutdown.
     """
     def configure(self, ns):
         # load configuration
-        section = ns.section("syslog")
+        section = ns.section("relay")
         self.nprocs = section.getInt("num processes", None)
         self.port = section.getInt("listen port", 10514)
+        self.reuseport = section.getBoolean("reuse port", False)
+        if self.reuseport and SO_REUSEPORT == None:
+            raise ConfigureError("reuse port is not supported on this platform")
+        # how long to wait for the sink to send buffered events on shutdown
+        self.draintimeout = section.getFloat("drain timeout", 5.0)
+        self.taskid = 0
+        self.stopping = False
+        # configure the pipeline, which consists of zero or more filters
+        # and a sink.  plugins are initialized after forking in run().
+        args = ns.args
+        if len(args) > 0:
+            spec = " ".join(args)
+        else:
+            spec = section.getString("pipeline", None)
+        if spec == None:
+            raise ConfigureError("no pipeline was specified")
+        nodes = list(parsenodespec(spec))
+        if len(nodes) < 1:
+            raise ConfigureError("pipeline must consist of at least one sink")
+        filters = makefilterchain(nodes[:-1])
+        sink = makepipeline(nodes[-1:])[0]
+        batchsize = section.getInt("batch size", 256)
+        self.pipeline = RelayPipeline(filters, sink, batchsize)
+        # validate every message using the (slow) loggerglue grammar
+        strict = section.getBoolean("strict parsing", False)
+        self.parser = RFC5424Parser(strict)
+        # the largest message accepted, and the most data buffered for
+        # each connection.  connections which exceed either are closed.
+        self.maxframe = section.getInt("max frame size", 64 * 1024)
+        self.maxbuffer = section.getInt("max buffer size", 1024 * 1024)
+        if self.maxframe > self.maxbuffer:
+            raise ConfigureError("max frame size must not be larger than max buffer size")
+        # also listen for UDP syslog messages on this port
+        self.udpport = section.getInt("udp listen port", None)
+        self.rcvbuf = section.getInt("udp receive buffer", 8 * 1024 * 1024)
         # configure server logging
         logconfigfile = section.getString('log config file', "%s.logconfig" % ns.appname)
         getLogger('tornado')
@@ -42,18 +87,61 @@ class Server(object):
             startLogging(StdoutHandler(), DEBUG, logconfigfile)
         else:
             startLogging(None)
-        self.handler = TCPHandler(max_buffer_size=65535)
+        self.handler = TCPHandler(self.pipeline, self.parser, self.maxframe,
+            max_buffer_size=self.maxbuffer)
+        self.udphandler = None
+        if self.udpport != None:
+            self.udphandler = UDPHandler(self.pipeline, self.parser, self.rcvbuf)
 
     def run(self):
+        if self.reuseport:
+            return self._supervise()
         logger.debug("starting main loop")
         self.handler.bind(self.port, address=None, backlog=128)
+        # the UDP socket is bound before forking, so it is shared by every process
+        if self.udphandler != None:
+            self.udphandler.bind(self.udpport)
         self.handler.start(self.nprocs)
+        self.taskid = 0 if task_id() == None else task_id()
+        self._serve()
+
+    def _supervise(self):
+        nprocs = self.nprocs if self.nprocs > 0 else cpu_count()
+        # check the ports can be bound, so a misconfiguration fails here
+        # rather than in every worker.  the sockets must be closed before
+        # forking, otherwise the kernel would queue connections for them.
+        sockets = bindreuseport(self.port, socket.SOCK_STREAM)
+        if self.udpport != None:
+            sockets += bindreuseport(self.udpport, socket.SOCK_DGRAM)
+        for sock in sockets:
+            sock.close()
+        logger.debug("starting %i workers with SO_REUSEPORT" % nprocs)
+        # workers get a few seconds beyond the drain timeout to exit cleanly
+        supervisor = Supervisor(nprocs, self._worker, self.draintimeout + 5.0)
+        return supervisor.run()
+
+    def _worker(self, taskid):
+        self.taskid = taskid
+        self.handler.add_sockets(bindreuseport(self.port, socket.SOCK_STREAM))
+        if self.udphandler != None:
+            self.udphandler.bind(self.udpport, reuseport=True)
+        self._serve()
+        return 0
+
+    def _serve(self):
+        if self.udphandler != None:
+            self.udphandler.start()
         signal.signal(signal.SIGINT, self.signal_shutdown)
         signal.signal(signal.SIGTERM, self.signal_shutdown)
         IOLoop.current().handle_callback_exception(self.handle_exception)
-        taskid = '0' if task_id() == None else task_id()
-        logger.debug("starting task %s (pid %d)" % (taskid, os.getpid()))
-        IOLoop.instance().start()
+        logger.debug("starting task %s (pid %d)" % (self.taskid, os.getpid()))
+        self.pipeline.init()
+        logger.info("relaying events to '%s'" % self.pipeline)
+        try:
+            IOLoop.instance().start()
+        finally:
+            self.pipeline.fini()
+        logger.info("relayed %i events, dropped %i" % (self.pipeline.processed, self.pipeline.dropped))
         logger.debug("stopping main loop")
 
     def handle_exception(self):
@@ -64,53 +152,179 @@ class Server(object):
         IOLoop.instance().add_callback_from_signal(self.shut_down)
 
     def shut_down(self):
-        taskid = '0' if task_id() == None else task_id()
-        logger.debug("stopping task %s" % taskid)
+        if self.stopping:
+            return
+        self.stopping = True
+        logger.debug("stopping task %s" % self.taskid)
         self.handler.stop()
-        IOLoop.current().stop()
+        if self.udphandler != None:
+            self.udphandler.stop()
+        # give the sink a few seconds to send whatever it has buffered
+        ioloop = IOLoop.current()
+        timeout = ioloop.add_timeout(ioloop.time() + self.draintimeout, ioloop.stop)
+        def drained():
+            ioloop.remove_timeout(timeout)
+            ioloop.stop()
+        self.pipeline.drain(drained)
 
 class TCPHandler(TCPServer):
     """
     Accepts incoming connections and hands each to a TCPSession.
     """
+    def __init__(self, pipeline, parser=None, maxframe=64 * 1024, max_buffer_size=1024 * 1024, **kwargs):
+        TCPServer.__init__(self, max_buffer_size=max_buffer_size, **kwargs)
+        self.pipeline = pipeline
+        self.parser = parser if parser is not None else RFC5424Parser()
+        self.maxframe = maxframe
+        self.maxbuffer = max_buffer_size
+
     def handle_stream(self, stream, address):
         host,port = address
         logger.debug("accepted connection from %s:%d" % (host,port))
-        TCPSession(stream, address)
+        TCPSession(stream, address, self.pipeline, self.parser, self.maxframe, self.maxbuffer)
 
 class TCPSession(object):
     """
-    Parses a TCP stream into individual frames.
+    Parses a TCP stream into individual frames, and passes each message
+    to the pipeline as an event.  Frames may use either octet-counting or
+    non-transparent (newline delimited) framing, as described in RFC 6587.
+
+    Rather than issuing a read for each length prefix and each message,
+    the session receives whatever data is available, parses every complete
+    frame in it, and keeps any partial frame until more data arrives.  The
+    data of a partial frame is kept as a list of chunks, which are only
+    joined once the frame is complete, so a large frame arriving in many
+    small reads isn't copied on every read.  A frame longer than maxframe
+    bytes, or more than maxbuffer bytes of unparsed data, closes the
+    connection.
     """
-    def __init__(self, stream, address):
+    def __init__(self, stream, address, pipeline, parser, maxframe=64 * 1024, maxbuffer=1024 * 1024):
         self.stream = stream
         self.address = address
+        self.pipeline = pipeline
+        self.parser = parser
+        self.maxframe = maxframe
+        self.maxbuffer = maxbuffer
+        # the chunks of a partial frame, their total size, and the size
+        # needed to complete the frame, or None if it ends with a newline
+        self.chunks = list()
+        self.buffered = 0
+        self.needed = None
+        # field identifiers announced by the sender on this connection
+        self.schema = dict()
         stream.set_close_callback(self._stream_closed)
-        self.read_frame()
+        try:
+            stream.read_until_close(self._stream_eof, streaming_callback=self._data_read)
+        except StreamClosedError:
+            self.cleanup()
 
     def closed(self):
         return True if self.stream == None or self.stream.closed() else False
 
-    def read_frame(self):
+    def _close(self, reason):
+        logger.info("closing connection from %s:%d: %s" % (self.address[0], self.address[1], reason))
+        self.chunks = list()
+        self.buffered = 0
+        self.cleanup()
+
+    def _data_read(self, data):
+        if self.buffered > 0:
+            self.chunks.append(data)
+            self.buffered += len(data)
+            if self.buffered > self.maxbuffer:
+                self._close("buffer size exceeded")
+                return
+            # wait until the partial frame is complete before joining
+            if self.needed == None:
+                if data.find('\n') == -1:
+                    if self.buffered > self.maxframe + 1:
+                        self._close("frame size exceeded")
+                    return
+            elif self.buffered < self.needed:
+                return
+            data = ''.join(self.chunks)
+            self.chunks = list()
+            self.buffered = 0
         try:
-            self.stream.read_until(' ', self._length_read)
-        except StreamClosedError:
-            self.cleanup()
+            pos,self.needed = self._parseframes(data)
+        except ParseError, e:
+            self._close(e)
+            return
+        if pos < len(data):
+            self.chunks.append(data[pos:] if pos > 0 else data)
+            self.buffered = len(data) - pos
+            if self.buffered > self.maxbuffer:
+                self._close("buffer size exceeded")
+
+    def _parseframes(self, data):
+        """
+        Parse every complete frame in data.
 
-    def _length_read(self, data):
-        length = int(data.strip())
-        logger.debug("expecting %i bytes" % length)
+        :returns: A tuple containing the offset of the first incomplete
+          frame, and the number of bytes from that offset needed to complete
+          it, or None if the frame ends with a newline.
+        :rtype: tuple
+        :raises: :class:`ParseError` if the framing is invalid
+        """
+        pos = 0
+        end = len(data)
+        maxframe = self.maxframe
+        while pos < end:
+            c = data[pos]
+            if c == '<':
+                # a non-transparently framed message, ending with a newline
+                eol = data.find('\n', pos, pos + maxframe + 2)
+                if eol == -1:
+                    if end - pos > maxframe + 1:
+                        raise ParseError("frame size exceeded")
+                    return pos, None
+                msgend = eol - 1 if data[eol - 1] == '\r' else eol
+                self._message_read(data, pos, msgend)
+                pos = eol + 1
+            elif c.isdigit():
+                # an octet-counted message, prefixed by its length
+                space = data.find(' ', pos, pos + 11)
+                if space == -1:
+                    if end - pos > 10:
+                        raise ParseError("invalid frame length")
+                    return pos, end - pos + 1
+                try:
+                    length = int(data[pos:space])
+                except ValueError:
+                    raise ParseError("invalid frame length")
+                if length > maxframe:
+                    raise ParseError("frame size %i exceeded %i" % (length, maxframe))
+                msgend = space + 1 + length
+                if msgend > end:
+                    return pos, msgend - pos
+                self._message_read(data, space + 1, msgend)
+                pos = msgend
+            elif c in '\r\n ':
+                pos += 1
+            else:
+                raise ParseError("invalid frame")
+        return pos, None
+
+    def _message_read(self, data, start, end):
         try:
-            self.stream.read_bytes(length, self._message_read)
-        except StreamClosedError:
-            self.cleanup()
+            message = self.parser.parse(data, start, end)
+            self.pipeline.put(makeevent(message, self.schema))
+        except ParseError, e:
+            logger.debug("dropped invalid message from %s:%d: %s" % (self.address[0], self.address[1], e))
+            self.pipeline.dropped += 1
+        except Exception, e:
+            logger.warning("dropped message from %s:%d: %s\n%s" % (
+                self.address[0], self.address[1], e, traceback.format_exc()))
+            self.pipeline.dropped += 1
 
-    def _message_read(self, data):
-        logger.debug("read %i bytes for message" % len(data))
-        r = syslog_msg.parseString(data)
-        message = SyslogEntry.parse(r)
-        logger.debug("parsed syslog message: %s" % message)
-        self.read_frame()
+    def _stream_eof(self, data):
+        if data != '':
+            self._data_read(data)
+        if self.buffered > 0:
+            logger.debug("discarding %i bytes of incomplete frame from %s:%d" % (
+                self.buffered, self.address[0], self.address[1]))
+            self.chunks = list()
+            self.buffered = 0
 
     def _stream_closed(self):
         logger.debug("stream has been closed")
@@ -120,3 +334,181 @@ class TCPSession(object):
         if not self.stream == None and not self.stream.closed():
             self.stream.close()
         self.stream = None
+
+def kerneldrops(sock):
+    """
+    Return the number of datagrams the kernel dropped because the receive
+    buffer of the specified UDP socket was full, as reported in
+    /proc/net/udp.
+
+    :param sock: The socket
+    :type sock: :class:`socket.socket`
+    :returns: The number of drops, or None if it isn't available.
+    :rtype: int
+    """
+    inode = str(os.fstat(sock.fileno()).st_ino)
+    for path in ('/proc/net/udp', '/proc/net/udp6'):
+        try:
+            f = open(path, 'r')
+        except IOError:
+            continue
+        with f:
+            f.readline()
+            for line in f:
+                fields = line.split()
+                if len(fields) > 12 and fields[9] == inode:
+                    return int(fields[12])
+    return None
+
+class SourceStats(object):
+    """
+    Counters for the datagrams received from a single source address.  The
+    schema holds the field identifiers announced by the source, or is None
+    if fields sent by the source shouldn't be decoded.
+    """
+
+    __slots__ = ('packets', 'bytes', 'invalid', 'schema')
+
+    def __init__(self, schema=True):
+        self.packets = 0
+        self.bytes = 0
+        self.invalid = 0
+        self.schema = dict() if schema else None
+
+class UDPHandler(object):
+    """
+    Receives syslog messages over UDP, one message per datagram, and passes
+    them to the same parser and pipeline as TCP.  The socket is given a
+    large receive buffer so bursts are absorbed by the kernel rather than
+    dropped, and when the socket becomes readable it is drained in batches
+    of up to batchsize datagrams with recvfrom_into() into a preallocated
+    buffer, yielding to the IOLoop between batches.
+
+    Packets, bytes and invalid messages are counted per source address and
+    port, up to maxsources sources, after which new sources are counted
+    together.  Every sender numbers the fields it announces independently,
+    so the schema is kept per source as well, and the fields of messages
+    from sources counted together are not decoded.
+    Every statsinterval seconds the number of datagrams dropped by the
+    kernel is read from /proc/net/udp, and logged if it has increased.
+    """
+
+    OTHER = '(other)'
+
+    def __init__(self, pipeline, parser=None, rcvbuf=8 * 1024 * 1024, batchsize=256,
+                 maxsources=10000, statsinterval=60.0):
+        self.pipeline = pipeline
+        self.parser = parser if parser is not None else RFC5424Parser()
+        self.rcvbuf = rcvbuf
+        self.batchsize = batchsize
+        self.maxsources = maxsources
+        self.statsinterval = statsinterval
+        self.socket = None
+        self.port = None
+        self.ioloop = None
+        self.stats = None
+        self.buffer = bytearray(65536)
+        self.sources = dict()
+        self.drops = 0
+
+    def bind(self, port, address='', reuseport=False):
+        family = socket.AF_INET6 if ':' in address else socket.AF_INET
+        sock = socket.socket(family, socket.SOCK_DGRAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if reuseport:
+            # the kernel distributes datagrams between every socket bound to the port
+            sock.setsockopt(socket.SOL_SOCKET, SO_REUSEPORT, 1)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.rcvbuf)
+        # linux doubles the requested size, and caps it at net.core.rmem_max
+        rcvbuf = sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)
+        if rcvbuf < self.rcvbuf:
+            logger.warning("UDP receive buffer is only %i bytes, increase net.core.rmem_max" % rcvbuf)
+        sock.setblocking(0)
+        sock.bind((address, port))
+        self.socket = sock
+        self.port = sock.getsockname()[1]
+        logger.debug("listening for UDP on port %i" % self.port)
+
+    def start(self):
+        self.ioloop = IOLoop.current()
+        self.ioloop.add_handler(self.socket.fileno(), self._readable, IOLoop.READ)
+        if self.statsinterval > 0:
+            self.stats = PeriodicCallback(self.checkdrops, self.statsinterval * 1000.0)
+            self.stats.start()
+
+    def stop(self):
+        if self.socket == None:
+            return
+        self.ioloop.remove_handler(self.socket.fileno())
+        if self.stats != None:
+            self.stats.stop()
+            self.stats = None
+        self.checkdrops()
+        self.socket.close()
+        self.socket = None
+        packets = sum([s.packets for s in self.sources.values()])
+        invalid = sum([s.invalid for s in self.sources.values()])
+        logger.info("received %i UDP datagrams from %i sources, %i invalid, %i dropped by the kernel" % (
+            packets, len(self.sources), invalid, self.drops))
+        for source,stats in sorted(self.sources.items(), key=lambda item: -item[1].packets)[:10]:
+            logger.debug("%s: %i datagrams, %i bytes, %i invalid" % (source, stats.packets, stats.bytes, stats.invalid))
+
+    def checkdrops(self):
+        """
+        Log the number of datagrams dropped by the kernel since the last check.
+        """
+        drops = kerneldrops(self.socket)
+        if drops == None:
+            return
+        if drops > self.drops:
+            logger.warning("kernel dropped %i UDP datagrams, the receive buffer is too small" % (drops - self.drops))
+        self.drops = drops
+
+    def _source(self, source):
+        stats = self.sources.get(source)
+        if stats is None:
+            if len(self.sources) >= self.maxsources:
+                stats = self.sources.get(UDPHandler.OTHER)
+                if stats is None:
+                    stats = SourceStats(schema=False)
+                    self.sources[UDPHandler.OTHER] = stats
+            else:
+                stats = SourceStats()
+                self.sources[source] = stats
+        return stats
+
+    def _readable(self, fd, events):
+        recvfrom_into = self.socket.recvfrom_into
+        buf = self.buffer
+        datagrams = list()
+        while len(datagrams) < self.batchsize:
+            try:
+                nbytes,address = recvfrom_into(buf)
+            except socket.error, e:
+                if e.errno == errno.EINTR:
+                    continue
+                if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    break
+                raise
+            datagrams.append((buffer(buf, 0, nbytes)[:], address[:2]))
+        # if there are more datagrams waiting, the IOLoop calls us again
+        # after running any other handlers which are ready
+        parse = self.parser.parse
+        for data,source in datagrams:
+            stats = self._source(source)
+            stats.packets += 1
+            stats.bytes += len(data)
+            end = len(data)
+            while end > 0 and data[end - 1] in '\r\n\x00':
+                end -= 1
+            try:
+                self.pipeline.put(makeevent(parse(data, 0, end), stats.schema))
+            except ParseError, e:
+                logger.debug("dropped invalid datagram from %s: %s" % (source, e))
+                stats.invalid += 1
+                self.pipeline.dropped += 1
+            except Exception, e:
+                logger.warning("dropped datagram from %s: %s\n%s" % (
+                    source, e, traceback.format_exc()))
+                stats.invalid += 1
+                self.pipeline.dropped += 1
@@ -6,44 +6,169 @@
 # it under the terms of the GNU General Public License as published by
 # the Free Software Foundation, either version 3 of the License, or
 # (at your option) any later version.
-#
+# 
 # Terane is distributed in the hope that it will be useful,
 # but WITHOUT ANY WARRANTY; without even the implied warranty of
 # MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
 # GNU General Public License for more details.
-#
+# 
 # You should have received a copy of the GNU General Public License
 # along with Terane.  If not, see <http://www.gnu.org/licenses/>.
 
-import os, signal
-from tornado.tcpserver import TCPServer
-from tornado.iostream import StreamClosedError
+import socket, time
+from tornado.iostream import IOStream, SSLIOStream
 from tornado.ioloop import IOLoop
-from tornado.process import task_id
-from loggerglue.rfc5424 import SyslogEntry, syslog_msg
-from terane.plugin import IPlugin
+from loggerglue.emitter import TCPSyslogEmitter
+from terane.sinks.syslog import SyslogSink as BaseSyslogSink, SchemaTracker
+from terane.pipeline import DropEvent
 from terane.settings import ConfigureError
-from terane.loggers import getLogger, startLogging, StdoutHandler, DEBUG
+from terane.loggers import getLogger
 
-logger = getLogger('terane.toolbox.syslog.sink')
+logger = getLogger('terane.toolbox.relay.sink')
 
-class SyslogSink(IPlugin):
+class SyslogSink(BaseSyslogSink):
     """
+    Forward events to a syslog server over TCP from the relay's IOLoop.
+    Messages are buffered in memory and written with a single non-blocking
+    write whenever the previous write has completed, so the IOLoop never
+    waits on the network.  If the connection is lost the sink reconnects
+    with exponential backoff, buffering messages meanwhile; once more than
+    buffer size bytes are waiting, events are dropped.
+
+    This sink may only be used by terane-relay.
     """
-    def __init__(self, ioloop=None):
-        self.ioloop = ioloop
-        self.host = 'localhost'
-        self.port = 514
+
+    def __init__(self, *args, **kwargs):
+        BaseSyslogSink.__init__(self)
+        self.buffersize = 16 * 1024 * 1024
+        self.ioloop = None
+
+    def __str__(self):
+        return "RelaySyslogSink(%s:%i)" % (self.address, self.port)
 
     def configure(self, section):
-        pass
+        url = section.getString("host", None)
+        if url != None:
+            self.factory,args = self._parsehost(url)
+            if self.factory is not TCPSyslogEmitter:
+                raise ConfigureError("relay sink only supports TCP transports")
+            self.address,self.port = args['address']
+            self.args.update(args)
+        # drop events once this many bytes are waiting to be sent
+        self.buffersize = section.getInt("buffer size", self.buffersize)
 
     def init(self):
-        self.queue = list()
+        self.ioloop = IOLoop.current()
+        self.tracker = SchemaTracker(self._schemaparams)
         self.stream = None
+        self.connected = False
+        self.writing = False
+        self.pending = list()
+        self.pendingsize = 0
+        self.retrydelay = 0.0
+        self.retry = None
+        self.drained = None
+        self.sent = 0
+        self._connect()
+
+    def _connect(self):
+        self.retry = None
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        if 'cert_reqs' in self.args:
+            stream = SSLIOStream(sock, ssl_options=dict(cert_reqs=self.args['cert_reqs']))
+        else:
+            stream = IOStream(sock)
+        stream.set_close_callback(self._closed)
+        self.stream = stream
+        stream.connect(self.args['address'], self._connected)
 
-    def _reconnect(self):
-        pass
+    def _connected(self):
+        logger.debug("connected to %s:%i" % (self.address, self.port))
+        self.connected = True
+        self.retrydelay = 0.0
+        self._write()
+
+    def _closed(self):
+        error = self.stream.error if self.stream != None else None
+        if self.connected:
+            logger.warning("connection to %s:%i closed: %s" % (self.address, self.port, error))
+        else:
+            logger.debug("failed to connect to %s:%i: %s" % (self.address, self.port, error))
+        self.stream = None
+        self.connected = False
+        # whatever was being written when the connection closed is lost
+        self.writing = False
+        self.tracker.reset()
+        self.retrydelay = min(max(1.0, self.retrydelay * 2), 30.0)
+        self.retry = self.ioloop.add_timeout(time.time() + self.retrydelay, self._connect)
+        self._drained()
+
+    def _write(self):
+        if not self.connected or self.writing or len(self.pending) == 0:
+            return
+        assemble = self.tracker.assemble
+        frames = list()
+        for msg in self.pending:
+            data = assemble(msg)
+            frames.append("%i %s" % (len(data), data))
+        self.sent += len(self.pending)
+        self.pending = list()
+        self.pendingsize = 0
+        self.writing = True
+        self.stream.write(''.join(frames), self._written)
+
+    def _written(self):
+        self.writing = False
+        if len(self.pending) > 0:
+            self._write()
+        else:
+            self._drained()
+
+    def _drained(self):
+        if self.drained != None and not self.writing and (len(self.pending) == 0 or not self.connected):
+            callback = self.drained
+            self.drained = None
+            callback()
+
+    def drain(self, callback):
+        """
+        Call callback once every buffered message has been written, or
+        immediately if the sink isn't connected.
+        """
+        self.drained = callback
+        self._drained()
+
+    def consume_batch(self, events):
+        """
+        Buffer the events and start writing them if the connection is idle.
+
+        :returns: The number of events dropped because the buffer is full.
+        :rtype: int
+        """
+        dropped = 0
+        for event in events:
+            msg = self._format(event)
+            if self.pendingsize + len(msg) > self.buffersize:
+                dropped += 1
+                continue
+            self.pending.append(msg)
+            self.pendingsize += len(msg)
+        if dropped > 0:
+            logger.debug("send buffer is full, dropped %i events" % dropped)
+        self._write()
+        return dropped
 
     def consume(self, event):
-        self.queue.append(event)
+        if self.consume_batch([event]) > 0:
+            raise DropEvent("send buffer is full")
+
+    def fini(self):
+        if self.retry != None:
+            self.ioloop.remove_timeout(self.retry)
+            self.retry = None
+        if self.stream != None:
+            self.stream.set_close_callback(None)
+            self.stream.close()
+            self.stream = None
+        if len(self.pending) > 0:
+            logger.warning("dropped %i unsent messages" % len(self.pending))
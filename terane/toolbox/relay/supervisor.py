@@ -0,0 +1,212 @@
+# Copyright 2013 Michael Frank <msfrank@syntaxjockey.com>
+#
+# This file is part of Terane.
+#
+# Terane is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Terane is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Terane.  If not, see <http://www.gnu.org/licenses/>.
+
+import os, sys, time, errno, signal, socket, traceback
+from terane.loggers import getLogger
+
+logger = getLogger('terane.toolbox.relay.supervisor')
+
+# python 2 doesn't define SO_REUSEPORT, although linux has supported it since 3.9
+if hasattr(socket, 'SO_REUSEPORT'):
+    SO_REUSEPORT = socket.SO_REUSEPORT
+elif sys.platform.startswith('linux'):
+    SO_REUSEPORT = 15
+else:
+    SO_REUSEPORT = None
+
+def bindreuseport(port, socktype, address=None, backlog=128):
+    """
+    Bind sockets for every address family on the specified port with
+    SO_REUSEPORT set, so several processes may bind the same port and the
+    kernel distributes connections (or datagrams) between them.
+
+    :param port: The port to bind
+    :type port: int
+    :param socktype: socket.SOCK_STREAM or socket.SOCK_DGRAM
+    :param address: The address to bind, or None to bind every address
+    :type address: str
+    :param backlog: The listen backlog for stream sockets
+    :type backlog: int
+    :returns: A list of non-blocking sockets
+    :rtype: list
+    """
+    if SO_REUSEPORT is None:
+        raise socket.error(errno.ENOPROTOOPT, "SO_REUSEPORT is not supported on this platform")
+    sockets = list()
+    seen = set()
+    for family,_,proto,_,sockaddr in socket.getaddrinfo(address, port, socket.AF_UNSPEC,
+                                                         socktype, 0, socket.AI_PASSIVE):
+        if (family, sockaddr) in seen:
+            continue
+        seen.add((family, sockaddr))
+        sock = socket.socket(family, socktype, proto)
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            sock.setsockopt(socket.SOL_SOCKET, SO_REUSEPORT, 1)
+            if family == socket.AF_INET6:
+                # bind the IPv4 address with its own socket
+                sock.setsockopt(socket.IPPROTO_IPV6, socket.IPV6_V6ONLY, 1)
+            sock.setblocking(0)
+            sock.bind(sockaddr)
+            if socktype == socket.SOCK_STREAM:
+                sock.listen(backlog)
+        except:
+            sock.close()
+            for s in sockets:
+                s.close()
+            raise
+        sockets.append(sock)
+    return sockets
+
+class Supervisor(object):
+    """
+    Runs target(taskid) in each of nprocs worker processes, restarting any
+    worker which exits until the supervisor is told to stop.  A worker which
+    exits within a second of starting is restarted after a delay, doubling
+    up to 30 seconds, so a worker which can't start doesn't spin.
+
+    When the supervisor receives SIGTERM or SIGINT it sends SIGTERM to every
+    worker and waits for them to finish draining.  Workers which haven't
+    exited after draintimeout seconds are killed.
+    """
+
+    def __init__(self, nprocs, target, draintimeout=10.0):
+        self.nprocs = nprocs
+        self.target = target
+        self.draintimeout = draintimeout
+        self.children = dict()
+        self.started = dict()
+        self.delays = dict()
+        self.restarts = dict()
+        self.stopsignal = None
+        self.stopping = False
+        self.killat = None
+
+    def __str__(self):
+        return "Supervisor(nprocs=%i, draintimeout=%s)" % (self.nprocs, self.draintimeout)
+
+    def _spawn(self, taskid):
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            try:
+                status = self.target(taskid)
+            except BaseException, e:
+                logger.error("worker %i failed: %s\n%s" % (taskid, e, traceback.format_exc()))
+                status = 1
+            os._exit(status if status is not None else 0)
+        logger.debug("started worker %i (pid %i)" % (taskid, pid))
+        self.children[pid] = taskid
+        self.started[taskid] = time.time()
+
+    def _stop(self, signum, frame):
+        # only record the signal, the supervisor loop does the work.  logging
+        # from a signal handler can deadlock on the lock the interrupted code
+        # holds.
+        if self.stopsignal is None:
+            self.stopsignal = signum
+
+    def _drain(self):
+        logger.info("caught signal %i, stopping %i workers" % (self.stopsignal, len(self.children)))
+        self.stopping = True
+        self.restarts.clear()
+        for pid in self.children.keys():
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                pass
+        self.killat = time.time() + self.draintimeout
+
+    def _kill(self):
+        for pid,taskid in self.children.items():
+            logger.warning("worker %i (pid %i) didn't stop, killing it" % (taskid, pid))
+            try:
+                os.kill(pid, signal.SIGKILL)
+            except OSError:
+                pass
+        self.killat = None
+
+    def _restartdelay(self, taskid):
+        if time.time() - self.started[taskid] < 1.0:
+            delay = min(max(1.0, self.delays.get(taskid, 0.0) * 2), 30.0)
+        else:
+            delay = 0.0
+        self.delays[taskid] = delay
+        return delay
+
+    def _reap(self):
+        """
+        Reap every worker which has exited without blocking, and schedule
+        its restart unless the supervisor is stopping.
+        """
+        while len(self.children) > 0:
+            try:
+                pid,status = os.waitpid(-1, os.WNOHANG)
+            except OSError, e:
+                if e.errno == errno.EINTR:
+                    continue
+                if e.errno == errno.ECHILD:
+                    self.children.clear()
+                    return
+                raise
+            if pid == 0:
+                return
+            taskid = self.children.pop(pid, None)
+            if taskid is None:
+                continue
+            if os.WIFSIGNALED(status):
+                reason = "was killed by signal %i" % os.WTERMSIG(status)
+            else:
+                reason = "exited with status %i" % os.WEXITSTATUS(status)
+            if self.stopping:
+                logger.debug("worker %i (pid %i) %s" % (taskid, pid, reason))
+                continue
+            delay = self._restartdelay(taskid)
+            logger.warning("worker %i (pid %i) %s, restarting in %.0f seconds" % (taskid, pid, reason, delay))
+            self.restarts[taskid] = time.time() + delay
+
+    def run(self):
+        """
+        Start the workers and supervise them until every worker has exited
+        after the supervisor was stopped.
+
+        :returns: The exit status
+        :rtype: int
+        """
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+        for taskid in xrange(self.nprocs):
+            self._spawn(taskid)
+        while True:
+            if self.stopsignal is not None and not self.stopping:
+                self._drain()
+            self._reap()
+            now = time.time()
+            if self.stopping:
+                if len(self.children) == 0:
+                    break
+                if self.killat is not None and now >= self.killat:
+                    self._kill()
+            for taskid,restartat in self.restarts.items():
+                if restartat <= now:
+                    del self.restarts[taskid]
+                    self._spawn(taskid)
+            # a signal interrupts the sleep, so stopping is handled promptly
+            time.sleep(0.1)
+        logger.debug("every worker has stopped")
+        return 0
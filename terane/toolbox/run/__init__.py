@@ -25,6 +25,15 @@ def run_main():
         description="Run the specified pipeline",
         section="run")
     try:
+        settings.addOption("b", "batch-size",
+            override="batch size", help="process events in batches of NUM", metavar="NUM"
+            )
+        settings.addOption("w", "workers",
+            override="workers", help="run filters in NUM worker processes", metavar="NUM"
+            )
+        settings.addLongSwitch("unordered",
+            override="unordered delivery", help="Don't preserve event order when using workers"
+            )
         settings.addLongOption("log-config",
             override="log config file", help="use logging configuration file FILE", metavar="FILE"
             )
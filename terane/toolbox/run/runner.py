@@ -17,7 +17,7 @@
 
 import sys
 from terane.plugin import PluginManager
-from terane.pipeline import Pipeline, parsenodespec, makepipeline
+from terane.pipeline import Pipeline, ParallelPipeline, parsenodespec, makepipeline
 from terane.settings import ConfigureError
 from terane.loggers import getLogger, startLogging, StdoutHandler, DEBUG
 
@@ -39,13 +39,20 @@ class Runner(object):
             spec = section.getString("pipeline", None)
         if spec == None:
             raise ConfigureError("no pipeline was specified")
-        nodes = makepipeline(parsenodespec(spec))
+        nodes = list(parsenodespec(spec))
         if len(nodes) < 2:
             raise ConfigureError("pipeline must consist of at least one source and one sink")
-        source = nodes.pop(0)
-        sink = nodes.pop(-1)
-        filters = nodes
-        self.pipeline = Pipeline(source, sink, filters)
+        source = makepipeline(nodes[:1])[0]
+        sink = makepipeline(nodes[-1:])[0]
+        batchsize = section.getInt("batch size", None)
+        workers = section.getInt("workers", None)
+        if workers != None and workers > 1:
+            # each worker constructs its own filters from the node specs
+            ordered = not section.getBoolean("unordered delivery", False)
+            self.pipeline = ParallelPipeline(source, sink, nodes[1:-1], workers, ordered, batchsize)
+        else:
+            filters = makepipeline(nodes[1:-1])
+            self.pipeline = Pipeline(source, sink, filters, batchsize)
         # configure server logging
         logconfigfile = section.getString('log config file', "%s.logconfig" % ns.appname)
         if section.getBoolean("debug", False):
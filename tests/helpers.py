@@ -0,0 +1,108 @@
+import os, time
+from pkg_resources import working_set, Distribution, EntryPoint
+from terane.plugin import IPlugin
+
+_plugins = Distribution(os.path.dirname(os.path.abspath(__file__)), project_name='terane-tests', version='0')
+_plugins._ep_map = {'terane.plugin.pipeline': dict()}
+working_set.add(_plugins)
+
+def registerplugin(name, target):
+    """
+    Register a pipeline plugin entry point, so plugins can be constructed
+    by name whether or not terane is installed.
+    """
+    entrypoints = _plugins._ep_map['terane.plugin.pipeline']
+    entrypoints[name] = EntryPoint.parse("%s = %s" % (name, target), dist=_plugins)
+
+class ListSink(object):
+    """
+    A sink which collects the events it consumes.
+    """
+
+    def __init__(self):
+        self.events = list()
+        self.batches = 0
+
+    def init(self):
+        pass
+
+    def fini(self):
+        pass
+
+    def consume(self, event):
+        self.events.append(event)
+
+class BatchListSink(ListSink):
+
+    def consume_batch(self, events):
+        self.batches += 1
+        self.events.extend(events)
+
+class MessageListSink(ListSink):
+    """
+    A sink which collects the message of each event it consumes.
+    """
+
+    def consume(self, event):
+        self.events.append(event.message())
+
+class BatchCollectingSink(object):
+    """
+    A sink which collects each batch of events it consumes.
+    """
+
+    def __init__(self):
+        self.batches = list()
+
+    def init(self):
+        pass
+
+    def fini(self):
+        pass
+
+    def consume_batch(self, events):
+        self.batches.append(events)
+
+class FailingFilter(IPlugin):
+
+    def filter(self, event):
+        raise Exception("filter failed")
+
+class WorkerInitFailingFilter(IPlugin):
+    """
+    A filter which can only be initialized in the process which loaded it.
+    """
+
+    pid = os.getpid()
+
+    def init(self):
+        if os.getpid() != WorkerInitFailingFilter.pid:
+            raise Exception("init failed")
+
+    def filter(self, event):
+        return event
+
+class UnpicklableFilter(IPlugin):
+
+    def filter_batch(self, events):
+        return [lambda: event for event in events]
+
+class ExitingSource(object):
+    """
+    A source which exits the worker process which initializes it.
+    """
+
+    path = "exiting"
+
+    def init(self):
+        os._exit(1)
+
+class SleepyFilter(IPlugin):
+    """
+    A filter which delays batches by an amount depending on their first
+    event, so batches complete out of order.
+    """
+
+    def filter_batch(self, events):
+        time.sleep((events[0] % 3) * 0.01)
+        return events
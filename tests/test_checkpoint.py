@@ -0,0 +1,72 @@
+import os, json, shutil, tempfile, threading
+from terane.sources.checkpoint import CheckpointStore
+from terane.sources.file import FileSource
+from terane.sources.tail import TailSource
+from terane.pipeline import Pipeline
+from helpers import MessageListSink
+
+class TestCheckpoints(object):
+
+    def setup(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'test.log')
+        self.state = os.path.join(self.tmpdir, 'checkpoints')
+        with open(self.path, 'w') as f:
+            f.write("one\ntwo\nthree\n")
+
+    def teardown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _append(self, data):
+        with open(self.path, 'a') as f:
+            f.write(data)
+
+    def test_store_batches_writes(self):
+        store = CheckpointStore(self.state, interval=3600, count=3)
+        stats = os.stat(self.path)
+        store.update(self.path, stats.st_ino, stats.st_dev, 4)
+        store.update(self.path, stats.st_ino, stats.st_dev, 8)
+        assert not os.path.exists(self.state)
+        store.update(self.path, stats.st_ino, stats.st_dev, 14)
+        assert json.load(open(self.state))[self.path]['offset'] == 14
+        assert CheckpointStore(self.state).lookup(self.path, stats) == 14
+        assert CheckpointStore(self.state).lookup('/nonexistent', stats) == None
+
+    def test_file_source_resume(self):
+        source = FileSource()
+        source.path = self.path
+        source.checkpointfile = self.state
+        sink = MessageListSink()
+        source.init()
+        assert source.emit().message() == u"one"
+        source.commit(source.checkpoint())
+        assert source.emit().message() == u"two"
+        # the second event was never consumed, so it isn't committed
+        source.fini()
+        sink = MessageListSink()
+        Pipeline(source, sink).run()
+        assert sink.events == [u"two", u"three"]
+        # the whole file was consumed
+        sink = MessageListSink()
+        Pipeline(source, sink).run()
+        assert sink.events == []
+
+    def test_tail_source_resume(self):
+        source = TailSource()
+        source.path = self.path
+        source.sleeptime = 0.05
+        source.inotify = False
+        source.checkpointfile = self.state
+        source.init()
+        threading.Timer(0.2, self._append, ("four\n",)).start()
+        assert source.emit().message() == u"four"
+        source.commit(source.checkpoint())
+        source.fini()
+        # lines written while the source was down are not lost
+        self._append("five\nsix\n")
+        source.init()
+        try:
+            assert source.emit().message() == u"five"
+            assert source.emit().message() == u"six"
+        finally:
+            source.fini()
@@ -0,0 +1,156 @@
+import os, gzip, bz2, zlib, shutil, tempfile
+from nose.plugins.skip import SkipTest
+from terane.sources.compressed import detectcompression, DecompressingReader, CompressionError, \
+     lzma, GZIP, BZIP2, XZ
+from terane.sources.file import FileSource
+
+class TestCompressedFileSource(object):
+
+    def setup(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.lines = ["line %i" % i for i in range(5000)]
+        self.data = "".join(line + "\n" for line in self.lines)
+
+    def teardown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _read(self, path, **kwargs):
+        source = FileSource()
+        source.path = path
+        for name,value in kwargs.items():
+            setattr(source, name, value)
+        source.init()
+        messages = list()
+        try:
+            while True:
+                messages.append(source.emit().message())
+        except StopIteration:
+            pass
+        source.fini()
+        return messages
+
+    def test_gzip(self):
+        path = os.path.join(self.tmpdir, 'test.log.gz')
+        with gzip.open(path, 'wb') as f:
+            f.write(self.data)
+        assert detectcompression(path) == GZIP
+        assert self._read(path) == self.lines
+        assert self._read(path, buffersize=512, decompressthread=True) == self.lines
+
+    def test_gzip_concatenated(self):
+        path = os.path.join(self.tmpdir, 'test.log.gz')
+        half = len(self.data) / 2
+        half = self.data.index("\n", half) + 1
+        for data in (self.data[:half], self.data[half:]):
+            with gzip.open(path + '.part', 'wb') as f:
+                f.write(data)
+            with open(path, 'ab') as f:
+                f.write(open(path + '.part', 'rb').read())
+        assert self._read(path, buffersize=100) == self.lines
+
+    def test_bzip2(self):
+        path = os.path.join(self.tmpdir, 'test.log.bz2')
+        with open(path, 'wb') as f:
+            f.write(bz2.compress(self.data))
+        assert detectcompression(path) == BZIP2
+        assert self._read(path, decompressthread=True) == self.lines
+
+    def test_xz(self):
+        if lzma is None:
+            raise SkipTest("lzma is not available")
+        path = os.path.join(self.tmpdir, 'test.log.xz')
+        with open(path, 'wb') as f:
+            f.write(lzma.compress(self.data))
+        assert detectcompression(path) == XZ
+        assert self._read(path) == self.lines
+
+    def test_uncompressed(self):
+        path = os.path.join(self.tmpdir, 'test.log')
+        with open(path, 'wb') as f:
+            f.write(self.data)
+        assert detectcompression(path) == None
+        assert self._read(path) == self.lines
+
+    def _pieces(self, path, compression, blocksize):
+        reader = DecompressingReader(open(path, 'rb'), compression, blocksize)
+        pieces = list()
+        while True:
+            if reader._inoffset == len(reader._input):
+                reader._input = reader._f.read(blocksize)
+                reader._inoffset = 0
+                if reader._input == '':
+                    break
+            pieces.append(len(reader._decompress()))
+        reader.close()
+        return pieces
+
+    def test_bounded_output(self):
+        size = 32 * 1024 * 1024
+        path = os.path.join(self.tmpdir, 'zeros.gz')
+        with gzip.open(path, 'wb') as f:
+            for i in range(32):
+                f.write('\x00' * (1024 * 1024))
+        pieces = self._pieces(path, GZIP, 64 * 1024)
+        assert sum(pieces) == size
+        assert max(pieces) <= 64 * 1024
+        # bzip2 output is bounded by the blocks in a small slice of input
+        path = os.path.join(self.tmpdir, 'pattern.bz2')
+        compressor = bz2.BZ2Compressor()
+        with open(path, 'wb') as f:
+            for i in range(8):
+                f.write(compressor.compress('0123456789' * (1024 * 1024 / 10)))
+            f.write(compressor.flush())
+        assert os.path.getsize(path) < 64 * 1024
+        pieces = self._pieces(path, BZIP2, 64 * 1024)
+        assert sum(pieces) == 8 * (1024 * 1024 / 10) * 10
+        assert max(pieces) <= 2 * 1024 * 1024
+
+    def _readall(self, data, compression):
+        path = os.path.join(self.tmpdir, 'test.log.compressed')
+        with open(path, 'wb') as f:
+            f.write(data)
+        reader = DecompressingReader(open(path, 'rb'), compression, 4096)
+        try:
+            output = ''
+            while True:
+                block = reader.read(4096)
+                if block == '':
+                    return output
+                output += block
+        finally:
+            reader.close()
+
+    def _truncated(self, data, compression):
+        assert self._readall(data, compression) == self.data
+        for end in (len(data) - 4, len(data) / 2):
+            try:
+                self._readall(data[:end], compression)
+            except CompressionError:
+                continue
+            raise AssertionError("truncated %s data was read without an error" % compression)
+
+    def test_truncated(self):
+        compressor = zlib.compressobj(9, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        self._truncated(compressor.compress(self.data) + compressor.flush(), GZIP)
+        self._truncated(bz2.compress(self.data), BZIP2)
+        # a complete stream followed by a truncated one
+        data = bz2.compress(self.data[:100])
+        try:
+            self._readall(data + data[:-4], BZIP2)
+        except CompressionError:
+            pass
+        else:
+            raise AssertionError("truncated bzip2 stream was read without an error")
+
+    def test_corrupt_xz(self):
+        if lzma is None:
+            raise SkipTest("lzma is not available")
+        data = lzma.compress(self.data)
+        self._truncated(data, XZ)
+        corrupt = data[:32] + '\xff' * 32 + data[64:]
+        try:
+            self._readall(corrupt, XZ)
+        except CompressionError:
+            pass
+        else:
+            raise AssertionError("corrupt xz data was read without an error")
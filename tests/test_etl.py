@@ -0,0 +1,99 @@
+import os, shutil, tempfile, multiprocessing
+from terane.sources.file import FileSource
+from terane.pipeline import parsenodespec
+from terane.toolbox.etl.etl import ETL
+from helpers import registerplugin, ExitingSource, MessageListSink
+
+class TestETL(object):
+
+    def setup(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def teardown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_multiple_files(self):
+        etl = ETL()
+        etl.sink = MessageListSink()
+        etl.sources = list()
+        etl.nodes = list()
+        etl.batchsize = 10
+        etl.workers = 2
+        expected = list()
+        for n in range(3):
+            path = os.path.join(self.tmpdir, "%i.log" % n)
+            with open(path, 'w') as f:
+                for i in range(100 * (n + 1)):
+                    f.write("file %i line %i\n" % (n, i))
+                    expected.append(u"file %i line %i" % (n, i))
+            source = FileSource()
+            source.path = path
+            etl.sources.append(source)
+        summaries = etl._runfiles()
+        assert sorted(etl.sink.events) == sorted(expected)
+        assert [summary.processed for summary in summaries] == [100, 200, 300]
+        assert [summary.error for summary in summaries] == [None, None, None]
+
+    def test_missing_file(self):
+        etl = ETL()
+        etl.sink = MessageListSink()
+        source = FileSource()
+        source.path = os.path.join(self.tmpdir, "missing.log")
+        etl.sources = [source]
+        etl.nodes = list()
+        etl.batchsize = 10
+        etl.workers = 1
+        summaries = etl._runfiles()
+        assert summaries[0].processed == 0
+        assert summaries[0].error != None
+
+    def _writefile(self, name, lines):
+        path = os.path.join(self.tmpdir, name)
+        with open(path, 'w') as f:
+            for i in range(lines):
+                f.write("line %i\n" % i)
+        source = FileSource()
+        source.path = path
+        return source
+
+    def test_worker_init_error(self):
+        registerplugin('workerinitfailing', 'helpers:WorkerInitFailingFilter')
+        etl = ETL()
+        etl.sink = MessageListSink()
+        etl.sources = [self._writefile("%i.log" % n, 10) for n in range(2)]
+        etl.nodes = list(parsenodespec('workerinitfailing'))
+        etl.batchsize = 10
+        etl.workers = 2
+        summaries = etl._runfiles()
+        assert etl.sink.events == []
+        assert ["init failed" in summary.error for summary in summaries] == [True, True]
+
+    def test_worker_exited(self):
+        etl = ETL()
+        etl.sink = MessageListSink()
+        etl.sources = [ExitingSource(), self._writefile("1.log", 10)]
+        etl.nodes = list()
+        etl.batchsize = 10
+        etl.workers = 2
+        summaries = etl._runfiles()
+        assert summaries[0].error == "worker exited unexpectedly"
+        assert summaries[1].processed == 10
+
+    def test_sink_init_error(self):
+        class FailingSink(MessageListSink):
+            def init(self):
+                raise Exception("init failed")
+        etl = ETL()
+        etl.sink = FailingSink()
+        etl.sources = [self._writefile("1.log", 10)]
+        etl.nodes = list()
+        etl.batchsize = 10
+        etl.workers = 2
+        try:
+            etl._runfiles()
+        except Exception, e:
+            assert str(e) == "init failed"
+        else:
+            raise AssertionError("_runfiles didn't fail")
+        # no worker processes were left behind
+        assert multiprocessing.active_children() == []
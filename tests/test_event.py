@@ -0,0 +1,210 @@
+import pickle
+from datetime import datetime
+from collections import Mapping
+from terane.event import FieldIdentifier, Event, CompactEvent, EventBatch, CoarseClock
+from terane.filters.enrich import EnrichFilter
+
+class TestFieldIdentifier(object):
+
+    def test_interned(self):
+        field = FieldIdentifier('message', FieldIdentifier.TEXT)
+        assert field is FieldIdentifier(u'message', FieldIdentifier.TEXT)
+        assert field is Event.MESSAGE
+        assert field is not FieldIdentifier('message', FieldIdentifier.LITERAL)
+
+    def test_hash_and_equality(self):
+        field = FieldIdentifier('foo', FieldIdentifier.INTEGER)
+        assert field == (u'foo', FieldIdentifier.INTEGER)
+        assert hash(field) == hash((u'foo', FieldIdentifier.INTEGER))
+        assert field != FieldIdentifier('bar', FieldIdentifier.INTEGER)
+        schema = {field: '1'}
+        assert FieldIdentifier('foo', FieldIdentifier.INTEGER) in schema
+        assert field.name == u'foo'
+        assert field.type == FieldIdentifier.INTEGER
+
+    def test_immutable(self):
+        field = FieldIdentifier('foo', FieldIdentifier.INTEGER)
+        try:
+            field.name = 'bar'
+        except AttributeError:
+            pass
+        else:
+            raise AssertionError("expected AttributeError")
+        try:
+            field.other = 'bar'
+        except AttributeError:
+            pass
+        else:
+            raise AssertionError("expected AttributeError")
+
+    def test_intern_bounded(self):
+        field = FieldIdentifier(u'untrusted', FieldIdentifier.TEXT, intern=False)
+        assert field == (u'untrusted', FieldIdentifier.TEXT)
+        assert field not in FieldIdentifier._interned
+        maxinterned = FieldIdentifier.MAXINTERNED
+        FieldIdentifier.MAXINTERNED = len(FieldIdentifier._interned)
+        try:
+            assert FieldIdentifier(u'overflow', FieldIdentifier.TEXT) == (u'overflow', FieldIdentifier.TEXT)
+            assert len(FieldIdentifier._interned) == FieldIdentifier.MAXINTERNED
+            assert FieldIdentifier('message', FieldIdentifier.TEXT) is Event.MESSAGE
+        finally:
+            FieldIdentifier.MAXINTERNED = maxinterned
+
+    def test_pickle(self):
+        field = FieldIdentifier.fromstring('foo', 'float')
+        for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+            assert pickle.loads(pickle.dumps(field, protocol)) is field
+
+class TestEvent(object):
+
+    def test_fields(self):
+        extra = FieldIdentifier('count', FieldIdentifier.INTEGER)
+        event = Event(Event.EMPTY_ID, {
+            Event.MESSAGE: "hello world",
+            Event.TIMESTAMP: 0.0,
+            extra: "42",
+            })
+        assert event.message() == u"hello world"
+        assert event.timestamp().year == 1970
+        assert event.integer('count') == 42
+        assert event[('count', FieldIdentifier.INTEGER)] == 42
+        assert extra in event
+        assert list(event.fields()) == [(extra, 42)]
+        for field in event.keys():
+            assert field is FieldIdentifier(field.name, field.type)
+        event.set(extra, 43)
+        assert event.get(extra) == 43
+        assert event.get(Event.SOURCE, None) == None
+
+    def test_fromparsed(self):
+        clock = CoarseClock(resolution=3600)
+        now = clock.now()
+        assert now.tzinfo is Event._utc
+        assert clock.now() is now
+        event = Event.fromparsed(Event.EMPTY_ID, {
+            Event.MESSAGE: u"hello world",
+            Event.TIMESTAMP: now,
+            })
+        assert event.message() == u"hello world"
+        assert event.timestamp() is now
+        assert pickle.loads(pickle.dumps(event)).timestamp() == now
+
+class TestCompactEvent(object):
+
+    def _values(self):
+        return {
+            Event.MESSAGE: "hello world",
+            Event.TIMESTAMP: 1000.0,
+            Event.ORIGIN: "localhost",
+            FieldIdentifier('count', FieldIdentifier.INTEGER): "42",
+            FieldIdentifier('ratio', FieldIdentifier.FLOAT): "0.5",
+            }
+
+    def test_matches_event(self):
+        event = Event(Event.EMPTY_ID, self._values())
+        compact = CompactEvent(Event.EMPTY_ID, self._values())
+        assert isinstance(compact, Mapping)
+        assert len(compact) == len(event)
+        assert set(compact.keys()) == set(event.keys())
+        assert compact == event
+        assert dict(compact.items()) == dict(event.items())
+        assert compact.message() == event.message()
+        assert compact.timestamp() == event.timestamp()
+        assert compact.integer('count') == 42
+        assert compact.source(None) == None
+        assert sorted(compact.fields()) == sorted(event.fields())
+
+    def test_lazy_parse(self):
+        compact = CompactEvent(Event.EMPTY_ID, self._values())
+        count = FieldIdentifier('count', FieldIdentifier.INTEGER)
+        assert count in compact
+        assert compact._values == None
+        assert compact.get(count) == 42
+        assert compact._values == {count: 42}
+        assert count not in compact._unparsed
+        assert count in compact
+
+    def test_set(self):
+        compact = CompactEvent(Event.EMPTY_ID, self._values())
+        count = FieldIdentifier('count', FieldIdentifier.INTEGER)
+        compact.set(count, 7)
+        compact.set(Event.SOURCE, u"syslog")
+        assert compact.integer('count') == 7
+        assert compact.source() == u"syslog"
+        assert len(compact) == 6
+        try:
+            compact.set(count, "not an int")
+        except TypeError:
+            pass
+        else:
+            raise AssertionError("expected TypeError")
+
+    def test_missing(self):
+        compact = CompactEvent(Event.EMPTY_ID, {Event.MESSAGE: "hello"})
+        assert len(compact) == 1
+        assert compact.get(Event.ORIGIN, None) == None
+        try:
+            compact.timestamp()
+        except KeyError:
+            pass
+        else:
+            raise AssertionError("expected KeyError")
+
+    def test_pickle(self):
+        compact = CompactEvent(Event.EMPTY_ID, self._values())
+        for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+            assert pickle.loads(pickle.dumps(compact, protocol)) == compact
+
+class TestEventBatch(object):
+
+    def _events(self):
+        count = FieldIdentifier('count', FieldIdentifier.INTEGER)
+        return [
+            Event(1, {Event.MESSAGE: "one", Event.TIMESTAMP: 1000.0, count: "1", Event.ORIGIN: "host1"}),
+            Event(2, {Event.MESSAGE: "two", Event.TIMESTAMP: 2000.0}),
+            Event(3, {Event.MESSAGE: "three", Event.TIMESTAMP: 3000.5, count: "3"}),
+            ]
+
+    def test_rows_match_events(self):
+        events = self._events()
+        batch = EventBatch(events)
+        assert len(batch) == 3
+        for event,row in zip(events, batch):
+            assert isinstance(row, Mapping)
+            assert row.id == event.id
+            assert row == event
+            assert row.message() == event.message()
+            assert row.timestamp() == event.timestamp()
+            assert row.integer('count', None) == event.integer('count', None)
+        assert list(batch.timestamps()) == [1000.0, 2000.0, 3000.5]
+        assert batch[-1].message() == u"three"
+
+    def test_columns(self):
+        batch = EventBatch(self._events())
+        count = FieldIdentifier('count', FieldIdentifier.INTEGER)
+        assert batch.column(count) == [1, None, 3]
+        batch.setcolumn(count, 0, override=False)
+        assert batch.column(count) == [1, 0, 3]
+        batch.setcolumn(count, 9)
+        assert batch.column(count) == [9, 9, 9]
+        batch.append(Event(4, {Event.MESSAGE: "four"}))
+        assert batch.column(count) == [9, 9, 9, None]
+        assert Event.TIMESTAMP not in batch[3]
+
+    def test_row_set(self):
+        batch = EventBatch(self._events())
+        row = batch[1]
+        row.set(Event.MESSAGE, u"deux")
+        assert batch.column(Event.MESSAGE) == [u"one", u"deux", u"three"]
+        assert batch.select([1, 2]).column(Event.MESSAGE) == [u"deux", u"three"]
+        events = batch.toevents()
+        assert [e.message() for e in events] == [u"one", u"deux", u"three"]
+        assert events[0].origin() == "host1"
+        assert Event.ORIGIN not in events[1]
+        assert events[0] == batch[0]
+
+    def test_enrich_filter_batch(self):
+        enrich = EnrichFilter('env', 'literal', 'prod')
+        enrich.init()
+        batch = enrich.filter_batch(EventBatch(self._events()))
+        assert [row.literal('env') for row in batch] == [u"prod"] * 3
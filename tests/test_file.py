@@ -0,0 +1,100 @@
+import os, shutil, tempfile
+from terane.sources.file import FileSource, StdinSource
+from terane.pipeline import Pipeline
+from helpers import MessageListSink
+
+class TestFileSource(object):
+
+    def setup(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'test.log')
+        self.lines = [u"line %i \xe9" % i for i in range(1000)]
+        with open(self.path, 'w') as f:
+            for line in self.lines:
+                f.write(line.encode('utf-8') + '\n')
+
+    def teardown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _run(self, **kwargs):
+        source = FileSource()
+        source.path = self.path
+        for name,value in kwargs.items():
+            setattr(source, name, value)
+        sink = MessageListSink()
+        Pipeline(source, sink).run()
+        return sink.events
+
+    def test_parallel_ordered(self):
+        events = self._run(workers=3, chunksize=100)
+        assert events == self._run()
+        assert events == self.lines
+
+    def test_parallel_unordered(self):
+        events = self._run(workers=3, chunksize=100, ordered=False)
+        assert sorted(events) == sorted(self.lines)
+
+    def test_parallel_skips_long_lines(self):
+        with open(self.path, 'w') as f:
+            f.write("short\n" + "x" * 100 + "\nafter\n\nlast\n")
+        events = self._run(workers=2, chunksize=16, linemax=32)
+        assert events == [u"short", u"after", u"last"]
+
+    def test_parallel_resume(self):
+        state = os.path.join(self.tmpdir, 'checkpoints')
+        source = FileSource()
+        source.path = self.path
+        source.workers = 2
+        source.chunksize = 100
+        source.checkpointfile = state
+        source.init()
+        for i in range(20):
+            source.emit()
+        source.commit(source.checkpoint())
+        source.fini()
+        events = self._run(workers=2, chunksize=100, checkpointfile=state)
+        # resumes from the start of the chunk which was partially emitted
+        assert len(events) < len(self.lines) - 10
+        assert events == self.lines[-len(events):]
+
+class TestStdinSource(object):
+
+    def setup(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'stdin')
+
+    def teardown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _source(self, data, **kwargs):
+        with open(self.path, 'wb') as f:
+            f.write(data)
+        source = StdinSource()
+        source.f = open(self.path, 'rb')
+        for name,value in kwargs.items():
+            setattr(source, name, value)
+        source.init()
+        return source
+
+    def test_binary_batches(self):
+        data = "".join("line %i \xc3\xa9\n" % i for i in range(1000))
+        source = self._source(data, binary=True, blocksize=37)
+        messages = list()
+        try:
+            while True:
+                messages.extend([event.message() for event in source.emit_batch(64)])
+        except StopIteration:
+            pass
+        assert messages == [u"line %i \xe9" % i for i in range(1000)]
+
+    def test_binary_skips_long_lines(self):
+        data = "short\n" + "x" * 100 + "\nafter\n\n" + "y" * 31 + "\nlast\nincomplete"
+        for blocksize in (7, 1024):
+            source = self._source(data, binary=True, blocksize=blocksize, linemax=32)
+            messages = list()
+            try:
+                while True:
+                    messages.append(source.emit().message())
+            except StopIteration:
+                pass
+            assert messages == [u"short", u"after", u"y" * 31, u"last"]
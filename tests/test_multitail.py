@@ -0,0 +1,85 @@
+import os, shutil, tempfile, threading
+from terane.sources.multitail import MultiTailSource
+
+class TestMultiTailSource(object):
+
+    def setup(self):
+        self.tmpdir = tempfile.mkdtemp()
+        for name in ('a.log', 'b.log'):
+            self._append(name, "existing\n")
+
+    def teardown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _path(self, name):
+        return os.path.join(self.tmpdir, name)
+
+    def _append(self, name, data):
+        with open(self._path(name), 'a') as f:
+            f.write(data)
+
+    def _source(self, inotify):
+        source = MultiTailSource()
+        source.pattern = os.path.join(self.tmpdir, '*.log')
+        source.sleeptime = 0.05
+        source.rescaninterval = 0.1
+        source.inotify = inotify
+        source.init()
+        return source
+
+    def _tail(self, inotify):
+        source = self._source(inotify)
+        try:
+            assert sorted(source.paths.keys()) == [self._path('a.log'), self._path('b.log')]
+            # existing files are read from the end
+            self._append('a.log', "a1\na2\na3\n")
+            self._append('b.log', "b1\n")
+            self._append('other.txt', "ignored\n")
+            events = [source.emit() for i in range(4)]
+            assert [e.message() for e in events] == [u"a1", u"b1", u"a2", u"a3"]
+            assert events[0].literal('path') == unicode(self._path('a.log'))
+            assert events[1].literal('path') == unicode(self._path('b.log'))
+            # new files are discovered and read from the beginning
+            threading.Timer(0.2, self._append, ('c.log', "c1\n")).start()
+            event = source.emit()
+            assert event.message() == u"c1"
+            assert event.literal('path') == unicode(self._path('c.log'))
+        finally:
+            source.fini()
+
+    def test_multitail_polling(self):
+        self._tail(False)
+
+    def test_multitail_inotify(self):
+        self._tail(True)
+
+    def test_emit_batch(self):
+        source = self._source(False)
+        try:
+            assert source.emit_batch(256) == []
+            self._append('a.log', "a1\na2\n")
+            self._append('b.log', "b1\n")
+            events = source.emit_batch(256)
+            assert sorted([e.message() for e in events]) == [u"a1", u"a2", u"b1"]
+            assert source.emit_batch(256) == []
+        finally:
+            source.fini()
+
+    def test_rotated_away_with_unread_lines(self):
+        source = self._source(False)
+        try:
+            self._append('a.log', "one\ntwo\nthree\n")
+            tail = source.paths[self._path('a.log')]
+            tail._fill()
+            os.rename(self._path('a.log'), self._path('a.old'))
+            # rescanning keeps the file while it has buffered lines
+            source._scan()
+            source._scan()
+            assert self._path('a.log') in source.paths
+            events = [source.emit() for i in range(3)]
+            assert [e.message() for e in events] == [u"one", u"two", u"three"]
+            # and stops tailing it once they have been read
+            source._scan()
+            assert self._path('a.log') not in source.paths
+        finally:
+            source.fini()
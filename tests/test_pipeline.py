@@ -0,0 +1,249 @@
+from terane.event import Event, EventBatch, FieldIdentifier
+from terane.filters.enrich import EnrichFilter
+from terane.parallel import WorkerError
+from terane.pipeline import Pipeline, ParallelPipeline, DropEvent, parsenodespec
+from helpers import registerplugin, ListSink, BatchListSink
+
+class ListSource(object):
+
+    def __init__(self, items):
+        self.items = list(items)
+
+    def init(self):
+        pass
+
+    def fini(self):
+        pass
+
+    def emit(self):
+        if len(self.items) == 0:
+            raise StopIteration
+        item = self.items.pop(0)
+        if item == None:
+            raise DropEvent("source dropped event")
+        return item
+
+class BatchListSource(ListSource):
+
+    def emit_batch(self, count):
+        if len(self.items) == 0:
+            raise StopIteration
+        batch = [item for item in self.items[:count] if item != None]
+        self.items = self.items[count:]
+        return batch
+
+class EventBatchSource(BatchListSource):
+
+    def emit_batch(self, count):
+        return EventBatch(BatchListSource.emit_batch(self, count))
+
+class IdleListSource(BatchListSource):
+    """
+    A source which has nothing to emit after each batch, recording how many
+    events the sink has consumed each time it is asked for a batch.
+    """
+
+    def __init__(self, items, sink):
+        BatchListSource.__init__(self, items)
+        self.sink = sink
+        self.idle = False
+        self.consumed = list()
+
+    def emit_batch(self, count):
+        if self.idle:
+            self.idle = False
+            return []
+        self.consumed.append(len(self.sink.events))
+        self.idle = True
+        return BatchListSource.emit_batch(self, count)
+
+class CheckpointListSource(ListSource):
+
+    def __init__(self, items, sink):
+        ListSource.__init__(self, items)
+        self.emitted = 0
+        self.sink = sink
+        self.commits = list()
+
+    def emit(self):
+        event = ListSource.emit(self)
+        self.emitted += 1
+        return event
+
+    def checkpoint(self):
+        return self.emitted
+
+    def commit(self, token):
+        self.commits.append((token, len(self.sink.events)))
+
+class OddFilter(object):
+
+    def init(self):
+        pass
+
+    def fini(self):
+        pass
+
+    def filter(self, event):
+        if event % 2 == 0:
+            raise DropEvent("even")
+        return event
+
+class BatchOddFilter(OddFilter):
+
+    def filter_batch(self, events):
+        return [event for event in events if event % 2 == 1]
+
+class FiniOrderSource(ListSource):
+
+    def __init__(self, items, order):
+        ListSource.__init__(self, items)
+        self.order = order
+
+    def fini(self):
+        self.order.append('source')
+
+class FiniOrderSink(ListSink):
+
+    def __init__(self, order):
+        ListSink.__init__(self)
+        self.order = order
+
+    def fini(self):
+        self.order.append('sink')
+
+class TestPipeline(object):
+
+    def test_run_per_event(self):
+        sink = ListSink()
+        pipeline = Pipeline(ListSource(range(10)), sink, [OddFilter()])
+        pipeline.run()
+        assert sink.events == [1, 3, 5, 7, 9]
+        assert pipeline.processed == 5
+        assert pipeline.dropped == 5
+
+    def test_run_batched_fallback(self):
+        sink = ListSink()
+        pipeline = Pipeline(ListSource([0, 1, None, 3, 4, 5, 6]), sink, [OddFilter()], batchsize=3)
+        pipeline.run()
+        assert sink.events == [1, 3, 5]
+        assert pipeline.processed == 3
+        assert pipeline.dropped == 4
+
+    def test_run_batched_hooks(self):
+        sink = BatchListSink()
+        pipeline = Pipeline(BatchListSource(range(10)), sink, [BatchOddFilter()], batchsize=4)
+        pipeline.run()
+        assert sink.events == [1, 3, 5, 7, 9]
+        assert sink.batches == 3
+        assert pipeline.processed == 5
+        assert pipeline.dropped == 5
+
+    def test_run_batched_mixed(self):
+        sink = BatchListSink()
+        pipeline = Pipeline(ListSource(range(10)), sink, [BatchOddFilter(), OddFilter()], batchsize=5)
+        pipeline.run()
+        assert sink.events == [1, 3, 5, 7, 9]
+        assert pipeline.processed == 5
+        assert pipeline.dropped == 5
+
+    def test_run_batched_columns(self):
+        events = [Event(Event.EMPTY_ID, {Event.MESSAGE: u"message %i" % i}) for i in range(10)]
+        sink = BatchListSink()
+        pipeline = Pipeline(EventBatchSource(events), sink, [EnrichFilter('env', 'literal', 'prod')], batchsize=4)
+        pipeline.run()
+        assert sink.batches == 3
+        assert [e.message() for e in sink.events] == [u"message %i" % i for i in range(10)]
+        assert [e.literal('env') for e in sink.events] == [u"prod"] * 10
+
+    def test_run_parallel_ordered(self):
+        sink = BatchListSink()
+        pipeline = ParallelPipeline(ListSource(range(100)), sink, [], workers=3, batchsize=7)
+        pipeline.run()
+        assert sink.events == range(100)
+        assert pipeline.processed == 100
+        assert pipeline.dropped == 0
+
+    def test_run_parallel_unordered(self):
+        sink = ListSink()
+        pipeline = ParallelPipeline(ListSource(range(100)), sink, [], workers=3, ordered=False, batchsize=7)
+        pipeline.run()
+        assert sorted(sink.events) == range(100)
+        assert pipeline.processed == 100
+
+    def test_run_parallel_idle_source(self):
+        # batches in flight are consumed while the source is idle, rather
+        # than being held back until it emits more events
+        for ordered in (True, False):
+            sink = ListSink()
+            source = IdleListSource(range(10), sink)
+            pipeline = ParallelPipeline(source, sink, [], workers=2, ordered=ordered, batchsize=3)
+            pipeline.run()
+            assert sorted(sink.events) == range(10)
+            assert source.consumed == [0, 3, 6, 9, 10]
+
+    def test_run_parallel_plugins(self):
+        registerplugin('enrich', 'terane.filters.enrich:EnrichFilter')
+        nodes = parsenodespec('enrich fieldname="count" fieldtype="integer" value="42"')
+        events = [Event(Event.EMPTY_ID, {Event.MESSAGE: u"message %i" % i}) for i in range(20)]
+        sink = BatchListSink()
+        pipeline = ParallelPipeline(ListSource(events), sink, nodes, workers=2, batchsize=3)
+        pipeline.run()
+        assert [e.message() for e in sink.events] == [u"message %i" % i for i in range(20)]
+        assert set([e.get(FieldIdentifier('count', FieldIdentifier.INTEGER)) for e in sink.events]) == set([42])
+
+    def _runfailing(self, spec, ordered=True):
+        sink = BatchListSink()
+        pipeline = ParallelPipeline(ListSource(range(20)), sink, parsenodespec(spec),
+            workers=2, ordered=ordered, batchsize=3)
+        try:
+            pipeline.run()
+        except Exception, e:
+            return e
+        raise AssertionError("pipeline didn't fail")
+
+    def test_run_parallel_config_error(self):
+        registerplugin('enrich', 'terane.filters.enrich:EnrichFilter')
+        e = self._runfailing('enrich fieldname="count" fieldtype="nosuchtype" value="42"')
+        assert isinstance(e, KeyError)
+
+    def test_run_parallel_failing_filter(self):
+        registerplugin('failing', 'helpers:FailingFilter')
+        for ordered in (True, False):
+            assert isinstance(self._runfailing('failing', ordered), WorkerError)
+
+    def test_run_parallel_worker_init_error(self):
+        registerplugin('workerinitfailing', 'helpers:WorkerInitFailingFilter')
+        for ordered in (True, False):
+            e = self._runfailing('workerinitfailing', ordered)
+            assert isinstance(e, WorkerError)
+            assert "init failed" in str(e)
+
+    def test_run_parallel_unpicklable_result(self):
+        registerplugin('unpicklable', 'helpers:UnpicklableFilter')
+        for ordered in (True, False):
+            assert self._runfailing('unpicklable', ordered) != None
+
+    def test_run_parallel_unordered_checkpoints(self):
+        registerplugin('sleepy', 'helpers:SleepyFilter')
+        sink = ListSink()
+        source = CheckpointListSource(range(100), sink)
+        pipeline = ParallelPipeline(source, sink, parsenodespec('sleepy'), workers=3, ordered=False, batchsize=5)
+        pipeline.run()
+        assert sorted(sink.events) == range(100)
+        tokens = [token for token,consumed in source.commits]
+        # a checkpoint is only committed once every event before it was consumed
+        assert tokens == sorted(tokens)
+        assert tokens[-1] == 100
+        assert len(tokens) > 1
+        for token,consumed in source.commits:
+            assert token <= consumed
+
+    def test_sink_fini_before_source(self):
+        for makepipeline in (
+          lambda source,sink: Pipeline(source, sink),
+          lambda source,sink: ParallelPipeline(source, sink, workers=2)):
+            order = list()
+            pipeline = makepipeline(FiniOrderSource(range(10), order), FiniOrderSink(order))
+            pipeline.run()
+            assert order == ['sink', 'source']
@@ -0,0 +1,551 @@
+import os, time, select, signal, socket, threading
+from datetime import datetime
+from dateutil.tz import tzutc
+from tornado.ioloop import IOLoop
+from terane.event import Event, FieldIdentifier
+from terane.pipeline import FilterChain
+from terane.plugin import IPlugin
+from terane.sinks.syslog import SyslogSink as BaseSyslogSink, SchemaTracker
+from terane.toolbox.relay.pipeline import RelayPipeline, makeevent
+from terane.toolbox.relay.rfc5424 import RFC5424Parser, ParseError
+from terane.toolbox.relay.server import TCPHandler, TCPSession, UDPHandler, kerneldrops
+from terane.toolbox.relay.sink import SyslogSink
+from terane.toolbox.relay.supervisor import Supervisor, bindreuseport
+from helpers import BatchCollectingSink
+
+COUNT = FieldIdentifier('count', FieldIdentifier.INTEGER)
+USER = FieldIdentifier('user', FieldIdentifier.LITERAL)
+
+def makeinput(i):
+    return Event(Event.EMPTY_ID, {
+        Event.MESSAGE: u"message %i" % i,
+        Event.ORIGIN: "host.example.com",
+        Event.TIMESTAMP: 1381000000000.0 + i,
+        BaseSyslogSink.APPNAME: u"app",
+        BaseSyslogSink.SEVERITY: u"err",
+        COUNT: i,
+        USER: u"user%i" % i,
+        })
+
+def parse(data):
+    return RFC5424Parser(fallback=False).parse(data)
+
+class Collector(threading.Thread):
+    def __init__(self):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.bind(('127.0.0.1', 0))
+        self.listener.listen(1)
+        self.port = self.listener.getsockname()[1]
+        self.data = ''
+        self.start()
+    def run(self):
+        conn,address = self.listener.accept()
+        while True:
+            data = conn.recv(65536)
+            if data == '':
+                break
+            self.data += data
+        conn.close()
+        self.listener.close()
+
+def frame(data):
+    return "%i %s" % (len(data), data)
+
+def newlineframe(data):
+    return data + "\n"
+
+_messages = [
+    '<34>1 2003-10-11T22:14:15.003Z mymachine.example.com su - ID47 - \xef\xbb\xbf\'su root\' failed',
+    '<165>1 2003-08-24T05:14:15.000003Z 192.0.2.1 myproc 8710 - - %% It\'s time to make the do-nuts.',
+    '<165>1 2003-10-11T22:14:15.003Z mymachine.example.com evntslog - ID47 [exampleSDID@32473 iut="3" eventSource="Application" eventID="1011"] \xef\xbb\xbfAn application event log entry...',
+    '<165>1 2003-10-11T22:14:15.003Z mymachine.example.com evntslog - ID47 [exampleSDID@32473 iut="3"][examplePriority@32473 class="high"]',
+    '<13>1 - - - - - -',
+    '<13>1 2013-10-05T19:06:40Z host app - - [a@1 q="say \\"hi\\"" b="back\\\\slash" c="close\\]" d=""] msg',
+    '<13>1 2013-10-05T19:06:40.5Z host app - - [a@1 u="\xe2\x98\x83"] \xef\xbb\xbf\xe2\x98\x83',
+    ]
+
+def fields(message):
+    return (message.prival, message.version, message.timestamp, message.hostname,
+        message.appname, message.procid, message.msgid, message.elements, message.msg)
+
+class TestRFC5424Parser(object):
+
+    def test_matches_loggerglue(self):
+        fast = RFC5424Parser(fallback=False)
+        strict = RFC5424Parser(strict=True)
+        for data in _messages:
+            assert fields(fast.parse(data)) == fields(strict.parse(data)), data
+
+    def test_parse(self):
+        message = RFC5424Parser().parse(_messages[5])
+        assert message.prival == 13
+        assert message.timestamp == datetime(2013, 10, 5, 19, 6, 40, 0, tzutc())
+        assert message.elements == [('a@1', [('q', u'say "hi"'), ('b', u'back\\slash'),
+                                             ('c', u'close]'), ('d', u'')])]
+        assert message.msg == u"msg"
+        message = RFC5424Parser().parse(_messages[4])
+        assert fields(message) == (13, 1, None, None, None, None, None, [], None)
+
+    def test_offsets(self):
+        data = "garbage" + _messages[0] + "garbage"
+        message = RFC5424Parser(fallback=False).parse(data, 7, 7 + len(_messages[0]))
+        assert message.msg == u"'su root' failed"
+        timestamp = RFC5424Parser().parse('<13>1 2013-10-05T21:36:40.25+02:30 h - - - -').timestamp
+        assert timestamp == datetime(2013, 10, 5, 19, 6, 40, 250000, tzutc())
+
+    def test_invalid(self):
+        for data in ('', '<13>', '<192>1 - - - - - -', '<13>1 - - - - - [a@1', '<13>1 - - - - - [a@1 b="c]',
+                     '<13>1 - - - - - [a@1 b=c]', '<13>1 - - - - -msg', '<13>1 2013-13-05T19:06:40Z - - - - -'):
+            for parser in (RFC5424Parser(fallback=False, rfc3164=False),
+                           RFC5424Parser(strict=True, rfc3164=False), RFC5424Parser(rfc3164=False)):
+                try:
+                    parser.parse(data)
+                except ParseError:
+                    continue
+                raise AssertionError("%s parsed invalid message %r" % (parser, data))
+
+    def test_rfc3164(self):
+        parser = RFC5424Parser()
+        message = parser.parse("<34>Oct  1 22:14:15 mymachine su[12]: 'su root' failed")
+        assert (message.prival, message.version) == (34, 0)
+        assert (message.timestamp.month, message.timestamp.day, message.timestamp.hour) == (10, 1, 22)
+        assert message.timestamp.tzinfo is not None
+        assert (message.hostname, message.appname, message.procid) == (u"mymachine", u"su", u"12")
+        assert message.msg == u"'su root' failed"
+        message = parser.parse("<13>no header at all")
+        assert (message.timestamp, message.hostname, message.appname) == (None, None, None)
+        assert message.msg == u"no header at all"
+        try:
+            RFC5424Parser(rfc3164=False).parse("<13>no header at all")
+        except ParseError:
+            pass
+        else:
+            raise AssertionError("parsed RFC 3164 message with rfc3164=False")
+
+class FakeStream(object):
+    def __init__(self):
+        self.isclosed = False
+    def set_close_callback(self, callback):
+        pass
+    def read_until_close(self, callback, streaming_callback):
+        self.eof = callback
+        self.received = streaming_callback
+    def closed(self):
+        return self.isclosed
+    def close(self):
+        self.isclosed = True
+
+class TestTCPSession(object):
+
+    def setup(self):
+        self.ioloop = IOLoop()
+        self.ioloop.make_current()
+        self.sink = BatchCollectingSink()
+        self.pipeline = RelayPipeline(FilterChain(list()), self.sink, batchsize=1)
+        self.pipeline.init()
+        self.stream = FakeStream()
+
+    def teardown(self):
+        IOLoop.clear_current()
+        self.ioloop.close(all_fds=True)
+
+    def makesession(self, maxframe=64 * 1024, maxbuffer=1024 * 1024):
+        return TCPSession(self.stream, ('127.0.0.1', 1), self.pipeline, RFC5424Parser(), maxframe, maxbuffer)
+
+    def messages(self):
+        return [batch[0].message() for batch in self.sink.batches]
+
+    def test_partial_frames(self):
+        encoder = BaseSyslogSink()
+        tracker = SchemaTracker(encoder._schemaparams)
+        data = ''.join([framing(tracker.assemble(encoder._format(makeinput(i))))
+                        for i in range(20) for framing in (frame, newlineframe)])
+        # deliver the data in chunks of every size, so frames are split
+        # at every possible offset
+        for chunksize in (1, 2, 3, 7, 64, len(data)):
+            self.sink.batches = list()
+            session = self.makesession()
+            for i in xrange(0, len(data), chunksize):
+                self.stream.received(data[i:i + chunksize])
+            self.stream.eof('')
+            assert self.messages() == [u"message %i" % i for i in range(20) for j in range(2)], chunksize
+            assert self.sink.batches[-1][0].get(COUNT) == 19
+            assert session.buffered == 0 and session.chunks == []
+            assert not self.stream.closed()
+
+    def test_crlf(self):
+        session = self.makesession()
+        self.stream.received('<13>1 - - - - - - one\r\n\n<13>1 - - - - - - two\n')
+        assert self.messages() == [u"one", u"two"]
+
+    def test_invalid_length(self):
+        session = self.makesession()
+        self.stream.received('12x45 <13>1 - - - - - -')
+        assert self.stream.closed()
+
+    def test_frame_too_large(self):
+        session = self.makesession(maxframe=100)
+        self.stream.received('101 ')
+        assert self.stream.closed()
+        self.stream = FakeStream()
+        session = self.makesession(maxframe=100)
+        self.stream.received('<13>1 - - - - - - ' + 'x' * 100)
+        assert self.stream.closed()
+
+    def test_length_too_long(self):
+        session = self.makesession()
+        self.stream.received('1' * 10)
+        assert not self.stream.closed()
+        self.stream.received('1')
+        assert self.stream.closed()
+
+    def test_unexpected_error(self):
+        class BrokenParser(RFC5424Parser):
+            def parse(self, data, start=0, end=None):
+                if data[start:end].endswith('broken'):
+                    raise RuntimeError("broken")
+                return RFC5424Parser.parse(self, data, start, end)
+        session = TCPSession(self.stream, ('127.0.0.1', 1), self.pipeline, BrokenParser())
+        self.stream.received('<13>1 - - - - - - broken\n<13>1 - - - - - - ok\n')
+        assert self.messages() == [u"ok"]
+        assert self.pipeline.dropped == 1
+        assert not self.stream.closed()
+
+    def test_chunks_joined_once(self):
+        session = self.makesession()
+        data = frame('<13>1 - - - - - - ' + 'x' * 10000)
+        for i in xrange(0, len(data) - 1, 100):
+            self.stream.received(data[i:min(i + 100, len(data) - 1)])
+        # the chunks are kept as they arrived until the frame is complete
+        assert len(session.chunks) == (len(data) - 1 + 99) // 100
+        assert session.needed == len(data)
+        self.stream.received(data[-1:])
+        assert self.messages() == [u'x' * 10000]
+        assert session.chunks == []
+
+    def test_newline_frame_too_large_in_chunks(self):
+        session = self.makesession(maxframe=100)
+        self.stream.received('<13>1 - - - - - - ')
+        for i in range(10):
+            self.stream.received('x' * 10)
+        assert self.stream.closed()
+
+    def test_buffer_exceeded(self):
+        session = self.makesession(maxframe=100, maxbuffer=50)
+        self.stream.received('90 <13>1 - - - - - - ' + 'x' * 40)
+        assert self.stream.closed()
+
+class TestRelay(object):
+
+    def setup(self):
+        self.ioloop = IOLoop()
+        self.ioloop.make_current()
+
+    def teardown(self):
+        IOLoop.clear_current()
+        self.ioloop.close(all_fds=True)
+
+    def test_makeevent(self):
+        sink = BaseSyslogSink()
+        tracker = SchemaTracker(sink._schemaparams)
+        schema = dict()
+        first = makeevent(parse(tracker.assemble(sink._format(makeinput(1)))), schema)
+        second = makeevent(parse(tracker.assemble(sink._format(makeinput(2)))), schema)
+        assert first.message() == u"message 1"
+        assert first.origin() == "host.example.com"
+        assert first.get(BaseSyslogSink.FACILITY) == u"daemon"
+        assert first.get(BaseSyslogSink.SEVERITY) == u"err"
+        assert first.get(BaseSyslogSink.APPNAME) == u"app"
+        assert first.get(COUNT) == 1
+        assert first.get(USER) == u"user1"
+        # the second message refers to the schema sent with the first
+        assert second.get(COUNT) == 2
+        assert second.get(USER) == u"user2"
+        assert second.timestamp() > first.timestamp()
+
+    def test_makeevent_invalid_values(self):
+        schema = dict()
+        message = parse('<13>1 - - - - - [schema@42785 c="integer:count" t="datetime:ts" u="literal:user"]'
+            '[values@42785 c="many" t="1e400" u="alice"] invalid values')
+        event = makeevent(message, schema)
+        assert event.message() == u"invalid values"
+        assert event.get(USER) == u"alice"
+        assert COUNT not in event
+
+    def test_makeevent_schema_limit(self):
+        schema = dict()
+        params = ' '.join(['f%i="literal:field%i"' % (i, i) for i in range(10)])
+        values = ' '.join(['f%i="%i"' % (i, i) for i in range(10)])
+        message = parse('<13>1 - - - - - [schema@42785 %s][values@42785 %s]' % (params, values))
+        event = makeevent(message, schema, maxfields=4)
+        assert sorted(schema.keys()) == ['f0', 'f1', 'f2', 'f3']
+        assert event.literal('field3') == u"3"
+        assert FieldIdentifier('field9', FieldIdentifier.LITERAL) not in event
+        assert schema['f0'] not in FieldIdentifier._interned
+
+    def test_batched_handoff(self):
+        sink = BatchCollectingSink()
+        pipeline = RelayPipeline(FilterChain(list()), sink, batchsize=4)
+        pipeline.init()
+        for i in range(10):
+            pipeline.put(makeinput(i))
+        self.ioloop.add_callback(self.ioloop.stop)
+        self.ioloop.start()
+        assert [len(batch) for batch in sink.batches] == [4, 4, 2]
+        assert pipeline.processed == 10
+
+    def test_batch_errors(self):
+        # a filter which fails on one event only drops that event
+        class FailingFilter(IPlugin):
+            def filter(self, event):
+                if event.get(COUNT) == 2:
+                    raise Exception("filter failed")
+                return event
+        sink = BatchCollectingSink()
+        pipeline = RelayPipeline(FilterChain([FailingFilter()]), sink, batchsize=4)
+        pipeline.init()
+        for i in range(4):
+            pipeline.put(makeinput(i))
+        assert [e.get(COUNT) for e in sink.batches[0]] == [0, 1, 3]
+        assert (pipeline.processed, pipeline.dropped) == (3, 1)
+        # a sink which fails drops the whole batch
+        def fail(events):
+            raise Exception("sink failed")
+        sink.consume_batch = fail
+        for i in range(4):
+            pipeline.put(makeinput(i))
+        assert (pipeline.processed, pipeline.dropped) == (3, 5)
+
+    def test_forward(self):
+        self._forward(frame)
+
+    def test_forward_newline_framing(self):
+        self._forward(newlineframe)
+
+    def _forward(self, framing):
+        collector = Collector()
+        sink = SyslogSink()
+        sink.args['address'] = ('127.0.0.1', collector.port)
+        pipeline = RelayPipeline(FilterChain(list()), sink)
+        pipeline.init()
+        handler = TCPHandler(pipeline)
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.bind(('127.0.0.1', 0))
+        listener.setblocking(0)
+        listener.listen(8)
+        handler.add_socket(listener)
+        encoder = BaseSyslogSink()
+        tracker = SchemaTracker(encoder._schemaparams)
+        data = ''.join([framing(tracker.assemble(encoder._format(makeinput(i)))) for i in range(100)])
+        client = socket.create_connection(listener.getsockname())
+        client.sendall(data)
+        client.close()
+        def check():
+            if pipeline.processed + pipeline.dropped == 100:
+                pipeline.drain(self.ioloop.stop)
+            else:
+                self.ioloop.add_timeout(self.ioloop.time() + 0.01, check)
+        self.ioloop.add_callback(check)
+        self.ioloop.add_timeout(self.ioloop.time() + 10, self.ioloop.stop)
+        self.ioloop.start()
+        handler.stop()
+        pipeline.fini()
+        collector.join(5)
+        assert pipeline.processed == 100
+        schema = dict()
+        events = list()
+        data = collector.data
+        while data != '':
+            length,data = data.split(' ', 1)
+            events.append(makeevent(parse(data[:int(length)]), schema))
+            data = data[int(length):]
+        assert len(events) == 100
+        assert [e.get(COUNT) for e in events] == range(100)
+        assert events[-1].get(USER) == u"user99"
+
+class TestUDPHandler(object):
+
+    def setup(self):
+        self.ioloop = IOLoop()
+        self.ioloop.make_current()
+
+    def teardown(self):
+        IOLoop.clear_current()
+        self.ioloop.close(all_fds=True)
+
+    def test_receive(self):
+        sink = BatchCollectingSink()
+        pipeline = RelayPipeline(FilterChain(list()), sink)
+        pipeline.init()
+        handler = UDPHandler(pipeline, rcvbuf=1024 * 1024, batchsize=8, maxsources=1)
+        handler.bind(0, '127.0.0.1')
+        handler.start()
+        encoder = BaseSyslogSink()
+        tracker = SchemaTracker(encoder._schemaparams)
+        client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        for i in range(50):
+            client.sendto(tracker.assemble(encoder._format(makeinput(i))), ('127.0.0.1', handler.port))
+        client.sendto("<13>Oct  5 19:06:40 host app: bsd message\n", ('127.0.0.1', handler.port))
+        client.sendto("not syslog", ('127.0.0.1', handler.port))
+        def check():
+            if pipeline.processed + pipeline.dropped >= 52:
+                self.ioloop.stop()
+            else:
+                self.ioloop.add_timeout(self.ioloop.time() + 0.01, check)
+        self.ioloop.add_callback(check)
+        self.ioloop.add_timeout(self.ioloop.time() + 10, self.ioloop.stop)
+        self.ioloop.start()
+        events = [event for batch in sink.batches for event in batch]
+        assert [e.get(COUNT) for e in events[:50]] == range(50)
+        assert events[50].message() == u"bsd message"
+        assert events[50].get(BaseSyslogSink.APPNAME) == u"app"
+        stats = handler.sources[('127.0.0.1', client.getsockname()[1])]
+        assert (stats.packets, stats.invalid) == (52, 1)
+        assert handler._source(('127.0.0.2', 514)) is handler.sources[UDPHandler.OTHER]
+        assert handler.sources[UDPHandler.OTHER].schema is None
+        assert kerneldrops(handler.socket) in (0, None)
+        handler.stop()
+        pipeline.fini()
+
+    def test_schema_per_source(self):
+        sink = BatchCollectingSink()
+        pipeline = RelayPipeline(FilterChain(list()), sink)
+        pipeline.init()
+        handler = UDPHandler(pipeline, rcvbuf=1024 * 1024, maxsources=2)
+        handler.bind(0, '127.0.0.1')
+        handler.start()
+        # each sender numbers its fields from 1, so both senders on this
+        # host describe a different field as field 1
+        clients = list()
+        for field in (COUNT, USER, COUNT):
+            client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            client.bind(('127.0.0.1', 0))
+            encoder = BaseSyslogSink()
+            clients.append((client, field, encoder, SchemaTracker(encoder._schemaparams)))
+        for i in range(2):
+            for client,field,encoder,tracker in clients:
+                value = i if field == COUNT else u"user%i" % i
+                event = Event(Event.EMPTY_ID, {Event.MESSAGE: u"message %i" % i, field: value})
+                client.sendto(tracker.assemble(encoder._format(event)), ('127.0.0.1', handler.port))
+        def check():
+            if pipeline.processed + pipeline.dropped >= 6:
+                self.ioloop.stop()
+            else:
+                self.ioloop.add_timeout(self.ioloop.time() + 0.01, check)
+        self.ioloop.add_callback(check)
+        self.ioloop.add_timeout(self.ioloop.time() + 10, self.ioloop.stop)
+        self.ioloop.start()
+        events = [event for batch in sink.batches for event in batch]
+        assert len(events) == 6
+        first = [e for e in events if COUNT in e and USER not in e]
+        second = [e for e in events if USER in e and COUNT not in e]
+        assert sorted([e.get(COUNT) for e in first]) == [0, 1]
+        assert sorted([e.get(USER) for e in second]) == [u"user0", u"user1"]
+        # the third sender is past maxsources, so its fields aren't decoded
+        other = [e for e in events if COUNT not in e and USER not in e]
+        assert sorted([e.message() for e in other]) == [u"message 0", u"message 1"]
+        handler.stop()
+        pipeline.fini()
+        for client,_,_,_ in clients:
+            client.close()
+
+def readlines(fd, count, timeout=10.0):
+    lines = list()
+    data = ''
+    deadline = time.time() + timeout
+    while len(lines) < count and time.time() < deadline:
+        if select.select([fd], [], [], 0.1)[0] == []:
+            continue
+        data += os.read(fd, 4096)
+        while '\n' in data:
+            line,data = data.split('\n', 1)
+            lines.append(line.split())
+    return lines
+
+class TestSupervisor(object):
+
+    def test_bindreuseport(self):
+        for socktype in (socket.SOCK_STREAM, socket.SOCK_DGRAM):
+            first = bindreuseport(0, socktype, '127.0.0.1')
+            port = first[0].getsockname()[1]
+            second = bindreuseport(port, socktype, '127.0.0.1')
+            assert second[0].getsockname()[1] == port
+            for sock in first + second:
+                sock.close()
+
+    def test_restart_and_drain(self):
+        rfd,wfd = os.pipe()
+        def worker(taskid):
+            os.close(rfd)
+            stopped = list()
+            signal.signal(signal.SIGTERM, lambda signum, frame: stopped.append(signum))
+            os.write(wfd, "start %i %i\n" % (taskid, os.getpid()))
+            while stopped == []:
+                time.sleep(0.01)
+            os.write(wfd, "stop %i %i\n" % (taskid, os.getpid()))
+            return 0
+        pid = os.fork()
+        if pid == 0:
+            status = 1
+            try:
+                status = Supervisor(2, worker, draintimeout=5.0).run()
+            finally:
+                os._exit(status)
+        os.close(wfd)
+        try:
+            started = readlines(rfd, 2)
+            assert sorted([int(taskid) for _,taskid,_ in started]) == [0, 1]
+            # a worker which dies is restarted with the same task id
+            os.kill(int(started[0][2]), signal.SIGKILL)
+            restarted = readlines(rfd, 1)
+            assert restarted[0][:2] == started[0][:2]
+            assert restarted[0][2] != started[0][2]
+            # stopping the supervisor stops every worker
+            os.kill(pid, signal.SIGTERM)
+            stopped = readlines(rfd, 2)
+            assert sorted([(int(taskid), int(p)) for _,taskid,p in stopped]) == sorted([
+                (int(restarted[0][1]), int(restarted[0][2])),
+                (int(started[1][1]), int(started[1][2]))])
+            _,status = os.waitpid(pid, 0)
+            assert os.WIFEXITED(status) and os.WEXITSTATUS(status) == 0
+        finally:
+            os.close(rfd)
+
+    def test_restart_during_backoff(self):
+        rfd,wfd = os.pipe()
+        def worker(taskid):
+            os.close(rfd)
+            os.write(wfd, "start %i %i\n" % (taskid, os.getpid()))
+            # worker 0 can't start, so it is restarted with an increasing delay
+            if taskid == 0:
+                return 1
+            while True:
+                time.sleep(0.01)
+        pid = os.fork()
+        if pid == 0:
+            status = 1
+            try:
+                status = Supervisor(2, worker, draintimeout=5.0).run()
+            finally:
+                os._exit(status)
+        os.close(wfd)
+        try:
+            # wait until worker 0 has been restarted once, and is waiting
+            # out its second, two second delay
+            started = readlines(rfd, 3)
+            assert sorted([int(taskid) for _,taskid,_ in started]) == [0, 0, 1]
+            worker1 = [p for _,taskid,p in started if taskid == '1'][0]
+            time.sleep(0.2)
+            # worker 1 has run for over a second, so it is restarted at once
+            killed = time.time()
+            os.kill(int(worker1), signal.SIGKILL)
+            restarted = readlines(rfd, 1)
+            assert restarted[0][1] == '1'
+            assert time.time() - killed < 1.0
+            os.kill(pid, signal.SIGTERM)
+            _,status = os.waitpid(pid, 0)
+            assert os.WIFEXITED(status) and os.WEXITSTATUS(status) == 0
+        finally:
+            os.close(rfd)
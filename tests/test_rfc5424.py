@@ -0,0 +1,54 @@
+from datetime import datetime
+from dateutil.tz import tzutc
+from loggerglue import constants
+from loggerglue.rfc5424 import SyslogEntry, SDElement, StructuredData
+from terane.sinks.rfc5424 import RFC5424Encoder, stringtoprival
+
+def loggerglue(prival, timestamp, hostname, appname, procid, msgid, elements, message):
+    sdata = None
+    if len(elements) > 0:
+        sdata = StructuredData([SDElement(sdid, params) for sdid,params in elements])
+    return str(SyslogEntry(prival=prival, timestamp=timestamp, hostname=hostname,
+        app_name=appname, procid=procid, msgid=msgid, structured_data=sdata, msg=message))
+
+class TestRFC5424Encoder(object):
+
+    def test_prival(self):
+        for facility in ('kern', 'daemon', 'local7', 'AUTHPRIV'):
+            for severity in ('emerg', 'info', 'Debug'):
+                expected = getattr(constants, "LOG_" + facility.upper()) \
+                    + getattr(constants, "LOG_" + severity.upper())
+                assert stringtoprival(facility, severity) == expected
+                assert stringtoprival(unicode(facility), unicode(severity)) == expected
+
+    def test_compatible(self):
+        encoder = RFC5424Encoder(cachesize=2)
+        utc = tzutc()
+        timestamps = [None, datetime(2013, 10, 5, 19, 6, 40, 123000, utc),
+                      datetime(2013, 1, 1, 0, 0, 0, 0, utc)]
+        headers = [(None, None, None, None),
+                   ("host.example.com", u"sshd", u"1234", u"ID47"),
+                   ("host.example.com", u"cron", None, None),
+                   ("other.example.com", u"sshd", u"99", None)]
+        elements = [[],
+                    [("values@42785", [("1", u"plain")])],
+                    [("schema@42785", [("1", "LITERAL:user"), ("2", "INTEGER:bytes")]),
+                     ("values@42785", [("1", u'quote " slash \\ bracket ]'), ("2", u"4096")])],
+                    [("values@42785", [("1", u""), ("2", u"]]]")])]]
+        messages = [None, u"hello world", "bytes message", u"unicode \u2603 message"]
+        count = 0
+        for timestamp in timestamps:
+            for hostname,appname,procid,msgid in headers:
+                for element in elements:
+                    for message in messages:
+                        for prival in (0, 30, 191):
+                            args = (prival, timestamp, hostname, appname, procid, msgid, element, message)
+                            assert encoder.encode(*args) == loggerglue(*args), args
+                            count += 1
+        assert count == 3 * 4 * 4 * 4 * 3
+
+    def test_utf8_values(self):
+        encoder = RFC5424Encoder()
+        encoded = encoder.encode(30, None, u"h\xf6st", None, None, None,
+            [("values@42785", [("1", u"\u2603")])], None)
+        assert encoded == '<30>1 - h\xc3\xb6st - - - [values@42785 1="\xe2\x98\x83"]'
@@ -0,0 +1,70 @@
+import os, shutil, tempfile
+from terane.sinks.spool import Spool
+
+class TestSpool(object):
+
+    def setup(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'spool')
+
+    def teardown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _drain(self, spool, maxbytes=100):
+        msgs = list()
+        while True:
+            batch = spool.read(maxbytes)
+            if len(batch) == 0:
+                return msgs
+            spool.commit()
+            msgs.extend(batch)
+
+    def test_fifo_across_segments(self):
+        spool = Spool(self.path, segmentsize=64)
+        assert spool.empty()
+        msgs = ["message %i" % i for i in range(50)]
+        assert spool.append(msgs[:20]) == 20
+        assert spool.read(30) == msgs[:3]
+        # not committed, so the same messages are read again
+        assert spool.read(30) == msgs[:3]
+        spool.commit()
+        for msg in msgs[20:]:
+            spool.append([msg])
+        assert len(os.listdir(self.path)) > 1
+        assert not spool.empty()
+        assert self._drain(spool) == msgs[3:]
+        assert spool.empty()
+        assert spool.size == 0
+        assert os.listdir(self.path) == []
+        spool.close()
+
+    def test_size_cap(self):
+        spool = Spool(self.path, maxsize=100)
+        assert spool.append(["x" * 40, "y" * 40, "z" * 40]) == 2
+        assert spool.append(["z" * 40]) == 0
+        assert self._drain(spool) == ["x" * 40, "y" * 40]
+        assert spool.append(["z" * 40]) == 1
+        spool.close()
+
+    def test_reopen(self):
+        spool = Spool(self.path, segmentsize=64)
+        msgs = ["message %i" % i for i in range(20)]
+        spool.append(msgs)
+        spool.close()
+        spool = Spool(self.path, segmentsize=64)
+        assert not spool.empty()
+        spool.append(["last"])
+        assert self._drain(spool) == msgs + ["last"]
+        spool.close()
+
+    def test_truncated_segment(self):
+        spool = Spool(self.path)
+        spool.append(["one", "two"])
+        spool.close()
+        segment = os.path.join(self.path, os.listdir(self.path)[0])
+        with open(segment, 'ab') as f:
+            f.write("\x00\x00\x00\x10par")
+        spool = Spool(self.path)
+        assert self._drain(spool) == ["one", "two"]
+        assert spool.empty()
+        spool.close()
@@ -0,0 +1,51 @@
+import dateutil.parser
+from datetime import datetime
+from dateutil.tz import tzutc
+from terane.event import Event
+from terane.filters.syslog_format import SyslogFormatFilter
+from terane.sinks.syslog import SyslogSink
+from terane.pipeline import DropEvent
+
+def makeevent(line):
+    return Event(Event.EMPTY_ID, {Event.MESSAGE: line, Event.TIMESTAMP: 0.0})
+
+class TestSyslogFormatFilter(object):
+
+    def _filter(self, **params):
+        f = SyslogFormatFilter()
+        f.year = params.get('year', None)
+        f.timezone = params.get('timezone', None)
+        f._tz = f._gettz(f.timezone)
+        f.init()
+        return f
+
+    def test_parse_line(self):
+        f = self._filter()
+        event = f.filter(makeevent(u"Oct  7 12:01:02 host sshd[123]: Accepted publickey"))
+        assert event.timestamp() == dateutil.parser.parse("Oct  7 12:01:02")
+        assert event.origin() == u"host"
+        assert event.get(SyslogSink.APPNAME) == u"sshd"
+        assert event.get(SyslogSink.PROCID) == u"123"
+        assert event.message() == u"Accepted publickey"
+
+    def test_fast_path_matches_dateutil(self):
+        f = self._filter(year=2013)
+        for ts in ("Jan  1 00:00:00", "Feb 28 23:59:59", "Dec 31 12:30:45", "Jun 15 06:07:08"):
+            assert f._parsetimestamp(ts) == dateutil.parser.parse(ts, default=datetime(2013, 1, 1))
+
+    def test_cache_and_fallback(self):
+        f = self._filter(year=2012, timezone='utc')
+        first = f._parsetimestamp("Feb 29 01:02:03")
+        assert first == datetime(2012, 2, 29, 1, 2, 3, tzinfo=tzutc())
+        assert f._parsetimestamp("Feb 29 01:02:03") is first
+        # unexpected month abbreviation is handled by dateutil
+        assert f._parsetimestamp("FEB 29 01:02:03") == first
+
+    def test_invalid_timestamp(self):
+        f = self._filter(year=2013)
+        try:
+            f.filter(makeevent(u"Feb 30 01:02:03 host sshd: hello"))
+        except DropEvent:
+            pass
+        else:
+            raise AssertionError("expected DropEvent")
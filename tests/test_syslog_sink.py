@@ -0,0 +1,237 @@
+import os, time, shutil, socket, tempfile, threading
+from ConfigParser import RawConfigParser
+from terane.event import Event, FieldIdentifier
+from loggerglue.emitter import TCPSyslogEmitter
+from terane.sinks.syslog import SyslogSink, SyslogSender, SchemaTracker
+from terane.sinks.spool import Spool
+from terane.settings import Section
+
+class Collector(threading.Thread):
+    """
+    Accepts a single TCP connection and collects everything sent on it.
+    """
+    def __init__(self, port=0):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listener.bind(('127.0.0.1', port))
+        self.listener.listen(1)
+        self.port = self.listener.getsockname()[1]
+        self.data = ''
+        self.start()
+
+    def run(self):
+        conn,address = self.listener.accept()
+        while True:
+            data = conn.recv(65536)
+            if data == '':
+                break
+            self.data += data
+        conn.close()
+        self.listener.close()
+
+    def frames(self):
+        self.join(5)
+        frames = list()
+        data = self.data
+        while data != '':
+            length,data = data.split(' ', 1)
+            frames.append(data[:int(length)])
+            data = data[int(length):]
+        return frames
+
+def freeport():
+    """
+    Return a port which nothing is listening on.
+    """
+    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    s.bind(('127.0.0.1', 0))
+    port = s.getsockname()[1]
+    s.close()
+    return port
+
+def makesink(options):
+    config = RawConfigParser()
+    config.add_section('sink')
+    for name,value in options.items():
+        config.set('sink', name, value)
+    sink = SyslogSink()
+    sink.configure(Section('sink', config, os.getcwd()))
+    return sink
+
+def makeevent(i):
+    return Event(Event.EMPTY_ID, {
+        Event.MESSAGE: u"message %i" % i,
+        Event.ORIGIN: "host.example.com",
+        Event.TIMESTAMP: 1381000000000.0 + i,
+        FieldIdentifier('count', FieldIdentifier.INTEGER): i,
+        })
+
+def makemixedevent(i):
+    """
+    Return an event resembling a parsed web server, sshd or cron log line.
+    """
+    values = {
+        Event.MESSAGE: u"message %i" % i,
+        Event.ORIGIN: "host.example.com",
+        Event.TIMESTAMP: 1381000000000.0 + i,
+        }
+    kind = i % 3
+    if kind == 0:
+        values[FieldIdentifier('method', FieldIdentifier.LITERAL)] = u"GET"
+        values[FieldIdentifier('path', FieldIdentifier.LITERAL)] = u"/index.html"
+        values[FieldIdentifier('status', FieldIdentifier.INTEGER)] = 200
+        values[FieldIdentifier('bytes', FieldIdentifier.INTEGER)] = 1000 + i
+        values[FieldIdentifier('agent', FieldIdentifier.TEXT)] = u"Mozilla/5.0"
+    elif kind == 1:
+        values[FieldIdentifier('user', FieldIdentifier.LITERAL)] = u"user%i" % (i % 7)
+        values[FieldIdentifier('address', FieldIdentifier.LITERAL)] = u"10.0.0.%i" % (i % 250)
+        values[FieldIdentifier('port', FieldIdentifier.INTEGER)] = 22
+    else:
+        values[FieldIdentifier('command', FieldIdentifier.TEXT)] = u"run-parts /etc/cron.hourly"
+        values[FieldIdentifier('user', FieldIdentifier.LITERAL)] = u"root"
+    return Event(Event.EMPTY_ID, values)
+
+class TestSchemaTracker(object):
+
+    def test_bytes_per_event(self):
+        sink = makesink({})
+        msgs = [sink._format(makemixedevent(i)) for i in range(3000)]
+        everytime = SchemaTracker(sink._schemaparams, 0)
+        once = SchemaTracker(sink._schemaparams)
+        before = sum([len(everytime.assemble(msg)) for msg in msgs]) / float(len(msgs))
+        after = sum([len(once.assemble(msg)) for msg in msgs]) / float(len(msgs))
+        # the schema makes up a large fraction of each message
+        assert after < before * 0.75, "%.1f -> %.1f bytes per event" % (before, after)
+
+    def test_announce_once(self):
+        sink = makesink({})
+        tracker = SchemaTracker(sink._schemaparams)
+        first = tracker.assemble(sink._format(makeevent(0)))
+        second = tracker.assemble(sink._format(makeevent(1)))
+        assert '[schema@42785 1="INTEGER:count"][values@42785 1="0"]' in first
+        assert 'schema@42785' not in second
+        assert '[values@42785 1="1"]' in second
+        tracker.reset()
+        third = tracker.assemble(sink._format(makeevent(2)))
+        assert '[schema@42785 1="INTEGER:count"]' in third
+
+    def test_interval(self):
+        sink = makesink({})
+        tracker = SchemaTracker(sink._schemaparams, 0)
+        for i in range(3):
+            assert 'schema@42785' in tracker.assemble(sink._format(makeevent(i)))
+        tracker = SchemaTracker(sink._schemaparams, 3600)
+        assert 'schema@42785' in tracker.assemble(sink._format(makeevent(0)))
+        assert 'schema@42785' not in tracker.assemble(sink._format(makeevent(1)))
+        tracker.expires = time.time()
+        assert 'schema@42785' in tracker.assemble(sink._format(makeevent(2)))
+
+    def test_no_structured_data(self):
+        sink = makesink({})
+        tracker = SchemaTracker(sink._schemaparams)
+        event = Event(Event.EMPTY_ID, {Event.MESSAGE: u"hello", Event.ORIGIN: "host"})
+        assert tracker.assemble(sink._format(event)) == '<30>1 - host - - - - \xef\xbb\xbfhello'
+
+class TestSyslogSink(object):
+
+    def test_sync_send(self):
+        collector = Collector()
+        sink = makesink({'host': 'syslog.tcp://127.0.0.1:%i' % collector.port})
+        sink.init()
+        for i in range(10):
+            sink.consume(makeevent(i))
+        sink.fini()
+        frames = collector.frames()
+        assert len(frames) == 10
+        assert 'schema@42785' in frames[0]
+        assert len([f for f in frames if 'schema@42785' in f]) == 1
+
+    def test_async_send(self):
+        collector = Collector()
+        sink = makesink({'host': 'syslog.tcp://127.0.0.1:%i' % collector.port,
+                         'async': 'true', 'send size': '1024'})
+        sink.init()
+        for i in range(500):
+            sink.consume(makeevent(i))
+        sink.fini()
+        frames = collector.frames()
+        assert len(frames) == 500
+        assert frames[0].endswith(u"message 0".encode('utf-8'))
+        assert frames[-1].endswith(u"message 499".encode('utf-8'))
+
+    def test_sender_drop(self):
+        sender = SyslogSender(TCPSyslogEmitter, {}, queuesize=1, block=False)
+        assert sender.put("one") == True
+        assert sender.put("two") == False
+
+    def test_spool_while_down(self):
+        port = freeport()
+        tmpdir = tempfile.mkdtemp()
+        try:
+            sink = makesink({'host': 'syslog.tcp://127.0.0.1:%i' % port,
+                             'spool directory': os.path.join(tmpdir, 'spool'),
+                             'queue size': '10'})
+            sink.init()
+            for i in range(100):
+                sink.consume(makeevent(i))
+            collector = Collector(port)
+            deadline = time.time() + 10
+            while not sink.sender.spool.empty() or not sink.sender.queue.empty():
+                assert time.time() < deadline
+                time.sleep(0.1)
+            sink.fini()
+            frames = collector.frames()
+            assert len(frames) == 100
+            assert sorted(frames) == sorted(set(frames))
+            # spooled messages are replayed with their schema
+            assert all(['[schema@42785 1="INTEGER:count"]' in f for f in frames])
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_replay_reannounces_schema(self):
+        collector = Collector()
+        tmpdir = tempfile.mkdtemp()
+        try:
+            # a message spooled by an earlier process, which numbered its fields differently
+            spool = Spool(os.path.join(tmpdir, 'spool'))
+            old = '<14>1 - - - - - [schema@42785 1="LITERAL:other"][values@42785 1="x"] old'
+            spool.append(["%i %s" % (len(old), old)])
+            sink = makesink({'host': 'syslog.tcp://127.0.0.1:%i' % collector.port})
+            sender = SyslogSender(sink.factory, sink.args, spool=spool,
+                tracker=SchemaTracker(sink._schemaparams))
+            sender.write([sink._format(makeevent(1))])
+            sender._replay()
+            sender.write([sink._format(makeevent(2))])
+            sender.close()
+            spool.close()
+            frames = collector.frames()
+            assert len(frames) == 3
+            assert frames[1] == old
+            assert '[schema@42785 1="INTEGER:count"]' in frames[2]
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_multiple_hosts(self):
+        collectors = [Collector(), Collector()]
+        sink = makesink({'host': ', '.join(['syslog.tcp://127.0.0.1:%i' % c.port for c in collectors])})
+        assert sink.background == True
+        sink.init()
+        for i in range(100):
+            sink.consume(makeevent(i))
+        sink.fini()
+        frames = [collector.frames() for collector in collectors]
+        assert len(frames[0]) == 50
+        assert len(frames[1]) == 50
+
+    def test_multiple_hosts_failover(self):
+        collector = Collector()
+        sink = makesink({'host': 'syslog.tcp://127.0.0.1:%i, syslog.tcp://127.0.0.1:%i' % (freeport(), collector.port),
+                         'distribution': 'least-loaded'})
+        sink.init()
+        for i in range(100):
+            sink.consume(makeevent(i))
+        sink.fini()
+        assert len(collector.frames()) == 100
+        assert sink.leastloaded == True
@@ -0,0 +1,126 @@
+import os, shutil, tempfile, threading, time
+from terane.sources.tail import TailSource
+from terane.pipeline import Pipeline
+from helpers import BatchListSink
+
+class StoppingSink(BatchListSink):
+    """
+    A sink which records the size of each batch, and stops the pipeline
+    after consuming count events.
+    """
+
+    def __init__(self, count):
+        BatchListSink.__init__(self)
+        self.count = count
+        self.sizes = list()
+
+    def consume_batch(self, events):
+        BatchListSink.consume_batch(self, events)
+        self.sizes.append(len(events))
+        if len(self.events) >= self.count:
+            raise StopIteration
+
+class TestTailSource(object):
+
+    def setup(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'test.log')
+        with open(self.path, 'w') as f:
+            f.write("existing line\n")
+
+    def teardown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _source(self, inotify):
+        source = TailSource()
+        source.path = self.path
+        source.sleeptime = 0.05
+        source.inotify = inotify
+        source.init()
+        return source
+
+    def _append(self, data, path=None):
+        with open(path or self.path, 'a') as f:
+            f.write(data)
+
+    def _tail(self, inotify):
+        source = self._source(inotify)
+        try:
+            # the first read starts at the end of the file
+            threading.Timer(0.2, self._append, ("first\n",)).start()
+            assert source.emit().message() == u"first"
+            self._append("second\nthird\n")
+            assert source.emit().message() == u"second"
+            assert source.emit().message() == u"third"
+            # rotate the file
+            os.rename(self.path, self.path + '.1')
+            self._append("rotated\n")
+            assert source.emit().message() == u"rotated"
+            # truncate the file
+            with open(self.path, 'w') as f:
+                pass
+            threading.Timer(0.2, self._append, ("truncated\n",)).start()
+            assert source.emit().message() == u"truncated"
+        finally:
+            source.fini()
+
+    def test_tail_polling(self):
+        self._tail(False)
+
+    def test_tail_inotify(self):
+        self._tail(True)
+
+    def test_emit_batch(self):
+        source = self._source(False)
+        try:
+            # the batch holds the lines which are available, without waiting
+            # for it to fill
+            assert source.emit_batch(256) == []
+            self._append("one\ntwo\nthree\n")
+            assert [e.message() for e in source.emit_batch(256)] == [u"one", u"two", u"three"]
+            self._append("four\nfive\n")
+            assert [e.message() for e in source.emit_batch(1)] == [u"four"]
+            assert [e.message() for e in source.emit_batch(256)] == [u"five"]
+            assert source.emit_batch(256) == []
+        finally:
+            source.fini()
+
+    def test_run_batched(self):
+        # lines are consumed as they arrive, rather than once a batch fills
+        source = self._source(False)
+        sink = StoppingSink(4)
+        threading.Timer(0.2, self._append, ("one\ntwo\nthree\n",)).start()
+        threading.Timer(0.5, self._append, ("four\n",)).start()
+        Pipeline(source, sink, batchsize=256).run()
+        assert [e.message() for e in sink.events] == [u"one", u"two", u"three", u"four"]
+        assert sink.sizes == [3, 1]
+
+    def test_block_reads(self):
+        source = self._source(False)
+        source.linemax = 16
+        source.blocksize = 8
+        source.init()
+        try:
+            threading.Timer(0.2, self._append, ("one\n" + "x" * 40 + "\ntwo\n" + "y" * 20,)).start()
+            assert source.emit().message() == u"one"
+            # the long line is skipped
+            assert source.emit().message() == u"two"
+            # the trailing long line is skipped once its newline arrives
+            threading.Timer(0.2, self._append, ("\nthree\n",)).start()
+            assert source.emit().message() == u"three"
+        finally:
+            source.fini()
+
+    def test_inotify_wakeup(self):
+        source = self._source(True)
+        source.sleeptime = 5
+        try:
+            if source.watcher is None:
+                return
+            timer = threading.Timer(0.5, self._append, ("wakeup\n",))
+            started = time.time()
+            timer.start()
+            assert source.emit().message() == u"wakeup"
+            assert time.time() - started < 2
+        finally:
+            source.fini()